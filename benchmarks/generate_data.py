@@ -0,0 +1,158 @@
+"""
+Synthetic Data Generator for Secure Function Benchmarks
+
+Generates guest value tables and host formula tables of any size, in the
+same format as ``examples/create_test_data.py``.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def generate_values(
+    num_rows: int, num_cols: int, seed: int = 0, scale: float = 100.0, decimals: int = 2
+):
+    """
+    Guest values: an ``id`` column plus ``num_cols`` numeric columns
+
+    Parameters
+    ----------
+    num_rows : int
+        Number of rows
+    num_cols : int
+        Number of value columns, named ``x0``, ``x1``, ...
+    seed : int
+        Random seed
+    scale : float
+        Values are drawn uniformly from ``[-scale, scale]``
+    decimals : int
+        Decimals the values are rounded to, 0 for integral values
+    """
+    rng = np.random.default_rng(seed)
+    data = {"id": [f"id_{i}" for i in range(num_rows)]}
+    for j in range(num_cols):
+        data[f"x{j}"] = np.round(rng.uniform(-scale, scale, num_rows), decimals)
+    return pd.DataFrame(data)
+
+
+def _random_formula(rng, columns, max_terms: int) -> str:
+    num_terms = int(rng.integers(1, min(max_terms, len(columns)) + 1))
+    terms = []
+    for col in rng.choice(columns, size=num_terms, replace=False):
+        coef = int(rng.integers(1, 6))
+        sign = "-" if rng.random() < 0.3 else "+"
+        term = col if coef == 1 else f"{coef}*{col}"
+        terms.append(f"{sign}{term}")
+    formula = "".join(terms).lstrip("+")
+    if rng.random() < 0.3:
+        formula += f"+{int(rng.integers(1, 100))}"
+    return formula
+
+
+def generate_formulas(
+    num_formulas: int,
+    columns: list,
+    dup_ratio: float = 0.0,
+    max_terms: int = 3,
+    seed: int = 0,
+):
+    """
+    Host formulas: linear combinations with integer coefficients
+
+    Parameters
+    ----------
+    num_formulas : int
+        Number of formula rows
+    columns : list
+        Guest columns the formulas may reference
+    dup_ratio : float
+        Fraction of rows that repeat an earlier formula verbatim
+    max_terms : int
+        Maximum columns referenced by one formula
+    seed : int
+        Random seed
+    """
+    if not 0.0 <= dup_ratio < 1.0:
+        raise ValueError(f"dup_ratio must be in [0, 1), got {dup_ratio}")
+    rng = np.random.default_rng(seed)
+
+    num_unique = max(1, num_formulas - int(round(num_formulas * dup_ratio)))
+    unique = [_random_formula(rng, columns, max_terms) for _ in range(num_unique)]
+    formulas = unique + [
+        unique[int(rng.integers(0, num_unique))]
+        for _ in range(num_formulas - num_unique)
+    ]
+    rng.shuffle(formulas)
+    return pd.DataFrame(
+        {"id": [f"formula_{i}" for i in range(num_formulas)], "formula": formulas}
+    )
+
+
+def generate_coefficients(
+    num_outputs: int,
+    columns: list,
+    dup_ratio: float = 0.0,
+    seed: int = 0,
+):
+    """
+    Host coefficient table for ``formula_type="matrix"``: one row of integer
+    weights per output, one column per guest column
+
+    Parameters
+    ----------
+    num_outputs : int
+        Number of output rows
+    columns : list
+        Guest columns, one coefficient column each
+    dup_ratio : float
+        Fraction of rows that repeat an earlier row
+    seed : int
+        Random seed
+    """
+    if not 0.0 <= dup_ratio < 1.0:
+        raise ValueError(f"dup_ratio must be in [0, 1), got {dup_ratio}")
+    rng = np.random.default_rng(seed)
+
+    num_unique = max(1, num_outputs - int(round(num_outputs * dup_ratio)))
+    weights = rng.integers(-5, 6, size=(num_unique, len(columns)))
+    # Every output references at least one column
+    weights[weights.any(axis=1) == 0, 0] = 1
+    rows = np.concatenate(
+        [weights, weights[rng.integers(0, num_unique, num_outputs - num_unique)]]
+    )
+    rng.shuffle(rows)
+    df = pd.DataFrame(rows, columns=columns)
+    df.insert(0, "id", [f"output_{i}" for i in range(num_outputs)])
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate secure_func benchmark data")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--cols", type=int, default=4)
+    parser.add_argument("--formulas", type=int, default=8)
+    parser.add_argument("--dup-ratio", type=float, default=0.0)
+    parser.add_argument("--max-terms", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "data"))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    values = generate_values(args.rows, args.cols, seed=args.seed)
+    formulas = generate_formulas(
+        args.formulas,
+        [col for col in values.columns if col != "id"],
+        dup_ratio=args.dup_ratio,
+        max_terms=args.max_terms,
+        seed=args.seed,
+    )
+    values.to_csv(os.path.join(args.out, "guest_values.csv"), index=False)
+    formulas.to_csv(os.path.join(args.out, "host_formula.csv"), index=False)
+    print(f"Wrote {len(values)} rows x {args.cols} columns and {len(formulas)} formulas to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Cold-Import Benchmark for Secure Function Component
+
+FATE imports ``fate_secure_func.secure_func`` through the
+``fate.ext.component_desc`` entry point whenever it lists components or
+spawns a task process, whether or not the task is ``secure_func``. This
+script times that import in fresh interpreters against the imports every
+FATE component pays anyway (``fate.arch`` and ``fate.components.core``),
+checks that no role implementation or heavy dependency is loaded with it,
+and fails when the overhead exceeds the budget.
+
+Example:
+    python import_time.py --repeat 5 --budget-ms 50 --top 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Overhead over the FATE component imports, in milliseconds
+DEFAULT_BUDGET_MS = 50.0
+
+BASELINE = "from fate.arch import Context; from fate.components.core import cpn, params"
+TARGET = "import fate_secure_func.secure_func"
+
+# Loaded only when a guest or host task runs
+LAZY_MODULES = [
+    "fate_secure_func.secure_func_guest",
+    "fate_secure_func.secure_func_host",
+    "fate.arch.dataframe",
+    "torch",
+    "pandas",
+    "numpy",
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def measure(statements: list, repeat: int) -> list:
+    """
+    Median time of every statement over ``repeat`` fresh interpreters each;
+    the statements take turns so that disk caches favour none of them
+    """
+    probes = [_PROBE.format(statement=s, lazy=LAZY_MODULES) for s in statements]
+    runs = [[] for _ in statements]
+    for _ in range(repeat):
+        for probe, probe_runs in zip(probes, runs):
+            out = subprocess.check_output(
+                [sys.executable, "-c", probe], env=_env(), text=True
+            )
+            probe_runs.append(json.loads(out.strip().splitlines()[-1]))
+    return [
+        {
+            "seconds": statistics.median(run["seconds"] for run in probe_runs),
+            "loaded": probe_runs[0]["loaded"],
+        }
+        for probe_runs in runs
+    ]
+
+
+def slowest_imports(statement: str, top: int) -> list:
+    """(self microseconds, module) of the slowest imports, from -X importtime"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        modules.append((int(self_us), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold-import budget")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    baseline, target = measure([BASELINE, TARGET], args.repeat)
+    overhead_ms = (target["seconds"] - baseline["seconds"]) * 1000
+    # Modules FATE itself already loads are not ours to defer
+    eager = [m for m in target["loaded"] if m not in baseline["loaded"]]
+
+    print(f"FATE component imports: {baseline['seconds'] * 1000:8.1f} ms")
+    print(f"fate_secure_func:       {target['seconds'] * 1000:8.1f} ms")
+    print(f"overhead:               {overhead_ms:8.1f} ms (budget {args.budget_ms:.1f} ms)")
+    if eager:
+        print(f"eagerly loaded: {', '.join(eager)}")
+    if args.top:
+        for self_us, name in slowest_imports(TARGET, args.top):
+            print(f"{self_us / 1000:8.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "baseline_seconds": baseline["seconds"],
+                    "import_seconds": target["seconds"],
+                    "overhead_ms": overhead_ms,
+                    "budget_ms": args.budget_ms,
+                    "eagerly_loaded": eager,
+                },
+                f,
+                indent=2,
+            )
+
+    if eager or overhead_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Secure Function Benchmark Harness
+
+Runs guest and host of ``secure_func`` in one process over a loopback
+federation, on synthetic data, for every HE kind and key length asked for.
+Both parties are driven through their public ``encrypt_and_send`` /
+``receive_and_decrypt`` and ``eval`` calls. Key setup, encryption, host
+evaluation, decryption and result join are taken from the phase metrics
+the parties record themselves; loopback delivery is free, so transfer time
+is modelled from the bytes moved and reported as ``transfer_modelled``.
+Every run checks the decrypted results against the formulas evaluated in
+plaintext and records the largest absolute error. The results are written as
+JSON so runs of different versions can be compared.
+
+The synthetic values match ``--encoding``: integral for "integer", with
+``--encoding-precision`` decimals for "fixed_point". mock, which FATE's
+configuration disallows, is enabled for the harness's own runs as an
+unencrypted baseline. OU has no negative plaintexts and runs only with
+``--pack``; combinations that cannot run are recorded as skipped.
+
+Example:
+    python run_benchmark.py --rows 20000 --cols 8 --formulas 16 \\
+        --dup-ratio 0.25 --kinds mock,paillier,ou --pack --key-lengths 1024,2048
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Run from a source checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from fate.arch.config import cfg
+from fate.arch.dataframe import PandasReader
+
+from fate_secure_func import __version__
+from fate_secure_func.encoding import ValueEncoding
+from fate_secure_func.secure_func_guest import SecureFuncGuest
+from fate_secure_func.secure_func_host import SecureFuncHost
+from fate_secure_func.selection import select_scheme
+
+from generate_data import generate_coefficients, generate_formulas, generate_values
+from loopback import create_loopback_contexts
+
+# Reported phase -> phase of the guest's metrics
+GUEST_PHASES = {
+    "key_setup": "key_setup",
+    "encryption": "encryption",
+    "decryption": "decryption",
+    "result_join": "result_join",
+}
+
+# Reported phase -> phase of the hosts' metrics, the slowest host counts
+HOST_PHASES = {
+    "host_evaluation": "evaluation",
+}
+
+
+def _phase_seconds(metrics: dict, phase: str) -> float:
+    """Wall seconds of a phase in ``PhaseMetrics.dict()``, 0 if not recorded"""
+    return metrics.get("phases", {}).get(phase, {}).get("wall_seconds", 0.0)
+
+
+def unsupported(kind: str, args) -> str:
+    """Why ``kind`` cannot run with the given options, None if it can"""
+    if kind == "ou" and not args.pack:
+        return "ou has no negative plaintexts, run it with --pack"
+    return None
+
+
+def expected_results(values_df, formula_df, formula_type: str):
+    """Plaintext results of every formula, indexed by the value ids"""
+    values = values_df.set_index("id")
+    if formula_type == "matrix":
+        weights = formula_df.set_index("id")
+        data = values[weights.columns].to_numpy() @ weights.to_numpy().T
+        return values.iloc[:, :0].assign(**dict(zip(weights.index, data.T)))
+    columns = {col: values[col].to_numpy() for col in values.columns}
+    results = {
+        idx: np.broadcast_to(eval(text, {}, dict(columns)), len(values))
+        for idx, text in zip(formula_df["id"], formula_df["formula"])
+    }
+    return values.iloc[:, :0].assign(**results)
+
+
+def max_abs_error(result_df, expected) -> float:
+    """Largest absolute difference of decrypted and plaintext results"""
+    result = result_df.set_index("id").loc[expected.index, expected.columns]
+    diff = result.to_numpy(dtype=np.float64) - expected.to_numpy(dtype=np.float64)
+    return float(np.abs(diff).max()) if diff.size else 0.0
+
+
+class FormulaFrame:
+    """
+    Host formula table for the harness
+
+    ``SecureFuncHost.eval`` only reads ``shape`` and ``as_pd_df()``, and a
+    string-valued FATE DataFrame needs a reader job to build.
+    """
+
+    def __init__(self, df):
+        self._df = df
+
+    @property
+    def shape(self):
+        return self._df.shape
+
+    def as_pd_df(self):
+        return self._df.copy()
+
+
+def run_once(
+    values_df, formula_df, expected, kind, key_length, options, host_options, args
+) -> dict:
+    """Run one guest/host job and return its per-phase measurements"""
+    hub, contexts = create_loopback_contexts(
+        num_hosts=args.hosts, data_dir=args.data_dir
+    )
+    guest_ctx, *host_ctxs = contexts.values()
+    values = PandasReader(
+        match_id_name="id", dtype="float64", partition=args.partitions
+    ).to_frame(guest_ctx, values_df.copy())
+    # The formula catalogue is dealt round-robin over the hosts
+    host_formulas = [
+        FormulaFrame(formula_df.iloc[h :: len(host_ctxs)].reset_index(drop=True))
+        for h in range(len(host_ctxs))
+    ]
+
+    outcome = {}
+
+    def guest():
+        he_options = {"kind": kind, "key_length": key_length}
+        if kind == "auto":
+            he_options = select_scheme(
+                guest_ctx.cipher.phe,
+                args.min_security_bits,
+                ValueEncoding(args.encoding, args.encoding_precision),
+                pack=args.pack,
+                cache_path=args.he_benchmark_path,
+            )
+            outcome["selected"] = he_options
+        guest_ctx.cipher.set_phe(guest_ctx.device, he_options)
+        sfg = SecureFuncGuest(guest_ctx, **options)
+        sfg.encrypt_and_send(values)
+        result = sfg.receive_and_decrypt()
+        outcome["output_rows"] = result.shape[0]
+        outcome["guest_metrics"] = sfg.metrics.dict()
+        outcome["result"] = result
+
+    def host(h):
+        sfh = SecureFuncHost(host_ctxs[h], **host_options)
+        sfh.eval(host_formulas[h])
+        outcome.setdefault("host_metrics", {})[h] = sfh.metrics.dict()
+
+    def run(role, target, *args):
+        try:
+            target(*args)
+        except BaseException as e:
+            outcome.setdefault("error", f"{role}: {e!r}")
+            hub.abort(f"{role} failed")
+
+    # The harness's mock runs are an unencrypted baseline, FATE disallows mock
+    allow_mock = (
+        cfg.temp_override({"safety.phe.mock.allow": True})
+        if kind == "mock"
+        else contextlib.nullcontext()
+    )
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run, args=("guest", guest))] + [
+        threading.Thread(target=run, args=(f"host {h}", host, h))
+        for h in range(len(host_ctxs))
+    ]
+    with allow_mock:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    total = time.perf_counter() - start
+
+    result = outcome.pop("result", None)
+    if result is not None:
+        outcome["max_abs_error"] = max_abs_error(result.as_pd_df(), expected)
+
+    bytes_sent = defaultdict(int)
+    for event in hub.events:
+        if event["op"] == "push":
+            bytes_sent[event["party"]] += event["bytes"]
+    transfer_bytes = sum(bytes_sent.values())
+
+    guest_metrics = outcome.get("guest_metrics", {})
+    host_metrics = list(outcome.get("host_metrics", {}).values())
+    phases = {
+        phase: round(_phase_seconds(guest_metrics, name), 6)
+        for phase, name in GUEST_PHASES.items()
+    }
+    for phase, name in HOST_PHASES.items():
+        phases[phase] = round(
+            max((_phase_seconds(metrics, name) for metrics in host_metrics), default=0.0),
+            6,
+        )
+    # Loopback delivery is free, not measured but modelled from the bytes moved
+    phases["transfer_modelled"] = round(
+        transfer_bytes * 8 / (args.bandwidth_mbps * 1e6), 6
+    )
+
+    record = {
+        "kind": kind,
+        "key_length": key_length,
+        "rows": len(values_df),
+        "cols": len(values_df.columns) - 1,
+        "formulas": len(formula_df),
+        "hosts": len(host_ctxs),
+        "distinct_formulas": len(formula_df.drop(columns=["id"]).drop_duplicates()),
+        "dup_ratio": args.dup_ratio,
+        "options": options,
+        "host_options": host_options,
+        "total_seconds": round(total, 6),
+        "phases": phases,
+        "bytes_guest_to_host": bytes_sent["guest"],
+        "bytes_host_to_guest": bytes_sent["host"],
+        "messages": sum(1 for event in hub.events if event["op"] == "push"),
+        "rows_per_second": round(len(values_df) / total, 3) if total > 0 else None,
+    }
+    record.update(outcome)
+    return record
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark secure_func locally")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--cols", type=int, default=4)
+    parser.add_argument("--formulas", type=int, default=8)
+    parser.add_argument("--dup-ratio", type=float, default=0.0)
+    parser.add_argument("--max-terms", type=int, default=3)
+    parser.add_argument("--kinds", default="mock,paillier")
+    parser.add_argument("--key-lengths", default="1024,2048")
+    parser.add_argument("--min-security-bits", type=int, default=112)
+    parser.add_argument("--he-benchmark-path", default=None)
+    parser.add_argument("--encrypt-mode", default="local", choices=["local", "partition"])
+    parser.add_argument("--chunk-size", type=int, default=0)
+    parser.add_argument("--pack", action="store_true")
+    parser.add_argument(
+        "--encoding", default="float", choices=["float", "integer", "fixed_point"]
+    )
+    parser.add_argument("--encoding-precision", type=int, default=2)
+    parser.add_argument(
+        "--formula-type", default="expression", choices=["expression", "matrix"]
+    )
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--spill-path", default=None)
+    parser.add_argument("--hosts", type=int, default=1)
+    parser.add_argument("--bandwidth-mbps", type=float, default=1000.0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="/tmp")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # Integer encoding needs integral values, fixed_point keeps its decimals
+    decimals = {"integer": 0, "fixed_point": args.encoding_precision}.get(args.encoding, 2)
+    values_df = generate_values(args.rows, args.cols, seed=args.seed, decimals=decimals)
+    columns = [col for col in values_df.columns if col != "id"]
+    if args.formula_type == "matrix":
+        formula_df = generate_coefficients(
+            args.formulas, columns, dup_ratio=args.dup_ratio, seed=args.seed
+        )
+    else:
+        formula_df = generate_formulas(
+            args.formulas,
+            columns,
+            dup_ratio=args.dup_ratio,
+            max_terms=args.max_terms,
+            seed=args.seed,
+        )
+    expected = expected_results(values_df, formula_df, args.formula_type)
+    options = {
+        "encrypt_mode": args.encrypt_mode,
+        "chunk_size": args.chunk_size,
+        "pack": args.pack,
+        "encoding": args.encoding,
+        "encoding_precision": args.encoding_precision,
+        "spill_path": args.spill_path,
+    }
+    host_options = {
+        "formula_type": args.formula_type,
+        "eval_partitions": args.partitions,
+        "spill_path": args.spill_path,
+    }
+
+    results = []
+    for kind in args.kinds.split(","):
+        for key_length in [int(k) for k in args.key_lengths.split(",")]:
+            reason = unsupported(kind, args)
+            if reason is not None:
+                results.append(
+                    {"kind": kind, "key_length": key_length, "options": options, "skipped": reason}
+                )
+                print(f"{kind:>8} {key_length:>5}: skipped, {reason}")
+                continue
+            for repeat in range(args.repeat):
+                record = run_once(
+                    values_df,
+                    formula_df,
+                    expected,
+                    kind,
+                    key_length,
+                    options,
+                    host_options,
+                    args,
+                )
+                record["repeat"] = repeat
+                results.append(record)
+                status = record.get("error") or (
+                    f"{record['total_seconds']:.3f}s, "
+                    f"max error {record['max_abs_error']:.3g}"
+                )
+                print(f"{kind:>8} {key_length:>5} #{repeat}: {status}")
+
+    report = {
+        "meta": {
+            "version": __version__,
+            "git_commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "bandwidth_mbps": args.bandwidth_mbps,
+            "partitions": args.partitions,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
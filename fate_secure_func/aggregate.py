@@ -0,0 +1,82 @@
+"""
+Aggregate Formulas for Secure Function Component
+
+An aggregate formula such as ``sum(2*x - y)`` or ``mean(x) by region`` is
+evaluated row by row like any other formula, then reduced on the host by
+homomorphic addition: rows are scattered into one accumulator per group
+(the native ``i_update`` of the FATE evaluators), chunk and block partials
+are added up, across computing partitions by the engine's ``reduce``, and
+only one ciphertext per group goes back to the guest.
+
+Group columns stay on the guest. Hosts only receive the group index of
+every row, so they learn which rows share a group but not its value.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def group_codes(column: pd.Series):
+    """
+    Group index of every row and the group labels, in sorted label order
+
+    Rows with a missing label get index ``len(labels)``, outside any group.
+    """
+    codes, labels = pd.factorize(column, sort=True)
+    codes = np.where(codes < 0, len(labels), codes).astype(np.int64)
+    return codes, labels
+
+
+def group_sums(column, codes: np.ndarray, num_groups: int):
+    """
+    Per-group sums of an encrypted column
+
+    Parameters
+    ----------
+    column : PHETensor
+        Encrypted values of the rows
+    codes : np.ndarray
+        Group index of every row; ``num_groups`` collects rows to be left out
+    num_groups : int
+        Number of groups
+
+    Returns
+    -------
+    PHETensor
+        One ciphertext per group
+    """
+    evaluator = column.evaluator
+    sums = evaluator.zeros(num_groups + 1, column.dtype)
+    positions = np.asarray(codes, dtype=np.int64).reshape(-1, 1).tolist()
+    evaluator.i_update(column.pk, sums, column.data, positions, 1)
+    return column.with_template(
+        evaluator.slice(sums, 0, num_groups), shape=torch.Size([num_groups])
+    )
+
+
+def add_aggregates(left: dict, right: dict) -> dict:
+    """Add two dicts of partial aggregates, keys missing on one side are kept"""
+    merged = dict(left)
+    for key, value in right.items():
+        merged[key] = merged[key] + value if key in merged else value
+    return merged
+
+
+def finish_aggregate(func: str, sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Decrypted group sums to the values of the aggregate function"""
+    if func == "mean":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sums / counts
+    return sums
+
+
+def broadcast(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Value of its group for every row, NaN for rows outside any group"""
+    if (codes >= len(values)).any():
+        values = np.append(values.astype(np.float64), np.nan)
+    return values[codes]
@@ -0,0 +1,183 @@
+"""
+Checkpoints for Secure Function Component
+
+A long "local" mode job keeps what it has completed in ``checkpoint_path``
+so that a retried task resumes instead of starting over: the guest keeps
+its encryption kit, the wire-encoded values of every encrypted chunk and
+the decrypted results of every chunk and host; every host keeps the
+encoded results and partial aggregates of every evaluated chunk. Chunk
+files are keyed by the key fingerprint, a digest of the job's inputs and
+the chunk index, so a retry only reuses chunks of the same key, values,
+columns, chunking and formulas. The guest does not know the host formulas,
+so its decrypted results are also keyed by the digest of the formulas each
+host reports.
+
+On a retry the hosts report their formula digest and the chunks they have
+kept, and the guest sends every host one action per chunk:
+
+- ``"evaluate"``: the guest sends the values (re-read from its checkpoint,
+  not encrypted again), the host evaluates and returns the result
+- ``"resend"``: the host returns its kept result without receiving values
+- ``"skip"``: the guest already decrypted the chunk of this host under the
+  same formulas, nothing is exchanged; the host adds its kept partial aggregates, if any
+
+Both parties remove the chunk files of a job once their side completed.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+
+import pandas as pd
+
+from .keystore import GuestKeyStore, _atomic_dump, _private_dir
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ACTIONS = ["evaluate", "resend", "skip"]
+
+
+def checkpoint_digest(*parts) -> str:
+    """Digest of the inputs a job's chunks depend on"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            part = pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes()
+        elif not isinstance(part, bytes):
+            part = repr(part).encode()
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()[:32]
+
+
+def checkpoint_keys(path: str) -> GuestKeyStore:
+    """Store of the guest's kit, so that a retried job keeps its key"""
+    return GuestKeyStore(os.path.join(path, "keys"))
+
+
+def resume_actions(decrypted: set, kept: set, aggregates: bool, num_chunks: int) -> list:
+    """
+    Action of every chunk for one host
+
+    Parameters
+    ----------
+    decrypted : set
+        Chunks of this host the guest has decrypted results of, under the
+        host's current formulas
+    kept : set
+        Chunks the host has kept results of
+    aggregates : bool
+        Whether the host has aggregate formulas, whose partial sums of a
+        chunk have to be kept or evaluated again
+    num_chunks : int
+        Chunks of the job
+    """
+    actions = []
+    for i in range(num_chunks):
+        if i in decrypted and (i in kept or not aggregates):
+            actions.append("skip")
+        elif i in kept:
+            actions.append("resend")
+        else:
+            actions.append("evaluate")
+    return actions
+
+
+class _ChunkCheckpoint:
+    def __init__(self, path: str, fingerprint: str, digest: str, private: bool):
+        self.path = os.path.join(path, fingerprint, digest)
+        if private:
+            _private_dir(self.path)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read(self, name: str):
+        path = self._file(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _write(self, name: str, obj):
+        _atomic_dump(obj, self._file(name))
+
+    def clear(self):
+        """Remove the chunk files of the job"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.info(f"Removed checkpoint {self.path}")
+
+
+class GuestCheckpoint(_ChunkCheckpoint):
+    """
+    Guest-local encrypted and decrypted chunks of one job
+
+    Parameters
+    ----------
+    path : str
+        Directory of the checkpoints, created if missing; keep it private to
+        the guest
+    fingerprint : str
+        Fingerprint of the job's key
+    digest : str
+        ``checkpoint_digest`` of the job's inputs
+    """
+
+    def __init__(self, path: str, fingerprint: str, digest: str):
+        super().__init__(path, fingerprint, digest, True)
+
+    def load_values(self, i: int):
+        """Encoded values of chunk ``i``, or None"""
+        return self._read(f"values-{i}")
+
+    def save_values(self, i: int, payload: dict):
+        self._write(f"values-{i}", payload)
+
+    def decrypted(self, num_chunks: int, host_digests: list) -> list:
+        """Chunks with decrypted results, per host and its formula digest"""
+        return [
+            {
+                i
+                for i in range(num_chunks)
+                if os.path.exists(self._file(f"decrypted-{i}-{h}-{digest}"))
+            }
+            for h, digest in enumerate(host_digests)
+        ]
+
+    def load_decrypted(self, i: int, h: int, digest: str) -> dict:
+        return self._read(f"decrypted-{i}-{h}-{digest}")
+
+    def save_decrypted(self, i: int, h: int, digest: str, values: dict):
+        self._write(f"decrypted-{i}-{h}-{digest}", values)
+
+
+class HostCheckpoint(_ChunkCheckpoint):
+    """
+    Host-local results of the evaluated chunks of one job
+
+    Parameters
+    ----------
+    path : str
+        Directory of the checkpoints, created if missing
+    fingerprint : str
+        Fingerprint of the guest's key
+    digest : str
+        ``checkpoint_digest`` of the job's inputs
+    """
+
+    def __init__(self, path: str, fingerprint: str, digest: str):
+        super().__init__(path, fingerprint, digest, False)
+
+    def chunks(self, num_chunks: int) -> list:
+        """Chunks with kept results"""
+        return [i for i in range(num_chunks) if os.path.exists(self._file(f"result-{i}"))]
+
+    def load(self, i: int):
+        """Encoded results and partial aggregates of chunk ``i``"""
+        return self._read(f"result-{i}")
+
+    def save(self, i: int, result: dict, aggregates: dict):
+        self._write(f"result-{i}", (result, aggregates))
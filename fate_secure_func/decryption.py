@@ -0,0 +1,158 @@
+"""
+Parallel Decryption for Secure Function Component
+
+Splits encrypted result columns into row ranges and decrypts the ranges as
+tasks of a computing-engine table, so decryption runs on every partition
+(process) the engine has instead of on the driver alone.
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+from .packing import PackedCiphertext
+
+logger = logging.getLogger(__name__)
+
+# Rows per decryption task, small enough to balance, large enough to amortize
+DEFAULT_DECRYPT_BATCH_SIZE = 4096
+
+
+def num_rows(tensor) -> int:
+    """Number of rows of an encrypted result column"""
+    if isinstance(tensor, PackedCiphertext):
+        return tensor.num_rows
+    return tensor.shape[0]
+
+
+def slice_rows(tensor, start: int, size: int):
+    """
+    Rows ``start:start + size`` of an encrypted result column
+
+    Packed columns can only be cut between ciphertexts, so ``start`` must be
+    a multiple of ``layout.pack_num`` for them.
+    """
+    if isinstance(tensor, PackedCiphertext):
+        pack_num = tensor.layout.pack_num
+        if start % pack_num:
+            raise ValueError(f"Packed slice start {start} is not a multiple of {pack_num}")
+        data = tensor.evaluator.slice(tensor.data, start // pack_num, -(-size // pack_num))
+        return PackedCiphertext(
+            tensor.pk, tensor.evaluator, tensor.coder, tensor.layout, data, size, tensor.weight
+        )
+
+    stride = tensor.shape[1:].numel()
+    data = tensor.evaluator.slice(tensor.data, start * stride, size * stride)
+    return tensor.with_template(data, shape=torch.Size([size, *tensor.shape[1:]]))
+
+
+def decrypt_column(tensor, decryptor, sk, packer=None) -> np.ndarray:
+    """
+    Decrypt (and unpack) one encrypted column to a NumPy array
+
+    Integer columns stay int64, everything else becomes float64.
+    """
+    if packer is not None:
+        decrypted = packer.decrypt(sk, tensor)
+    else:
+        decrypted = decryptor.decrypt_tensor(tensor)
+    decrypted = decrypted.detach().numpy()
+    if decrypted.dtype.kind in "iu":
+        return decrypted.astype(np.int64, copy=False)
+    return decrypted.astype(np.float64, copy=False)
+
+
+class ParallelDecryptor:
+    """
+    Decrypt result columns in row batches across computing partitions
+
+    The raw FATE Paillier/OU private keys already decrypt with the CRT
+    (modulo p and q separately), so the speed-up here comes from running
+    batches on all partitions at once; every batch is one call into the
+    native vector decryption.
+
+    Parameters
+    ----------
+    ctx : Context
+        FATE context, its computing engine runs the decryption tasks
+    decryptor : PHETensorDecryptor
+        Tensor decryptor of the encryption kit
+    sk
+        Raw private key, used for packed results
+    packer : Packer, optional
+        Packer of the guest values, when they were packed
+    num_partitions : int
+        Partitions to spread the batches over, 1 decrypts on the driver
+    batch_size : int
+        Rows per decryption task
+    """
+
+    def __init__(
+        self,
+        ctx,
+        decryptor,
+        sk,
+        packer=None,
+        num_partitions: int = 1,
+        batch_size: int = DEFAULT_DECRYPT_BATCH_SIZE,
+    ):
+        self.ctx = ctx
+        self.decryptor = decryptor
+        self.sk = sk
+        self.packer = packer
+        self.num_partitions = max(1, num_partitions)
+        self.batch_size = batch_size
+        if packer is not None:
+            # batches must start on a ciphertext boundary
+            pack_num = packer.layout.pack_num
+            self.batch_size = max(pack_num, batch_size - batch_size % pack_num)
+
+    def _tasks(self, en_results: dict) -> List[Tuple[Tuple[int, int], object]]:
+        tasks = []
+        for key, tensor in en_results.items():
+            total = num_rows(tensor)
+            for start in range(0, total, self.batch_size):
+                size = min(self.batch_size, total - start)
+                tasks.append(((key, start), slice_rows(tensor, start, size)))
+        return tasks
+
+    def decrypt(self, en_results: Dict[int, object]) -> Dict[int, np.ndarray]:
+        """
+        Decrypt a dict of encrypted result columns
+
+        Parameters
+        ----------
+        en_results : dict
+            Result key -> encrypted column
+
+        Returns
+        -------
+        dict
+            Result key -> NumPy array of the decrypted rows
+        """
+        decryptor, sk, packer = self.decryptor, self.sk, self.packer
+
+        total_rows = sum(num_rows(tensor) for tensor in en_results.values())
+        if self.num_partitions == 1 or total_rows <= self.batch_size:
+            return {
+                key: decrypt_column(tensor, decryptor, sk, packer)
+                for key, tensor in en_results.items()
+            }
+
+        tasks = self._tasks(en_results)
+        partitions = min(self.num_partitions, len(tasks))
+        decrypted = (
+            self.ctx.computing.parallelize(tasks, include_key=True, partition=partitions)
+            .mapValues(lambda tensor: decrypt_column(tensor, decryptor, sk, packer))
+            .collect()
+        )
+
+        batches = {key: [] for key in en_results}
+        for (key, start), values in sorted(decrypted, key=lambda kv: kv[0]):
+            batches[key].append(values)
+        logger.info(
+            f"Decrypted {total_rows} values in {len(tasks)} batches on {partitions} partitions"
+        )
+        return {key: np.concatenate(parts) for key, parts in batches.items()}
@@ -0,0 +1,186 @@
+"""
+Value Encoding for Secure Function Component
+
+By default guest values are encrypted as floats, which the FATE coders turn
+into a mantissa and a per-ciphertext exponent that every homomorphic
+operation has to align. Integer and fixed-point values can instead be
+encrypted as int64 plaintexts: ``"integer"`` takes the values as they are,
+``"fixed_point"`` scales them by ``10**precision`` first. Host formulas then
+run on exact integers, provided their coefficients are integers, and
+results come back as int64 (``"integer"``) or as the scaled integers divided
+by ``10**precision`` (``"fixed_point"``).
+
+The guest sends the bit length of its largest (scaled) value; the host
+bounds every formula result with it and refuses to evaluate a plan that
+could overflow int64 or the plaintext space of the key.
+"""
+
+import math
+import logging
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from .formula import FormulaPlan, LinearExpr
+from .packing import plaintext_bits
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ["float", "integer", "fixed_point"]
+
+# Results are decrypted into int64
+MAX_INT_BITS = 63
+
+
+class EncodingError(ValueError):
+    """Raised when values or formulas do not fit an exact encoding"""
+
+
+class ValueEncoding:
+    """
+    Plaintext encoding of the guest values
+
+    Parameters
+    ----------
+    kind : str
+        "float", "integer" or "fixed_point"
+    precision : int
+        Decimal digits kept by "fixed_point"
+    """
+
+    def __init__(self, kind: str = "float", precision: int = 0):
+        if kind not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {kind!r}, expected one of {ENCODINGS}")
+        if precision < 0:
+            raise ValueError(f"Encoding precision must be >= 0, got {precision}")
+        self.kind = kind
+        self.precision = precision if kind == "fixed_point" else 0
+
+    @property
+    def exact(self) -> bool:
+        """Whether values are encrypted as int64 plaintexts"""
+        return self.kind != "float"
+
+    @property
+    def scale(self) -> int:
+        return 10**self.precision
+
+    @property
+    def result_type(self):
+        """Type of the decrypted result columns"""
+        return torch.int64 if self.kind == "integer" else float
+
+    def int_bits(self, max_abs: float) -> int:
+        """Bits of the largest encoded value, for values bounded by ``max_abs``"""
+        return max(1, math.ceil(math.log2(max_abs * self.scale + 1)))
+
+    def meta(self, max_abs: float, kind: str, key_size: int):
+        """What the host needs to check its formulas, None for "float" """
+        if not self.exact:
+            return None
+        int_bits = self.int_bits(max_abs)
+        max_bits = min(MAX_INT_BITS, plaintext_bits(kind, key_size) - 1)
+        if int_bits >= max_bits:
+            raise EncodingError(
+                f"Values need {int_bits} bits with {self.kind} encoding, "
+                f"more than the {max_bits} bits available"
+            )
+        return {
+            "kind": self.kind,
+            "precision": self.precision,
+            "int_bits": int_bits,
+            "max_bits": max_bits,
+        }
+
+    def encode(self, column) -> Tensor:
+        """Column of values (NumPy array or tensor) ready for encryption"""
+        if not self.exact:
+            return column if isinstance(column, Tensor) else Tensor(column)
+        column = torch.as_tensor(column, dtype=torch.float64)
+        if self.kind == "integer":
+            if not torch.equal(column, torch.round(column)):
+                raise EncodingError(
+                    "Integer encoding requires integral values, "
+                    "use fixed_point encoding for decimals"
+                )
+            return column.to(torch.int64)
+        return torch.round(column * self.scale).to(torch.int64)
+
+    def decode(self, values: np.ndarray) -> np.ndarray:
+        """Decrypted (scaled) results back to result values"""
+        if not self.exact:
+            return values.astype(np.float64, copy=False)
+        if values.dtype.kind == "f":
+            # Packed results are unpacked to exact integral floats
+            values = np.rint(values).astype(np.int64)
+        if self.kind == "integer":
+            return values
+        return values / self.scale
+
+    def __repr__(self) -> str:
+        if self.kind == "fixed_point":
+            return f"ValueEncoding(kind={self.kind!r}, precision={self.precision})"
+        return f"ValueEncoding(kind={self.kind!r})"
+
+
+def encode_plan(
+    plan: FormulaPlan, meta: dict, packed: bool = False, num_rows: int = 1
+) -> FormulaPlan:
+    """
+    Plan evaluating the formulas on exactly encoded values
+
+    Constants are scaled like the values. Unpacked scalars become int64
+    tensors, since FATE promotes Python scalars to the default float dtype.
+    Aggregates may add up all ``num_rows`` rows.
+
+    Raises
+    ------
+    EncodingError
+        If a coefficient is not an integer, a constant has more decimals
+        than the encoding keeps, or a result could overflow
+    """
+    scale = 10 ** meta["precision"]
+    max_result = 1 << meta["max_bits"]
+    exprs = {}
+    for idx, expr in plan.exprs.items():
+        for col, coef in expr.coefs.items():
+            if not isinstance(coef, int):
+                raise EncodingError(
+                    f"Formula {idx} uses non-integer coefficient {coef} for '{col}', "
+                    f"which {meta['kind']} encoding does not support"
+                )
+        const = _scaled_const(expr.const, scale, idx)
+        bound = sum(abs(c) for c in expr.coefs.values()) * (1 << meta["int_bits"])
+        bound += abs(const)
+        if plan.is_aggregate(idx):
+            bound *= num_rows
+        if bound >= max_result:
+            raise EncodingError(
+                f"Formula {idx} may overflow the {meta['max_bits']} bit "
+                f"plaintext range of {meta['kind']} encoding"
+            )
+        exprs[idx] = LinearExpr(expr.coefs, const)
+
+    def scalar(value):
+        return value if packed else torch.tensor(value, dtype=torch.int64)
+
+    steps = []
+    for op, args in plan.steps:
+        if op == "mul":
+            args = (args[0], scalar(args[1]))
+        elif op in ("add_const", "rsub_const"):
+            args = (args[0], scalar(_scaled_const(args[1], scale, op)))
+        steps.append((op, args))
+    return FormulaPlan(steps, plan.outputs, exprs, plan.aggregates)
+
+
+def _scaled_const(const, scale: int, where) -> int:
+    scaled = const * scale
+    if isinstance(scaled, float):
+        if abs(scaled - round(scaled)) > 1e-9 * max(1.0, abs(scaled)):
+            raise EncodingError(
+                f"Constant {const} of {where} has more decimals than the encoding keeps"
+            )
+        scaled = int(round(scaled))
+    return scaled
@@ -0,0 +1,176 @@
+"""
+Distributed Evaluation for Secure Function Component
+
+The host evaluates the formula plan of a "local" mode chunk as tasks of a
+computing-engine table instead of on the driver alone. The encoded guest
+columns are cut into row batches without decoding them; every task decodes
+its batch, runs the plan, sums its aggregate rows and encodes its results,
+and the encoded results are joined back in row order. By default there are
+as many partitions as the guest values have, so evaluation scales with the
+engine the same way in "local" and "partition" mode.
+"""
+
+import logging
+
+from .aggregate import add_aggregates, group_sums
+from .decryption import num_rows
+from .formula import FormulaPlan
+from .spill import segment_bounds
+
+logger = logging.getLogger(__name__)
+
+# Rows per evaluation task, small enough to balance, large enough to amortize
+DEFAULT_EVAL_BATCH_SIZE = 1024
+
+
+def evaluate(en_vals: dict, plan: FormulaPlan, packed: bool, groups: dict = None):
+    """
+    Run the plan on one chunk, batch or block of decoded columns
+
+    Returns the row results, re-normalized if packed, and the partial
+    aggregates of these rows; ``groups`` maps every group column of the
+    aggregates to the group indices of the rows and the number of groups.
+    """
+    values = plan.evaluate(en_vals)
+    result = {key: values[key] for key in plan.result_keys}
+    if packed:
+        result = {key: tensor.normalize() for key, tensor in result.items()}
+    aggregates = {
+        key: group_sums(values[step], *groups[group])
+        for key, (_, group, step) in plan.aggregates.items()
+    }
+    return result, aggregates
+
+
+def evaluate_payload(payload, plan: FormulaPlan, packed: bool, wire, num_groups: dict = None):
+    """
+    ``evaluate`` on one wire-encoded batch or block, returning its encoded row
+    results and partial aggregates; with aggregates the payload comes with
+    its group indices
+    """
+    groups = None
+    if num_groups is not None:
+        payload, codes = payload
+        groups = {group: (codes[group], num_groups[group]) for group in codes}
+    result, aggregates = evaluate(wire.decode(payload), plan, packed, groups)
+    return wire.encode(result), wire.encode(aggregates)
+
+
+def add_aggregate_payloads(left: dict, right: dict, wire) -> dict:
+    """Add two encoded dicts of partial aggregates"""
+    return wire.encode(add_aggregates(wire.decode(left), wire.decode(right)))
+
+
+class ParallelEvaluator:
+    """
+    Evaluate a plan on row batches across computing partitions
+
+    Parameters
+    ----------
+    ctx : Context
+        FATE context, its computing engine runs the evaluation tasks
+    wire : WireCodec
+        Codec of the guest's columns
+    metrics : PhaseMetrics
+        Metrics of the host, driver-side decoding and encoding are counted
+        as serialization and everything else as evaluation
+    num_partitions : int
+        Partitions to spread the batches over, 1 evaluates on the driver
+    batch_size : int
+        Rows per evaluation task
+    """
+
+    def __init__(
+        self,
+        ctx,
+        wire,
+        metrics,
+        num_partitions: int = 1,
+        batch_size: int = DEFAULT_EVAL_BATCH_SIZE,
+    ):
+        self.ctx = ctx
+        self.wire = wire
+        self.metrics = metrics
+        self.num_partitions = max(1, num_partitions)
+        self.batch_size = batch_size
+        if wire.layout is not None:
+            # batches must start on a ciphertext boundary
+            pack_num = wire.layout.pack_num
+            self.batch_size = max(pack_num, batch_size - batch_size % pack_num)
+
+    def num_rows(self, columns: dict, plan: FormulaPlan) -> int:
+        """Rows of a dict of columns, encoded or decoded"""
+        column = columns[plan.columns[0]]
+        if isinstance(column, (bytes, memoryview)):
+            return self.wire.num_rows(column)
+        return num_rows(column)
+
+    def evaluate(self, columns: dict, plan: FormulaPlan, packed: bool, groups: dict = None):
+        """
+        ``evaluate`` on a dict of columns, encoded (wire buffers) or decoded
+
+        Returns
+        -------
+        tuple
+            Dict of encoded row results, in row order, and dict of the
+            decoded partial aggregates of all rows
+        """
+        wire, metrics = self.wire, self.metrics
+        columns = {col: columns[col] for col in plan.columns}
+        total = self.num_rows(columns, plan)
+        encoded = isinstance(columns[plan.columns[0]], (bytes, memoryview))
+
+        if self.num_partitions == 1 or total <= self.batch_size:
+            if encoded:
+                with metrics.phase("serialization"):
+                    columns = wire.decode(columns)
+            with metrics.phase("evaluation"):
+                result, aggregates = evaluate(columns, plan, packed, groups)
+            with metrics.phase("serialization"):
+                return wire.encode(result), aggregates
+
+        with metrics.phase("serialization"):
+            if not encoded:
+                columns = wire.encode(columns)
+            tasks = []
+            for start, size in segment_bounds(total, self.batch_size):
+                batch = {
+                    col: wire.slice_column(buf, start, size) for col, buf in columns.items()
+                }
+                if plan.aggregates:
+                    batch = (
+                        batch,
+                        {
+                            group: group_codes[start : start + size]
+                            for group, (group_codes, _) in groups.items()
+                        },
+                    )
+                tasks.append((start, batch))
+
+        partitions = min(self.num_partitions, len(tasks))
+        num_groups = (
+            {group: num for group, (_, num) in groups.items()} if plan.aggregates else None
+        )
+        with metrics.phase("evaluation"):
+            evaluated = (
+                self.ctx.computing.parallelize(tasks, include_key=True, partition=partitions)
+                .mapValues(
+                    lambda batch: evaluate_payload(batch, plan, packed, wire, num_groups)
+                )
+                .collect()
+            )
+        del tasks
+        batches = [value for _, value in sorted(evaluated, key=lambda kv: kv[0])]
+
+        with metrics.phase("serialization"):
+            result = {
+                key: wire.concat_columns([payload[key] for payload, _ in batches])
+                for key in plan.result_keys
+            }
+            aggregates = {}
+            for _, partial in batches:
+                aggregates = add_aggregates(aggregates, wire.decode(partial))
+        logger.info(
+            f"Evaluated {total} rows in {len(batches)} batches on {partitions} partitions"
+        )
+        return result, aggregates
@@ -0,0 +1,554 @@
+"""
+Formula Compiler for Secure Function Component
+
+Parses the host's linear formulas over guest columns and lowers them to a
+single evaluation plan in which every distinct subexpression is computed
+once, no matter how many formulas use it. Aggregate formulas such as
+``sum(x+y)`` or ``mean(2*x) by region`` reduce a linear formula over all
+rows, or over the rows of each group of a guest column.
+"""
+
+import re
+import logging
+from numbers import Number
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Multiplying a ciphertext by an integer c is a square-and-multiply
+# exponentiation of about this many ciphertext multiplications per bit of c;
+# a homomorphic addition is one
+_MUL_COST_PER_BIT = 1.5
+
+_TOKEN_RE = re.compile(
+    r"(?:"
+    r"(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<op>[-+*/()])"
+    r")"
+)
+
+
+AGGREGATES = ["sum", "mean"]
+
+_AGGREGATE_RE = re.compile(
+    r"^\s*(?P<func>[A-Za-z_]\w*)\s*\((?P<expr>.*)\)"
+    r"(?:\s+by\s+(?P<group>[A-Za-z_]\w*))?\s*$",
+    re.DOTALL,
+)
+
+
+class FormulaError(ValueError):
+    """Raised when a formula cannot be parsed or is not linear"""
+
+
+def _normalize_number(value: Number) -> Number:
+    """Use ints for integral coefficients so 2 and 2.0 share one term"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class LinearExpr:
+    """
+    Linear combination of guest columns plus a constant
+
+    Parameters
+    ----------
+    coefs : dict
+        Column name -> coefficient, zero coefficients are dropped
+    const : int or float
+        Constant term
+    """
+
+    def __init__(self, coefs: Dict[str, Number] = None, const: Number = 0):
+        self.coefs = {
+            col: _normalize_number(coef)
+            for col, coef in (coefs or {}).items()
+            if coef != 0
+        }
+        self.const = _normalize_number(const)
+
+    @property
+    def is_constant(self) -> bool:
+        return not self.coefs
+
+    def __add__(self, other: "LinearExpr") -> "LinearExpr":
+        coefs = dict(self.coefs)
+        for col, coef in other.coefs.items():
+            coefs[col] = coefs.get(col, 0) + coef
+        return LinearExpr(coefs, self.const + other.const)
+
+    def __sub__(self, other: "LinearExpr") -> "LinearExpr":
+        return self + other.scale(-1)
+
+    def scale(self, factor: Number) -> "LinearExpr":
+        return LinearExpr(
+            {col: coef * factor for col, coef in self.coefs.items()},
+            self.const * factor,
+        )
+
+    def key(self) -> tuple:
+        """Canonical, hashable form used to detect identical formulas"""
+        return tuple(sorted(self.coefs.items())), self.const
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LinearExpr) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __repr__(self) -> str:
+        return f"LinearExpr(coefs={self.coefs}, const={self.const})"
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+
+    def _tokenize(self, text: str) -> List[Tuple[str, str]]:
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            if text[pos].isspace():
+                pos += 1
+                continue
+            match = _TOKEN_RE.match(text, pos)
+            if match is None:
+                raise FormulaError(
+                    f"Unexpected character {text[pos]!r} at {pos} in '{self.text}'"
+                )
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))
+            pos = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def parse(self) -> LinearExpr:
+        if not self.tokens:
+            raise FormulaError("Empty formula")
+        expr = self._expr()
+        if self.pos != len(self.tokens):
+            raise FormulaError(
+                f"Unexpected token {self._peek()[1]!r} in '{self.text}'"
+            )
+        return expr
+
+    def _expr(self) -> LinearExpr:
+        expr = self._term()
+        while self._peek() in (("op", "+"), ("op", "-")):
+            _, op = self._next()
+            rhs = self._term()
+            expr = expr + rhs if op == "+" else expr - rhs
+        return expr
+
+    def _term(self) -> LinearExpr:
+        expr = self._unary()
+        while self._peek() in (("op", "*"), ("op", "/")):
+            _, op = self._next()
+            rhs = self._unary()
+            if op == "*":
+                if rhs.is_constant:
+                    expr = expr.scale(rhs.const)
+                elif expr.is_constant:
+                    expr = rhs.scale(expr.const)
+                else:
+                    raise FormulaError(
+                        f"Product of two columns is not supported in '{self.text}'"
+                    )
+            else:
+                if not rhs.is_constant:
+                    raise FormulaError(
+                        f"Division by a column is not supported in '{self.text}'"
+                    )
+                if rhs.const == 0:
+                    raise FormulaError(f"Division by zero in '{self.text}'")
+                expr = expr.scale(1 / rhs.const)
+        return expr
+
+    def _unary(self) -> LinearExpr:
+        if self._peek() == ("op", "-"):
+            self._next()
+            return self._unary().scale(-1)
+        if self._peek() == ("op", "+"):
+            self._next()
+            return self._unary()
+        return self._primary()
+
+    def _primary(self) -> LinearExpr:
+        kind, value = self._next()
+        if kind == "number":
+            number = float(value) if any(c in value for c in ".eE") else int(value)
+            return LinearExpr(const=number)
+        if kind == "name":
+            return LinearExpr({value: 1})
+        if (kind, value) == ("op", "("):
+            expr = self._expr()
+            if self._next() != ("op", ")"):
+                raise FormulaError(f"Missing ')' in '{self.text}'")
+            return expr
+        if kind is None:
+            raise FormulaError(f"Unexpected end of formula '{self.text}'")
+        raise FormulaError(f"Unexpected token {value!r} in '{self.text}'")
+
+
+def parse_formula(text: str) -> LinearExpr:
+    """
+    Parse a linear formula such as ``2*x + 3*(y - 0.5)``
+
+    Parameters
+    ----------
+    text : str
+        Formula over guest column names, with int/float constants,
+        ``+ - * /``, parentheses and unary minus
+
+    Returns
+    -------
+    LinearExpr
+        Normalized linear combination
+    """
+    return _Parser(str(text)).parse()
+
+
+def parse_aggregate(text: str) -> Optional[Tuple[str, LinearExpr, Optional[str]]]:
+    """
+    Parse an aggregate formula such as ``sum(2*x - y)`` or ``mean(x) by g``
+
+    Returns
+    -------
+    tuple or None
+        (function, inner LinearExpr, group column or None), None when the
+        text is a plain row formula
+    """
+    match = _AGGREGATE_RE.match(str(text))
+    if match is None or match.group("func") not in AGGREGATES:
+        return None
+    return match.group("func"), parse_formula(match.group("expr")), match.group("group")
+
+
+class FormulaPlan:
+    """
+    Straight-line evaluation plan shared by all formulas
+
+    Each step is ``(op, args)`` and refers to earlier steps by index:
+
+    - ``("col", name)``: encrypted guest column
+    - ``("mul", (i, c))``: step i times scalar c
+    - ``("add", (i, j))`` / ``("sub", (i, j))``: sum / difference of steps
+    - ``("add_const", (i, c))``: step i plus constant c
+    - ``("rsub_const", (i, c))``: constant c minus step i
+    - ``("matmul", ((i, ...), w))``: K x D weight tensor w times the steps
+      stacked as D rows, a K x N result
+    - ``("row", (i, k))``: row k of matrix step i
+
+    Aggregate results are keyed after the steps, ``len(steps) + i``, and
+    reduce one step over the rows of each group.
+
+    Parameters
+    ----------
+    steps : list
+        Steps in evaluation order
+    outputs : dict
+        Formula id -> index of the step holding its result, or key of its
+        aggregate
+    exprs : dict, optional
+        Formula id -> parsed LinearExpr, the inner one for aggregates
+    aggregates : dict, optional
+        Aggregate key -> (function, group column or None, step)
+    """
+
+    def __init__(
+        self,
+        steps: List[tuple],
+        outputs: Dict[str, int],
+        exprs: Dict[str, LinearExpr] = None,
+        aggregates: Dict[int, Tuple[str, Optional[str], int]] = None,
+    ):
+        self.steps = steps
+        self.outputs = outputs
+        self.exprs = exprs or {}
+        self.aggregates = aggregates or {}
+
+    @property
+    def columns(self) -> List[str]:
+        """Guest columns referenced by at least one formula"""
+        return sorted(args for op, args in self.steps if op == "col")
+
+    @property
+    def result_keys(self) -> List[int]:
+        """Distinct row result steps, formulas with identical results share one"""
+        return sorted(
+            set(key for key in self.outputs.values() if key not in self.aggregates)
+        )
+
+    @property
+    def aggregate_keys(self) -> List[int]:
+        """Distinct aggregate results"""
+        return sorted(self.aggregates)
+
+    @property
+    def groups(self) -> List[Optional[str]]:
+        """Group columns of the aggregates, None for aggregates over all rows"""
+        groups = set(group for _, group, _ in self.aggregates.values())
+        return sorted(groups, key=lambda group: (group is not None, group or ""))
+
+    def is_aggregate(self, formula_id) -> bool:
+        return self.outputs[formula_id] in self.aggregates
+
+    def evaluate(self, en_vals: dict) -> dict:
+        """
+        Run the plan on one set of encrypted columns
+
+        Parameters
+        ----------
+        en_vals : dict
+            Column name -> PHETensor, whole columns or a single chunk/block
+
+        Returns
+        -------
+        dict
+            Step -> PHETensor, one entry per distinct row result and per step
+            an aggregate reduces; use ``outputs`` to map formula ids to keys
+        """
+        missing = [col for col in self.columns if col not in en_vals]
+        if missing:
+            raise ValueError(f"Formulas reference unknown guest columns: {missing}")
+
+        values = []
+        for op, args in self.steps:
+            if op == "col":
+                values.append(en_vals[args])
+            elif op == "mul":
+                values.append(values[args[0]] * args[1])
+            elif op == "add":
+                values.append(values[args[0]] + values[args[1]])
+            elif op == "sub":
+                values.append(values[args[0]] - values[args[1]])
+            elif op == "add_const":
+                values.append(values[args[0]] + args[1])
+            elif op == "rsub_const":
+                values.append(args[1] - values[args[0]])
+            elif op == "matmul":
+                values.append(_matmul([values[i] for i in args[0]], args[1]))
+            elif op == "row":
+                values.append(values[args[0]][args[1]])
+            else:
+                raise ValueError(f"Unknown plan step: {op}")
+
+        steps = set(self.result_keys)
+        steps.update(step for _, _, step in self.aggregates.values())
+        return {step: values[step] for step in sorted(steps)}
+
+
+def _matmul(columns: list, weights):
+    """``weights @ X`` with the encrypted columns as the rows of X"""
+    first = columns[0]
+    data = first.data
+    if len(columns) > 1:
+        data = first.evaluator.cat([column.data for column in columns])
+    stacked = first.with_template(
+        data, shape=type(first.shape)([len(columns), first.shape[0]])
+    )
+    # Weights are encoded like the values, exact ones stay int64
+    return weights.to(stacked.dtype) @ stacked
+
+
+def addition_chain(coefs) -> List[Tuple[int, int, int]]:
+    """
+    Additions building every coefficient from 1, reusing earlier results
+
+    Parameters
+    ----------
+    coefs : iterable of int
+        Positive integer coefficients
+
+    Returns
+    -------
+    list
+        ``(c, a, b)`` triples with ``c = a + b``, where ``a`` and ``b`` are 1
+        or built by an earlier triple
+    """
+    known = {1}
+    chain = []
+
+    def build(c: int):
+        if c in known:
+            return
+        for a in sorted(known, reverse=True):
+            if c - a in known:
+                break
+        else:
+            # Binary method: c = c//2 + (c - c//2), the halves share a chain
+            a = c // 2
+            build(a)
+            build(c - a)
+        chain.append((c, a, c - a))
+        known.add(c)
+
+    for c in sorted(set(coefs)):
+        build(c)
+    return chain
+
+
+def _multiple_chains(exprs) -> Dict[str, Dict[int, Tuple[int, int]]]:
+    """
+    Addition chains of the columns whose integer multiples they make cheaper
+
+    Coefficients are positive in the plan, negative ones become subtractions.
+    """
+    coefs = {}
+    for expr in exprs:
+        for col, coef in expr.coefs.items():
+            coef = abs(coef)
+            if isinstance(coef, int) and coef > 1:
+                coefs.setdefault(col, set()).add(coef)
+
+    chains = {}
+    for col, col_coefs in coefs.items():
+        chain = addition_chain(col_coefs)
+        cost = sum(_MUL_COST_PER_BIT * coef.bit_length() for coef in col_coefs)
+        if len(chain) < cost:
+            chains[col] = {c: (a, b) for c, a, b in chain}
+    return chains
+
+
+class _PlanBuilder:
+    """
+    Hash-conses plan steps so that every distinct step is emitted once
+
+    Parameters
+    ----------
+    chains : dict, optional
+        Column -> {multiple: (a, b)}, integer multiples of the column built
+        as additions of smaller multiples instead of scalar multiplications
+    """
+
+    def __init__(self, chains: Dict[str, Dict[int, Tuple[int, int]]] = None):
+        self.steps = []
+        self._index = {}
+        self._chains = chains or {}
+        # (column, multiple) -> step; chain links share their halves
+        self._multiples = {}
+
+    def emit(self, op: str, args) -> int:
+        if op == "add":
+            args = tuple(sorted(args))
+        key = (op, args)
+        if key not in self._index:
+            self._index[key] = len(self.steps)
+            self.steps.append(key)
+        return self._index[key]
+
+    def scaled(self, col: str, coef: Number) -> int:
+        if coef in self._chains.get(col, {}):
+            return self.multiple(col, coef)
+        step = self.emit("col", col)
+        if coef != 1:
+            step = self.emit("mul", (step, coef))
+        return step
+
+    def multiple(self, col: str, coef: int) -> int:
+        """``coef * col`` from the column's addition chain"""
+        if coef == 1:
+            return self.emit("col", col)
+        if (col, coef) not in self._multiples:
+            a, b = self._chains[col][coef]
+            self._multiples[col, coef] = self.emit(
+                "add", (self.multiple(col, a), self.multiple(col, b))
+            )
+        return self._multiples[col, coef]
+
+    def lower(self, expr: LinearExpr) -> int:
+        if expr.is_constant:
+            raise FormulaError("Formula must reference at least one guest column")
+
+        # Negative coefficients become subtractions: multiplying a Paillier
+        # ciphertext by -c costs a full-size exponent, subtracting c*x does not
+        terms = sorted(expr.coefs.items())
+        positive = [(col, coef) for col, coef in terms if coef > 0]
+        negative = [(col, -coef) for col, coef in terms if coef < 0]
+
+        const = expr.const
+        acc = None
+        for col, coef in positive:
+            step = self.scaled(col, coef)
+            acc = step if acc is None else self.emit("add", (acc, step))
+        for col, coef in negative:
+            step = self.scaled(col, coef)
+            if acc is None:
+                acc = self.emit("rsub_const", (step, const))
+                const = 0
+            else:
+                acc = self.emit("sub", (acc, step))
+        if const != 0:
+            acc = self.emit("add_const", (acc, const))
+        return acc
+
+
+def compile_formulas(formulas: List[Tuple[str, str]]) -> FormulaPlan:
+    """
+    Compile (id, formula) pairs into one shared evaluation plan
+
+    Parameters
+    ----------
+    formulas : list
+        (formula id, formula text) pairs
+
+    Returns
+    -------
+    FormulaPlan
+        Plan computing each distinct subexpression once
+    """
+    exprs = {}
+    aggregated = {}
+    for idx, text in formulas:
+        try:
+            aggregate = parse_aggregate(text)
+            if aggregate is None:
+                exprs[idx] = parse_formula(text)
+            else:
+                func, exprs[idx], group = aggregate
+                aggregated[idx] = (func, group)
+        except FormulaError as e:
+            raise FormulaError(f"Invalid formula {idx} '{text}': {e}") from e
+
+    # Multiples of a column shared by many formulas are built by additions
+    chains = _multiple_chains(exprs.values())
+    builder = _PlanBuilder(chains)
+    outputs = {}
+    for idx, text in formulas:
+        try:
+            outputs[idx] = builder.lower(exprs[idx])
+        except FormulaError as e:
+            raise FormulaError(f"Invalid formula {idx} '{text}': {e}") from e
+
+    # Aggregates are keyed after the steps, identical ones are shared
+    aggregates = {}
+    for idx, (func, group) in aggregated.items():
+        spec = (func, group, outputs[idx])
+        if spec not in aggregates.values():
+            aggregates[len(builder.steps) + len(aggregates)] = spec
+        outputs[idx] = next(key for key, other in aggregates.items() if other == spec)
+
+    plan = FormulaPlan(builder.steps, outputs, exprs, aggregates)
+    num_muls = sum(1 for op, _ in plan.steps if op == "mul")
+    logger.info(
+        f"Compiled {len(formulas)} formulas into {len(plan.steps)} plan steps "
+        f"({num_muls} scalar multiplications, addition chains for "
+        f"{sorted(chains)}) over columns {plan.columns}"
+    )
+    if aggregates:
+        logger.info(
+            f"{len(aggregated)} aggregate formulas map to {len(aggregates)} "
+            f"distinct aggregates over groups {plan.groups}"
+        )
+    return plan
@@ -0,0 +1,248 @@
+"""
+Incremental Encryption for Secure Function Component
+
+Guest rows are mapped to stable slots, and every host keeps the ciphertexts
+of its slots between jobs. A job then only encrypts and sends the units
+holding new or modified rows, a unit being one ciphertext: a single slot, or
+``pack_num`` slots with packing. Hosts patch their stored columns with this
+delta and evaluate on the whole table.
+
+The guest side (``GuestRowCache``) keeps, per key fingerprint, the slot and
+a content hash of every row; the host side (``HostCiphertextStore``) keeps
+the ciphertexts in the wire format. Both are tagged with a token that
+changes every job, so a job that failed half way, another key, a changed
+packing layout or changed columns make the guest send every unit again.
+
+Slots of deleted rows are reused for new rows; until then their stale
+ciphertexts stay on the hosts and their results are ignored.
+"""
+
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .keystore import _atomic_dump, _private_dir
+from .packing import PackedCiphertext, PackLayout
+
+logger = logging.getLogger(__name__)
+
+
+def row_hashes(df: pd.DataFrame, columns: list) -> np.ndarray:
+    """Content hash of every row over the given columns"""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def reusable_layout(cached: PackLayout, layout: PackLayout) -> bool:
+    """Whether values that fit ``layout`` can keep using the ``cached`` one"""
+    return (
+        cached is not None
+        and layout is not None
+        and cached.precision == layout.precision
+        and cached.headroom_bits == layout.headroom_bits
+        and cached.int_bits >= layout.int_bits
+    )
+
+
+class SlotAssignment:
+    """
+    Slots of the current rows and the units to encrypt
+
+    Parameters
+    ----------
+    ids : array-like
+        Row ids, unique
+    hashes : np.ndarray
+        Content hash of each row
+    pack_num : int
+        Slots per unit, 1 without packing
+    previous : dict, optional
+        ``state()`` of the previous job; every unit is encrypted without it
+    """
+
+    def __init__(self, ids, hashes: np.ndarray, pack_num: int = 1, previous: dict = None):
+        ids = pd.Index(ids)
+        if not ids.is_unique:
+            raise ValueError("Incremental mode requires unique row ids")
+        self.pack_num = pack_num
+        self.ids = ids
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+
+        if previous is None:
+            self.row_slots = np.arange(len(ids), dtype=np.int64)
+            num_slots = len(ids)
+            changed = self.row_slots
+        else:
+            old_slots = np.asarray(previous["slots"], dtype=np.int64)
+            old_hashes = np.asarray(previous["hashes"], dtype=np.uint64)
+            positions = pd.Index(previous["ids"]).get_indexer(ids)
+            known = positions >= 0
+            self.row_slots = np.empty(len(ids), dtype=np.int64)
+            self.row_slots[known] = old_slots[positions[known]]
+
+            # New rows take the slots of deleted rows first, then new slots
+            deleted = np.ones(len(old_slots), dtype=bool)
+            deleted[positions[known]] = False
+            free = np.sort(old_slots[deleted])
+            num_new = int((~known).sum())
+            num_slots = previous["num_slots"]
+            extra = max(0, num_new - len(free))
+            new_slots = np.concatenate(
+                [free[:num_new], np.arange(num_slots, num_slots + extra)]
+            ).astype(np.int64)
+            self.row_slots[~known] = new_slots
+            num_slots += extra
+
+            modified = np.zeros(len(ids), dtype=bool)
+            modified[known] = old_hashes[positions[known]] != self.hashes[known]
+            changed = np.concatenate([new_slots, self.row_slots[modified]])
+
+        self.num_slots = num_slots
+        self.num_units = -(-num_slots // pack_num)
+        self.units = np.unique(changed // pack_num)
+        # Row position of every slot, -1 for free slots
+        self.slot_rows = np.full(self.num_units * pack_num, -1, dtype=np.int64)
+        self.slot_rows[self.row_slots] = np.arange(len(ids))
+
+    def unit_values(self, values: np.ndarray) -> np.ndarray:
+        """Values of the slots of ``units``, in slot order, 0 for free slots"""
+        slots = (self.units[:, None] * self.pack_num + np.arange(self.pack_num)).ravel()
+        rows = self.slot_rows[slots]
+        return np.where(rows >= 0, values[rows], 0.0)
+
+    def state(self) -> dict:
+        return {
+            "ids": self.ids.to_numpy(),
+            "slots": self.row_slots,
+            "hashes": self.hashes,
+            "num_slots": self.num_slots,
+        }
+
+
+def apply_delta(column, delta, units: np.ndarray, num_units: int):
+    """
+    Replace the given units of a stored column with a delta column
+
+    Parameters
+    ----------
+    column : PHETensor or PackedCiphertext, optional
+        Stored column, None when the delta holds every unit
+    delta : PHETensor or PackedCiphertext, optional
+        Ciphertexts of ``units``, in the same order; None if no unit changed
+    units : np.ndarray
+        Sorted unit indices; units past the stored column are appended
+    num_units : int
+        Units of the patched column
+    """
+    if delta is None:
+        return column
+    evaluator = delta.evaluator
+    pieces = []
+    stored = 0 if column is None else _num_units(column)
+    prev, j = 0, 0
+    while j < len(units):
+        # Consecutive units are taken from the delta as one run
+        start = int(units[j])
+        end = j + 1
+        while end < len(units) and units[end] == units[end - 1] + 1:
+            end += 1
+        if start > prev:
+            pieces.append(evaluator.slice(column.data, prev, start - prev))
+        pieces.append(evaluator.slice(delta.data, j, end - j))
+        prev = start + end - j
+        j = end
+    if prev < stored:
+        pieces.append(evaluator.slice(column.data, prev, stored - prev))
+    data = pieces[0] if len(pieces) == 1 else evaluator.cat(pieces)
+
+    if isinstance(delta, PackedCiphertext):
+        return PackedCiphertext(
+            delta.pk,
+            delta.evaluator,
+            delta.coder,
+            delta.layout,
+            data,
+            num_units * delta.layout.pack_num,
+        )
+    return delta.with_template(data, shape=type(delta.shape)([num_units]))
+
+
+def _num_units(column) -> int:
+    if isinstance(column, PackedCiphertext):
+        return column.num_ciphertexts
+    return column.shape[0]
+
+
+class GuestRowCache:
+    """
+    Guest-local slots and row hashes of the last job, per key fingerprint
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache, created if missing; keep it private to the guest
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        _private_dir(path)
+
+    def _file(self, fingerprint: str) -> str:
+        return os.path.join(self.path, f"{fingerprint}.rows")
+
+    def load(self, fingerprint: str):
+        """``{"token", "columns", "layout", "slots"}`` of the last job, or None"""
+        path = self._file(fingerprint)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, fingerprint: str, entry: dict):
+        _atomic_dump(entry, self._file(fingerprint))
+
+
+class HostCiphertextStore:
+    """
+    Host-local ciphertexts of the last job, per guest key fingerprint
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store, created if missing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, fingerprint: str) -> str:
+        return os.path.join(self.path, f"{fingerprint}.ct")
+
+    def token(self, fingerprint: str, columns: list):
+        """Token of the stored ciphertexts if they hold exactly ``columns``"""
+        entry = self._read(fingerprint)
+        if entry is None or entry["columns"] != list(columns):
+            return None
+        return entry["token"]
+
+    def load(self, fingerprint: str, wire) -> dict:
+        """Stored columns, decoded with a ``WireCodec`` of the key"""
+        return wire.decode(self._read(fingerprint)["data"])
+
+    def save(self, fingerprint: str, token: str, columns: dict, wire):
+        entry = {
+            "token": token,
+            "columns": list(columns.keys()),
+            "data": wire.encode(columns),
+        }
+        _atomic_dump(entry, self._file(fingerprint))
+
+    def _read(self, fingerprint: str):
+        path = self._file(fingerprint)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
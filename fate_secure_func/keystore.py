@@ -0,0 +1,156 @@
+"""
+Key Store for Secure Function Component
+
+Keeps encryption kits between jobs so that repeated runs between the same
+parties skip key generation (guest) and the transfer of the public key
+(host). Guest kits are rotated once they are too old or have been used too
+often.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def key_fingerprint(pk) -> str:
+    """Stable fingerprint of a raw public key"""
+    return hashlib.sha256(pickle.dumps(pk)).hexdigest()[:16]
+
+
+def _atomic_dump(obj, path: str):
+    """Replace ``path`` by a pickle of ``obj``, readable by the owner only"""
+    tmp = f"{path}.tmp.{os.getpid()}"
+    try:
+        # left over by a crashed process of the same pid
+        os.remove(tmp)
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _private_dir(path: str):
+    """Create a directory accessible to the owner only, or restrict it"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # makedirs keeps the mode of an existing directory
+    os.chmod(path, 0o700)
+
+
+class GuestKeyStore:
+    """
+    Guest-local store of full encryption kits (private key included)
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store, created if missing; keep it private to the guest
+    max_age : int
+        Seconds a kit may be used after its creation, 0 for no limit
+    max_uses : int
+        Jobs a kit may serve, 0 for no limit
+    """
+
+    def __init__(self, path: str, max_age: int = 0, max_uses: int = 0):
+        self.path = path
+        self.max_age = max_age
+        self.max_uses = max_uses
+        _private_dir(path)
+
+    @staticmethod
+    def scope(guest_id, host_ids, kind: str, key_length: int) -> str:
+        """Name of the kit shared by a guest, its hosts and one he_param"""
+        hosts = ",".join(sorted(str(host_id) for host_id in host_ids))
+        raw = f"{guest_id}|{hosts}|{kind}|{key_length}"
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def _file(self, scope: str) -> str:
+        return os.path.join(self.path, f"{scope}.kit")
+
+    def _expired(self, entry: dict) -> bool:
+        if self.max_age and time.time() - entry["created"] > self.max_age:
+            return True
+        return bool(self.max_uses) and entry["uses"] >= self.max_uses
+
+    def load(self, scope: str):
+        """
+        Return the stored kit of a scope and count one use, or None
+
+        Kits past ``max_age`` or ``max_uses`` are deleted instead.
+        """
+        path = self._file(scope)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            entry = pickle.load(f)
+        if self._expired(entry):
+            os.remove(path)
+            logger.info(f"Rotating key {entry['fingerprint']} after {entry['uses']} uses")
+            return None
+
+        entry["uses"] += 1
+        _atomic_dump(entry, path)
+        logger.info(f"Reusing key {entry['fingerprint']} (use {entry['uses']})")
+        return entry["kit"]
+
+    def save(self, scope: str, kit):
+        """Store a freshly generated kit, counted as used once"""
+        entry = {
+            "kit": kit,
+            "fingerprint": key_fingerprint(kit.pk),
+            "created": time.time(),
+            "uses": 1,
+        }
+        _atomic_dump(entry, self._file(scope))
+        logger.info(f"Stored key {entry['fingerprint']}")
+
+    def remove(self, scope: str):
+        """Delete the stored kit of a scope, if any"""
+        path = self._file(scope)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class HostKeyCache:
+    """
+    Host-local cache of guest public keys, evaluators and coders by fingerprint
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache, created if missing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, fingerprint: str) -> str:
+        return os.path.join(self.path, f"{fingerprint}.pk")
+
+    def get(self, fingerprint: str):
+        """Cached ``[pk, evaluator, coder]`` of a fingerprint, or None"""
+        path = self._file(fingerprint)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            en_kit = pickle.load(f)
+        # entries written before the coder was part of the kit are refetched
+        if len(en_kit) != 3 or key_fingerprint(en_kit[0]) != fingerprint:
+            logger.warning(f"Discarding stale cached key {fingerprint}")
+            os.remove(path)
+            return None
+        return list(en_kit)
+
+    def put(self, fingerprint: str, en_kit):
+        _atomic_dump(list(en_kit), self._file(fingerprint))
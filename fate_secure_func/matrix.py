@@ -0,0 +1,94 @@
+"""
+Matrix Formulas for Secure Function Component
+
+With ``formula_type="matrix"`` the host input is a numeric coefficient table
+instead of string formulas: one row per output, an ``id`` column and one
+coefficient column per guest column. The K x D weights are applied to the
+N x D encrypted guest values as one batched ciphertext-plaintext product,
+the native ``rmatmul`` of the FATE evaluators, instead of K formulas of up
+to D scalar multiplications and additions each.
+
+Like any other plan, the product runs on row batches as tasks of the
+computing engine (see ``evaluation``).
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import torch
+
+from .formula import FormulaError, FormulaPlan, LinearExpr
+
+logger = logging.getLogger(__name__)
+
+FORMULA_TYPES = ["expression", "matrix"]
+
+
+def compile_matrix(coefficients: pd.DataFrame) -> FormulaPlan:
+    """
+    Compile a coefficient table into a plan with one matrix product
+
+    Parameters
+    ----------
+    coefficients : pd.DataFrame
+        ``id`` column plus one numeric column per guest column; each row is
+        the weights of one output
+
+    Returns
+    -------
+    FormulaPlan
+        Plan multiplying the stacked guest columns by the distinct weight
+        rows; identical rows share one result
+
+    Raises
+    ------
+    FormulaError
+        If the table has no ``id`` column, a non-numeric or missing
+        coefficient, or a row of zeros only
+    """
+    if "id" not in coefficients.columns:
+        raise FormulaError("Coefficient table needs an 'id' column")
+    weights = coefficients.drop(columns=["id"])
+    try:
+        weights = weights.apply(pd.to_numeric)
+    except (TypeError, ValueError) as e:
+        raise FormulaError(f"Coefficients must be numeric: {e}") from e
+    if weights.isna().any().any():
+        missing = sorted(weights.columns[weights.isna().any()])
+        raise FormulaError(f"Missing coefficients in columns {missing}")
+
+    # Columns no output uses are neither requested nor multiplied
+    weights = weights.loc[:, (weights != 0).any()]
+    weights = weights[sorted(weights.columns)]
+    columns = list(weights.columns)
+    ids = coefficients["id"].tolist()
+
+    exprs = {}
+    rows = {}
+    outputs = {}
+    for idx, row in zip(ids, weights.to_numpy(dtype=np.float64).tolist()):
+        expr = LinearExpr(dict(zip(columns, row)))
+        if expr.is_constant:
+            raise FormulaError(
+                f"Output {idx} must reference at least one guest column"
+            )
+        exprs[idx] = expr
+        row = tuple(expr.coefs.get(col, 0) for col in columns)
+        outputs[idx] = rows.setdefault(row, len(rows))
+
+    matrix = np.array(list(rows), dtype=np.float64).reshape(len(rows), len(columns))
+    integral = np.array_equal(matrix, np.round(matrix))
+    matrix = torch.tensor(matrix, dtype=torch.int64 if integral else torch.float64)
+
+    steps = [("col", col) for col in columns]
+    steps.append(("matmul", (tuple(range(len(columns))), matrix)))
+    product = len(steps) - 1
+    steps.extend(("row", (product, k)) for k in range(len(rows)))
+    outputs = {idx: product + 1 + k for idx, k in outputs.items()}
+
+    logger.info(
+        f"Compiled {len(ids)} coefficient rows into a {len(rows)} x "
+        f"{len(columns)} product over columns {columns}"
+    )
+    return FormulaPlan(steps, outputs, exprs)
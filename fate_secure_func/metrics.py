@@ -0,0 +1,120 @@
+"""
+Phase Metrics for Secure Function Component
+
+Records wall time, CPU time, ciphertext count and (estimated) serialized
+bytes for each phase of a job, and reports them through FATE's context
+metrics and, optionally, as a JSON trace file.
+"""
+
+import contextlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from .packing import PackedCiphertext
+
+logger = logging.getLogger(__name__)
+
+METRICS_NAME = "secure_func_phases"
+
+
+def ciphertext_bytes(kind: str, key_size: int) -> int:
+    """Serialized size of one ciphertext, a residue of twice the key length"""
+    if kind in ("paillier", "ou"):
+        return 2 * key_size // 8
+    return 8
+
+
+def count_ciphertexts(tensors) -> int:
+    """Ciphertexts held by a PHETensor, PackedCiphertext or a dict of them"""
+    if isinstance(tensors, dict):
+        return sum(count_ciphertexts(tensor) for tensor in tensors.values())
+    if isinstance(tensors, PackedCiphertext):
+        return tensors.num_ciphertexts
+    return tensors.shape.numel()
+
+
+class _Phase:
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.ciphertexts = 0
+        self.bytes = 0
+
+    def dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "ciphertexts": self.ciphertexts,
+            "bytes": self.bytes,
+        }
+
+
+class PhaseMetrics:
+    """
+    Per-phase counters of one party
+
+    CPU time is the process time, so it includes native threads working on
+    the phase as well as any other thread of the process.
+
+    Parameters
+    ----------
+    role : str
+        "guest" or "host"
+    trace_path : str, optional
+        File the metrics are also written to as JSON
+    """
+
+    def __init__(self, role: str, trace_path: str = None):
+        self.role = role
+        self.trace_path = trace_path
+        self.ciphertext_size = 0
+        self._phases = OrderedDict()
+        self._started = time.perf_counter()
+
+    def _get(self, name: str) -> _Phase:
+        if name not in self._phases:
+            self._phases[name] = _Phase()
+        return self._phases[name]
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as (one more call of) phase ``name``"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            phase = self._get(name)
+            phase.calls += 1
+            phase.wall_seconds += time.perf_counter() - wall
+            phase.cpu_seconds += time.process_time() - cpu
+
+    def count(self, name: str, ciphertexts: int, nbytes: int = None):
+        """Attribute ciphertexts and their bytes, estimated if not given, to a phase"""
+        phase = self._get(name)
+        phase.ciphertexts += ciphertexts
+        if nbytes is None:
+            nbytes = ciphertexts * self.ciphertext_size
+        phase.bytes += nbytes
+
+    def dict(self) -> dict:
+        return {
+            "role": self.role,
+            "total_seconds": round(time.perf_counter() - self._started, 6),
+            "ciphertext_bytes": self.ciphertext_size,
+            "phases": {name: phase.dict() for name, phase in self._phases.items()},
+        }
+
+    def report(self, ctx):
+        """Log the metrics to the context and write the trace file, if any"""
+        data = self.dict()
+        ctx.metrics.log_metrics(data, name=METRICS_NAME, type="secure_func")
+        for name, phase in data["phases"].items():
+            logger.info(f"[{self.role}] {name}: {phase}")
+        if self.trace_path:
+            with open(self.trace_path, "w") as f:
+                json.dump(data, f, indent=2)
+            logger.info(f"Phase trace written to {self.trace_path}")
@@ -0,0 +1,163 @@
+"""
+Obfuscation Pool for Secure Function Component
+
+Paillier/OU encryption spends most of its time on the random obfuscator
+(``r^n mod n^2`` for Paillier), which does not depend on the data. The pool
+precomputes encryptions of zero ahead of time, in a background thread or
+from a file saved by an earlier job with the same key, so that online
+encryption is a cheap non-obfuscated encryption plus one ciphertext
+multiplication per value.
+
+Every obfuscator is handed out once; reusing one would link ciphertexts.
+"""
+
+import logging
+import os
+import pickle
+import threading
+import uuid
+from typing import List, Tuple
+
+import torch
+
+from .keystore import _atomic_dump, key_fingerprint
+from .packing import PackedCiphertext
+
+logger = logging.getLogger(__name__)
+
+# Obfuscators computed per background step, bounds the lock hold time
+POOL_FILL_BATCH = 1024
+
+
+class ObfuscatorPool:
+    """
+    Pool of precomputed encryptions of zero for one public key
+
+    Parameters
+    ----------
+    pk, evaluator, coder
+        Raw (protocol level) cipher objects of the encryption kit
+    """
+
+    def __init__(self, pk, evaluator, coder):
+        self.pk = pk
+        self.evaluator = evaluator
+        self.coder = coder
+        self.fingerprint = key_fingerprint(pk)
+        self._batches: List[Tuple[object, int]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._filler = None
+
+    def __len__(self) -> int:
+        with self._cond:
+            return self._size
+
+    def _compute(self, n: int):
+        zeros = self.coder.encode_tensor(torch.zeros(n, dtype=torch.int64), torch.int64)
+        return self.pk.encrypt_encoded(zeros, obfuscate=True)
+
+    def _add(self, data, n: int):
+        with self._cond:
+            self._batches.append((data, n))
+            self._size += n
+            self._cond.notify_all()
+
+    def fill(self, n: int):
+        """Compute ``n`` obfuscators in the calling thread"""
+        for start in range(0, n, POOL_FILL_BATCH):
+            size = min(POOL_FILL_BATCH, n - start)
+            self._add(self._compute(size), size)
+
+    def fill_in_background(self, n: int):
+        """Start computing ``n`` obfuscators in a daemon thread"""
+        if n <= 0:
+            return
+        self._filler = threading.Thread(
+            target=self.fill, args=(n,), name="obfuscator-pool", daemon=True
+        )
+        self._filler.start()
+        logger.info(f"Precomputing {n} obfuscators in the background")
+
+    def _filling(self) -> bool:
+        return self._filler is not None and self._filler.is_alive()
+
+    def take(self, n: int):
+        """
+        Remove ``n`` obfuscators from the pool
+
+        Waits for a running background fill while the pool is short, and
+        computes whatever is still missing once it has finished.
+        """
+        parts = []
+        needed = n
+        with self._cond:
+            while needed > 0:
+                if not self._batches:
+                    if self._filling():
+                        self._cond.wait(timeout=1.0)
+                        continue
+                    break
+                data, size = self._batches.pop(0)
+                if size > needed:
+                    rest = self.evaluator.slice(data, needed, size - needed)
+                    self._batches.insert(0, (rest, size - needed))
+                    data = self.evaluator.slice(data, 0, needed)
+                    size = needed
+                parts.append(data)
+                self._size -= size
+                needed -= size
+
+        if needed > 0:
+            logger.warning(f"Obfuscator pool exhausted, computing {needed} online")
+            parts.append(self._compute(needed))
+        return parts[0] if len(parts) == 1 else self.evaluator.cat(parts)
+
+    def obfuscate(self, ciphertext):
+        """Re-randomize a non-obfuscated PHETensor or PackedCiphertext"""
+        if isinstance(ciphertext, PackedCiphertext):
+            data = self.evaluator.add(
+                ciphertext.data, self.take(ciphertext.num_ciphertexts), self.pk
+            )
+            return ciphertext._with(data, ciphertext.weight)
+        obfuscators = self.take(ciphertext.shape.numel())
+        return ciphertext.with_template(
+            self.evaluator.add(ciphertext.data, obfuscators, self.pk)
+        )
+
+    def save(self, path: str):
+        """
+        Persist the unused obfuscators, tagged with the key fingerprint
+
+        The file is replaced atomically and readable by the owner only: an
+        obfuscator known to others would unmask the value it is added to.
+        """
+        with self._cond:
+            batches = list(self._batches)
+        _atomic_dump({"fingerprint": self.fingerprint, "batches": batches}, path)
+        logger.info(f"Saved {sum(n for _, n in batches)} obfuscators to {path}")
+
+    def load(self, path: str):
+        """
+        Add obfuscators saved for this key, the file is removed once read
+
+        The file is first renamed to a name unique to this job, so that of two
+        jobs sharing the key only one gets its obfuscators. A file written for
+        another key is ignored.
+        """
+        claimed = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.claimed"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return
+        try:
+            with open(claimed, "rb") as f:
+                saved = pickle.load(f)
+        finally:
+            os.remove(claimed)
+        if saved.get("fingerprint") != self.fingerprint:
+            logger.warning(f"Ignoring obfuscator pool {path} saved for another key")
+            return
+        for data, n in saved["batches"]:
+            self._add(data, n)
+        logger.info(f"Loaded {len(self)} obfuscators from {path}")
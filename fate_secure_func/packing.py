@@ -0,0 +1,329 @@
+"""
+Plaintext Packing for Secure Function Component
+
+Packs several fixed-point guest values into one Paillier/OU plaintext so a
+single ciphertext carries a whole group of rows. Each slot holds
+``round(v * 2**precision) + offset``; the offset keeps slots non-negative and
+the headroom bits leave room for the host's additions, subtractions and
+integer scalar multiplications to grow the values without spilling into the
+neighbouring slot.
+"""
+
+import math
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Fractional bits of the fixed-point slot encoding
+DEFAULT_PACK_PRECISION = 16
+
+# Slots go through the coders' ``pack_floats`` as float64, which holds
+# integers exactly up to 53 bits
+MAX_SLOT_BITS = 53
+
+
+def plaintext_bits(kind: str, key_size: int) -> int:
+    """Usable plaintext bits of a key, OU plaintexts live modulo p (~n/3)"""
+    if kind == "ou":
+        return key_size // 3 - 2
+    return key_size - 2
+
+
+class PackLayout:
+    """
+    Slot layout shared by guest and host
+
+    Parameters
+    ----------
+    precision : int
+        Fractional bits of each slot
+    int_bits : int
+        Bits needed for the integer part of the largest guest value
+    headroom_bits : int
+        Extra bits reserved for growth under the host's formulas
+    pack_num : int
+        Slots per plaintext
+    """
+
+    def __init__(self, precision: int, int_bits: int, headroom_bits: int, pack_num: int):
+        self.precision = precision
+        self.int_bits = int_bits
+        self.headroom_bits = headroom_bits
+        self.pack_num = pack_num
+
+    @property
+    def slot_bits(self) -> int:
+        # one extra bit so that offset +/- the largest result stays in range
+        return self.precision + self.int_bits + self.headroom_bits + 1
+
+    @property
+    def offset(self) -> int:
+        return 1 << (self.slot_bits - 1)
+
+    @property
+    def scale(self) -> int:
+        return 1 << self.precision
+
+    @property
+    def max_abs_result(self) -> float:
+        """Largest magnitude a formula result may reach"""
+        return float(1 << (self.int_bits + self.headroom_bits))
+
+    def meta(self) -> dict:
+        """Plain dict of the layout, safe to send to the hosts"""
+        return {
+            "precision": self.precision,
+            "int_bits": self.int_bits,
+            "headroom_bits": self.headroom_bits,
+            "pack_num": self.pack_num,
+        }
+
+    @classmethod
+    def from_meta(cls, meta: dict) -> "PackLayout":
+        """Rebuild a layout from ``meta()``"""
+        return cls(
+            int(meta["precision"]),
+            int(meta["int_bits"]),
+            int(meta["headroom_bits"]),
+            int(meta["pack_num"]),
+        )
+
+    def pack(self, coder, slots: torch.Tensor):
+        """
+        Pack non-negative int64 slots into plaintexts
+
+        The slots are padded with ``offset`` (an encoded zero) to whole
+        plaintexts, so that every slot of a plaintext carries one offset.
+        """
+        padding = -len(slots) % self.pack_num
+        if padding:
+            slots = torch.cat([slots, torch.full((padding,), self.offset, dtype=torch.int64)])
+        return coder.pack_floats(slots.to(torch.float64), self.slot_bits, self.pack_num, 0)
+
+    def unpack(self, coder, encoded, num_rows: int) -> torch.Tensor:
+        """The first ``num_rows`` slots of packed plaintexts as int64"""
+        # Unpack whole plaintexts: a short last one is read from its other end
+        total = -(-num_rows // self.pack_num) * self.pack_num
+        # The FATE wrapper returns float32, which drops the low bits of wide
+        # slots; read the float64 list of the fate_utils coder instead
+        slots = coder.coder.unpack_floats(encoded, self.slot_bits, self.pack_num, 0, total)
+        return torch.tensor(slots[:num_rows], dtype=torch.float64).to(torch.int64)
+
+    def __repr__(self) -> str:
+        return (
+            f"PackLayout(precision={self.precision}, int_bits={self.int_bits}, "
+            f"headroom_bits={self.headroom_bits}, pack_num={self.pack_num}, "
+            f"slot_bits={self.slot_bits})"
+        )
+
+
+def make_layout(
+    max_abs: float,
+    kind: str,
+    key_size: int,
+    headroom_bits: int,
+    precision: int = DEFAULT_PACK_PRECISION,
+):
+    """
+    Choose a packing layout for values bounded by ``max_abs``
+
+    Returns
+    -------
+    PackLayout or None
+        None when not even two slots fit into one plaintext
+    """
+    int_bits = max(1, math.ceil(math.log2(max_abs + 1)))
+    layout = PackLayout(precision, int_bits, headroom_bits, pack_num=1)
+    if layout.slot_bits > MAX_SLOT_BITS:
+        logger.warning(
+            f"Packing disabled: {layout.slot_bits} bit slots exceed {MAX_SLOT_BITS} bits"
+        )
+        return None
+
+    layout.pack_num = plaintext_bits(kind, key_size) // layout.slot_bits
+    if layout.pack_num < 2:
+        logger.warning(f"Packing disabled: key of {key_size} bits fits less than 2 slots")
+        return None
+    return layout
+
+
+class PackedCiphertext:
+    """
+    Ciphertext vector whose plaintexts each hold ``layout.pack_num`` rows
+
+    Supports the operations of a ``FormulaPlan``: addition and subtraction of
+    packed ciphertexts, multiplication by integers and adding constants.
+    ``weight`` counts how many offsets the slots currently carry; ``normalize``
+    brings it back to one before the result is sent to the guest.
+    """
+
+    def __init__(self, pk, evaluator, coder, layout: PackLayout, data, num_rows: int, weight: int = 1):
+        self.pk = pk
+        self.evaluator = evaluator
+        self.coder = coder
+        self.layout = layout
+        self.data = data
+        self.num_rows = num_rows
+        self.weight = weight
+
+    @property
+    def num_ciphertexts(self) -> int:
+        return -(-self.num_rows // self.layout.pack_num)
+
+    def _with(self, data, weight: int) -> "PackedCiphertext":
+        return PackedCiphertext(
+            self.pk, self.evaluator, self.coder, self.layout, data, self.num_rows, weight
+        )
+
+    def _encrypt_slots(self, slot_value: int):
+        """Encrypt (without obfuscation) a vector repeating slot_value in every slot"""
+        slots = torch.full(
+            (self.num_ciphertexts * self.layout.pack_num,), slot_value, dtype=torch.int64
+        )
+        encoded = self.layout.pack(self.coder, slots)
+        return self.pk.encrypt_encoded(encoded, obfuscate=False)
+
+    def _add_slot_constant(self, data, slot_value: int):
+        if slot_value >= 0:
+            return self.evaluator.add(data, self._encrypt_slots(slot_value), self.pk)
+        return self.evaluator.sub(data, self._encrypt_slots(-slot_value), self.pk)
+
+    def _check_packed(self, other):
+        if not isinstance(other, PackedCiphertext):
+            raise TypeError(f"Cannot combine packed ciphertexts with {type(other)}")
+        if other.num_rows != self.num_rows:
+            raise ValueError(f"Row mismatch {self.num_rows} != {other.num_rows}")
+
+    def __add__(self, other):
+        if isinstance(other, (int, float)):
+            slot_value = round(other * self.layout.scale)
+            return self._with(self._add_slot_constant(self.data, slot_value), self.weight)
+        self._check_packed(other)
+        data = self.evaluator.add(self.data, other.data, self.pk)
+        return self._with(data, self.weight + other.weight)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        if isinstance(other, (int, float)):
+            return self.__add__(-other)
+        self._check_packed(other)
+        data = self.evaluator.sub(self.data, other.data, self.pk)
+        return self._with(data, self.weight - other.weight)
+
+    def __rsub__(self, other):
+        if not isinstance(other, (int, float)):
+            return NotImplemented
+        # other - self == E(other) - self, built from a non-negative constant
+        slot_value = round(other * self.layout.scale)
+        data = self.evaluator.sub(self._encrypt_slots(max(slot_value, 0)), self.data, self.pk)
+        if slot_value < 0:
+            data = self._add_slot_constant(data, slot_value)
+        return self._with(data, -self.weight)
+
+    def __mul__(self, other):
+        if isinstance(other, float) and other.is_integer():
+            other = int(other)
+        if not isinstance(other, int):
+            raise ValueError(
+                f"Packed ciphertexts only support integer coefficients, got {other}"
+            )
+        if other < 0:
+            return (0 - self) * (-other)
+        data = self.evaluator.mul_plain_scalar(
+            self.data, other, self.pk, self.coder, torch.int64
+        )
+        return self._with(data, self.weight * other)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def normalize(self) -> "PackedCiphertext":
+        """Make every slot carry exactly one offset again"""
+        if self.weight == 1:
+            return self
+        missing = 1 - self.weight
+        offsets = self._encrypt_slots(self.layout.offset)
+        if abs(missing) != 1:
+            offsets = self.evaluator.mul_plain_scalar(
+                offsets, abs(missing), self.pk, self.coder, torch.int64
+            )
+        if missing > 0:
+            data = self.evaluator.add(self.data, offsets, self.pk)
+        else:
+            data = self.evaluator.sub(self.data, offsets, self.pk)
+        return self._with(data, 1)
+
+
+class Packer:
+    """
+    Guest-side packing, encryption and unpacking of columns
+
+    Parameters
+    ----------
+    pk, evaluator, coder
+        Raw (protocol level) cipher objects of the encryption kit
+    layout : PackLayout
+        Slot layout
+    """
+
+    def __init__(self, pk, evaluator, coder, layout: PackLayout):
+        self.pk = pk
+        self.evaluator = evaluator
+        self.coder = coder
+        self.layout = layout
+
+    def encrypt(self, column: torch.Tensor, obfuscate: bool = False) -> PackedCiphertext:
+        """Pack and encrypt one column of values"""
+        column = column.detach().flatten()
+        if column.dtype == torch.int64:
+            # Exactly encoded values, no float rounding on the way
+            slots = column * self.layout.scale + self.layout.offset
+        else:
+            column = column.to(torch.float64)
+            slots = torch.round(column * self.layout.scale).to(torch.int64) + self.layout.offset
+        encoded = self.layout.pack(self.coder, slots)
+        data = self.pk.encrypt_encoded(encoded, obfuscate=obfuscate)
+        return PackedCiphertext(
+            self.pk, self.evaluator, self.coder, self.layout, data, len(column)
+        )
+
+    def decrypt(self, sk, packed: PackedCiphertext) -> torch.Tensor:
+        """
+        Decrypt and unpack a normalized result column
+
+        Slots without fractional bits come back as int64, others as float64.
+        """
+        encoded = sk.decrypt_to_encoded(packed.data)
+        slots = self.layout.unpack(self.coder, encoded, packed.num_rows)
+        if self.layout.precision == 0:
+            return slots - self.layout.offset
+        return (slots - self.layout.offset).to(torch.float64) / self.layout.scale
+
+
+def check_plan_packable(plan, layout: PackLayout):
+    """
+    Validate that every formula stays exact under the packing layout
+
+    Raises
+    ------
+    ValueError
+        If a formula uses a non-integer coefficient or could overflow a slot
+    """
+    for idx, expr in plan.exprs.items():
+        for col, coef in expr.coefs.items():
+            if not isinstance(coef, int):
+                raise ValueError(
+                    f"Formula {idx} uses non-integer coefficient {coef} for '{col}', "
+                    f"which packing does not support"
+                )
+        bound = sum(abs(c) for c in expr.coefs.values()) * (1 << layout.int_bits)
+        bound += abs(expr.const)
+        if bound >= layout.max_abs_result:
+            raise ValueError(
+                f"Formula {idx} may exceed the packing headroom "
+                f"({layout.headroom_bits} bits), increase pack_headroom_bits"
+            )
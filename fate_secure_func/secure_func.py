@@ -2,12 +2,23 @@
 Secure Function Component
 
 Main entry point for the secure function computation component.
+
+FATE loads this module to discover the component, in the scheduler and in
+every task process. The role implementations, and with them torch, pandas
+and the FATE dataframe manager, are imported only when a guest or host task
+runs (``benchmarks/import_time.py`` checks the cold-import budget).
 """
 
 from fate.arch import Context
 from fate.components.core import GUEST, HOST, Role, cpn, params
-from .secure_func_guest import SecureFuncGuest
-from .secure_func_host import SecureFuncHost
+
+
+class HEParam(params.HEParam):
+    """FATE's HE parameters plus the "auto" kind, picked by a local microbenchmark"""
+
+    kind: params.string_choice(["paillier", "ou", "mock", "auto"])
+    # Used by "auto" only, 112 bits is a 2048 bit modulus
+    min_security_bits: int = 112
 
 
 @cpn.component(roles=[GUEST, HOST], provider="iotsp")
@@ -18,11 +29,147 @@ def secure_func(
     formula: cpn.dataframe_input(
         roles=[HOST], desc="Input formula/coefficients from host"
     ),
+    batch_values: cpn.dataframe_inputs(
+        roles=[GUEST],
+        desc="More guest values tables, each evaluated as its own batch under the same key",
+        optional=True,
+    ),
     result: cpn.dataframe_output(roles=[GUEST], desc="Computed result"),
+    batch_results: cpn.dataframe_outputs(
+        roles=[GUEST],
+        desc="Computed result of every batch, in batch order",
+        optional=True,
+    ),
     he_param: cpn.parameter(
-        type=params.he_param(),
-        default=params.HEParam(kind="paillier", key_length=1024),
-        desc="Homomorphic encryption parameters (paillier, ou, or mock)",
+        type=HEParam,
+        default=HEParam(kind="paillier", key_length=1024),
+        desc="Homomorphic encryption parameters (paillier, ou, mock, or auto to pick "
+        "the fastest scheme and key length reaching min_security_bits on this machine)",
+    ),
+    encrypt_mode: cpn.parameter(
+        type=params.string_choice(["local", "partition"]),
+        default="local",
+        desc="Where guest values are encrypted: 'local' collects them to one "
+        "process, 'partition' encrypts each block in parallel on the computing engine",
+    ),
+    chunk_size: cpn.parameter(
+        type=params.conint(ge=0),
+        default=0,
+        desc="Rows per encrypted message in 'local' mode; chunks are encrypted, "
+        "evaluated and decrypted as a pipeline. 0 sends all rows in one message",
+    ),
+    pack: cpn.parameter(
+        type=bool,
+        default=False,
+        desc="Pack several guest values into each plaintext (paillier/ou only); "
+        "formulas must use integer coefficients",
+    ),
+    pack_headroom_bits: cpn.parameter(
+        type=params.conint(gt=0),
+        default=8,
+        desc="Bits reserved in each packed slot for growth of values under the formulas",
+    ),
+    decrypt_partitions: cpn.parameter(
+        type=params.conint(ge=0),
+        default=0,
+        desc="Computing partitions that decrypt results in parallel in 'local' mode; "
+        "0 uses the partition count of the guest values",
+    ),
+    obfuscation_pool: cpn.parameter(
+        type=params.conint(ge=0),
+        default=0,
+        desc="Obfuscators to precompute in the background while the guest values "
+        "are read; ciphertexts are then re-randomized from the pool. 0 disables "
+        "obfuscation as before",
+    ),
+    obfuscation_pool_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Guest-local file keeping unused obfuscators for later jobs with the same key",
+    ),
+    keystore_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Local directory caching keys between jobs: the guest keeps its kit "
+        "per host set and he_param, the host keeps received public keys",
+    ),
+    key_max_age: cpn.parameter(
+        type=params.conint(ge=0),
+        default=86400,
+        desc="Seconds a cached guest key stays in use before a new one is generated, 0 for no limit",
+    ),
+    key_max_uses: cpn.parameter(
+        type=params.conint(ge=0),
+        default=1000,
+        desc="Jobs a cached guest key serves before a new one is generated, 0 for no limit",
+    ),
+    metrics_trace_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Local file each party also writes its per-phase metrics to as JSON",
+    ),
+    incremental_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Local directory keeping row slots (guest) or ciphertexts (host) between jobs, to send only changed rows",
+    ),
+    encoding: cpn.parameter(
+        type=params.string_choice(["float", "integer", "fixed_point"]),
+        default="float",
+        desc="Plaintext encoding of guest values: 'integer' and 'fixed_point' encrypt "
+        "exact int64 values, formulas must then use integer coefficients",
+    ),
+    encoding_precision: cpn.parameter(
+        type=params.conint(ge=0),
+        default=4,
+        desc="Decimal digits kept by 'fixed_point' encoding",
+    ),
+    formula_type: cpn.parameter(
+        type=params.string_choice(["expression", "matrix"]),
+        default="expression",
+        desc="Host input: 'expression' reads an id/formula table, 'matrix' a table of "
+        "one coefficient column per guest column, applied as an encrypted matrix product",
+    ),
+    eval_partitions: cpn.parameter(
+        type=params.conint(ge=0),
+        default=0,
+        desc="Computing partitions evaluating the formula plan in row batches in "
+        "'local' mode; 0 uses the partition count of the guest values",
+    ),
+    spill_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Local directory for memory-mapped spill files: in 'local' mode received "
+        "ciphertexts are decoded and evaluated or decrypted segment by segment; the "
+        "wire buffers of a whole chunk still pass through memory, only chunk_size "
+        "bounds them",
+    ),
+    checkpoint_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Local directory, e.g. under the job's working directory, keeping the key, "
+        "encrypted chunks, host results and decrypted chunks of a 'local' mode job so "
+        "that a retried task resumes from the completed chunks",
+    ),
+    he_benchmark_path: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="File caching the scheme timings of he_param kind 'auto' on this machine, "
+        "so that only the first job runs the microbenchmark",
+    ),
+    batch_column: cpn.parameter(
+        type=str,
+        default=None,
+        optional=True,
+        desc="Guest column splitting every values table into independent batches, "
+        "one per distinct value, run under one key setup and federation session",
     ),
 ):
     """
@@ -43,10 +190,55 @@ def secure_func(
         Input values (from guest)
     formula : DataFrame
         Formula/coefficients (from host)
+    batch_values : list
+        More values tables (from guest), each run as a batch
     result : DataFrame
         Output result (to guest)
+    batch_results : list
+        Output result of every batch (to guest)
     he_param : HEParam
-        Homomorphic encryption parameters
+        Homomorphic encryption parameters, kind "auto" picks the scheme
+    encrypt_mode : str
+        Encryption mode for guest values ("local" or "partition")
+    chunk_size : int
+        Rows per streamed chunk in "local" mode, 0 for a single message
+    pack : bool
+        Whether to pack several guest values into one plaintext
+    pack_headroom_bits : int
+        Bits reserved per packed slot for the formulas' growth
+    decrypt_partitions : int
+        Partitions decrypting results in "local" mode, 0 for the values' own
+    obfuscation_pool : int
+        Obfuscators precomputed before encryption, 0 to disable
+    obfuscation_pool_path : str
+        File keeping unused obfuscators between jobs
+    keystore_path : str
+        Directory caching keys between jobs
+    key_max_age : int
+        Seconds a cached guest key stays in use
+    key_max_uses : int
+        Jobs a cached guest key serves
+    metrics_trace_path : str
+        File the per-phase metrics are also written to
+    incremental_path : str
+        Directory keeping state between jobs to send only changed rows
+    encoding : str
+        Plaintext encoding of guest values ("float", "integer" or "fixed_point")
+    encoding_precision : int
+        Decimal digits kept by "fixed_point" encoding
+    formula_type : str
+        Host input type ("expression" or "matrix")
+    eval_partitions : int
+        Partitions evaluating the plan in "local" mode, 0 for the guest
+        values' own
+    spill_path : str
+        Directory encrypted columns are spilled to in "local" mode
+    checkpoint_path : str
+        Directory keeping completed chunks so that a retry resumes
+    he_benchmark_path : str
+        File caching the scheme timings of kind "auto"
+    batch_column : str
+        Column splitting the values tables into batches
 
     Examples
     --------
@@ -61,17 +253,142 @@ def secure_func(
     ... )
     """
     if role.is_guest:
-        ctx.cipher.set_phe(ctx.device, he_param.dict())
+        from .secure_func_guest import SecureFuncGuest
+
+        tables = [values.read()] + [table.read() for table in batch_values or []]
+        he_options = {"kind": he_param.kind, "key_length": he_param.key_length}
+        if he_param.kind == "auto":
+            from .encoding import ValueEncoding
+            from .selection import select_scheme
 
-        sfg = SecureFuncGuest(ctx)
-        sfg.encrypt_and_send(values.read())
-        result_data = sfg.receive_and_decrypt()
+            he_options = select_scheme(
+                ctx.cipher.phe,
+                he_param.min_security_bits,
+                ValueEncoding(encoding, encoding_precision),
+                pack=pack,
+                cache_path=he_benchmark_path,
+            )
+        ctx.cipher.set_phe(ctx.device, he_options)
 
-        result.write(result_data)
+        sfg = SecureFuncGuest(
+            ctx,
+            encrypt_mode=encrypt_mode,
+            chunk_size=chunk_size,
+            pack=pack,
+            pack_headroom_bits=pack_headroom_bits,
+            decrypt_partitions=decrypt_partitions,
+            obfuscation_pool=obfuscation_pool,
+            obfuscation_pool_path=obfuscation_pool_path,
+            keystore_path=keystore_path,
+            key_max_age=key_max_age,
+            key_max_uses=key_max_uses,
+            metrics_trace_path=metrics_trace_path,
+            incremental_path=incremental_path,
+            encoding=encoding,
+            encoding_precision=encoding_precision,
+            spill_path=spill_path,
+            checkpoint_path=checkpoint_path,
+        )
+        # Batches of values first, then of every batch_values table
+        batches = [
+            _split_batches(ctx, table, batch_column) if batch_column else [table]
+            for table in tables
+        ]
+        results = sfg.run_batches([batch for table in batches for batch in table])
+
+        num_values_batches = len(batches[0])
+        if num_values_batches == 1:
+            result.write(results[0])
+        else:
+            from fate.arch.dataframe import DataFrame
+
+            result.write(DataFrame.vstack(results[:num_values_batches]))
+        if len(results) > 1 and batch_results is not None:
+            for result_data in results:
+                next(batch_results).write(result_data)
 
     elif role.is_host:
-        sfh = SecureFuncHost(ctx)
-        sfh.eval(formula.read())
+        from .secure_func_host import SecureFuncHost
+
+        sfh = SecureFuncHost(
+            ctx,
+            keystore_path=keystore_path,
+            metrics_trace_path=metrics_trace_path,
+            incremental_path=incremental_path,
+            formula_type=formula_type,
+            eval_partitions=eval_partitions,
+            spill_path=spill_path,
+            checkpoint_path=checkpoint_path,
+        )
+        sfh.eval_batches(formula.read())
 
     else:
         raise ValueError(f"Unsupported role: {role}. Must be GUEST or HOST.")
+
+
+def _split_batches(ctx, values, column: str) -> list:
+    """
+    Rows of a values table per distinct value of ``column``, in value order
+
+    Only the distinct values reach the guest, reduced from the blocks; every
+    batch is a filter of the table and stays on the computing engine.
+    """
+    import functools
+
+    from fate.arch.dataframe import DataFrame
+
+    if column not in values.schema.columns:
+        raise ValueError(f"Batch column {column!r} is not a values column")
+    bid, offset = values.data_manager.loc_block(column, with_offset=True)
+    labels = values.block_table.mapValues(
+        functools.partial(_block_labels, bid=bid, offset=offset)
+    ).reduce(lambda a, b: a | b)
+    # (block id, row) -> (sample id, row of every block)
+    rows = values.flatten(key_type="block_id", with_sample_id=True)
+    return [
+        DataFrame.from_flatten_data(
+            ctx,
+            rows.filter(functools.partial(_in_batch, bid=bid, offset=offset, label=label)),
+            values.data_manager,
+            key_type="block_id",
+        )
+        for label in _sorted_labels(column, labels or set())
+    ]
+
+
+def _block_labels(blocks: list, bid: int, offset: int) -> set:
+    """Distinct values of one column in a partition's blocks"""
+    return set(blocks[bid][:, offset].tolist())
+
+
+def _in_batch(row: tuple, bid: int, offset: int, label) -> bool:
+    """Whether a flattened row belongs to the batch of ``label``"""
+    return row[1][bid][offset] == label
+
+
+def _sorted_labels(column: str, labels: set) -> list:
+    """
+    Batch labels in order, ints and floats compare as numbers
+
+    NaN never equals itself, every missing value would be a batch of its own,
+    and labels of different types have no order, so both are rejected.
+    """
+    import math
+    import numbers
+
+    kinds = set()
+    for label in labels:
+        if isinstance(label, numbers.Real) and not isinstance(label, bool):
+            if math.isnan(label):
+                raise ValueError(
+                    f"Batch column {column!r} has missing values, every row needs a batch"
+                )
+            kinds.add("number")
+        else:
+            kinds.add(type(label).__name__)
+    if len(kinds) > 1:
+        raise ValueError(
+            f"Batch column {column!r} mixes value types ({', '.join(sorted(kinds))}), "
+            "its values must all be numbers or all strings"
+        )
+    return sorted(labels)
@@ -6,11 +6,30 @@ from fate.arch.dataframe.manager import BlockType
 from fate.arch.dataframe import DataFrame
 from fate.arch import Context
 from torch import Tensor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .aggregate import broadcast, finish_aggregate, group_codes
+from .checkpoint import GuestCheckpoint, checkpoint_digest, checkpoint_keys, resume_actions
+from .decryption import ParallelDecryptor, decrypt_column
+from .encoding import ValueEncoding
+from .incremental import GuestRowCache, SlotAssignment, reusable_layout, row_hashes
+from .keystore import GuestKeyStore, key_fingerprint
+from .metrics import PhaseMetrics, ciphertext_bytes, count_ciphertexts
+from .obfuscation import ObfuscatorPool
+from .packing import Packer, make_layout
+from .spill import DEFAULT_SEGMENT_ROWS, SpillFile, segment_bounds
+from .wire import WireCodec, payload_bytes
+import numpy as np
+import pandas as pd
+import functools
 import logging
 import copy
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Number of chunks kept in flight ahead of the one being decrypted
+PIPELINE_DEPTH = 2
+
 
 class SecureFuncGuest:
     """
@@ -18,15 +37,43 @@ class SecureFuncGuest:
 
     The guest party:
     1. Initializes homomorphic encryption kit
-    2. Encrypts input values
-    3. Sends encrypted values to host
-    4. Receives and decrypts results
+    2. Encrypts the input columns the hosts' formulas reference
+    3. Sends each host the encrypted columns it needs
+    4. Receives every host's results as they arrive and decrypts them
+
+    With several hosts, output columns are named ``host_<party_id>_<formula
+    id>``; with a single host they keep the formula ids. Aggregate formulas
+    fill their column with the value of each row's group; the values per
+    group are also kept in ``aggregates``. ``run_batches`` runs several
+    values tables as sub-jobs of one key exchange.
     """
 
     values: DataFrame
-    idxvalues: dict
+    columns: list
+    host_columns: list
+    host_aggregates: list
+    aggregates: dict
 
-    def __init__(self, ctx: Context):
+    def __init__(
+        self,
+        ctx: Context,
+        encrypt_mode: str = "local",
+        chunk_size: int = 0,
+        pack: bool = False,
+        pack_headroom_bits: int = 8,
+        decrypt_partitions: int = 0,
+        obfuscation_pool: int = 0,
+        obfuscation_pool_path: str = None,
+        keystore_path: str = None,
+        key_max_age: int = 0,
+        key_max_uses: int = 0,
+        metrics_trace_path: str = None,
+        incremental_path: str = None,
+        encoding: str = "float",
+        encoding_precision: int = 4,
+        spill_path: str = None,
+        checkpoint_path: str = None,
+    ):
         """
         Initialize guest component
 
@@ -34,13 +81,112 @@ class SecureFuncGuest:
         ----------
         ctx : Context
             FATE context
+        encrypt_mode : str
+            "local" encrypts on the driver after collecting the values,
+            "partition" encrypts each block of the values table in place
+        chunk_size : int
+            Rows per message in "local" mode, 0 sends all rows at once
+        pack : bool
+            Pack several values into each plaintext before encryption
+        pack_headroom_bits : int
+            Bits reserved in every packed slot for growth under the formulas
+        decrypt_partitions : int
+            Partitions used to decrypt results in "local" mode, 0 uses as
+            many as the values table has
+        obfuscation_pool : int
+            Obfuscators to precompute in the background, 0 keeps encrypting
+            without obfuscation
+        obfuscation_pool_path : str, optional
+            File the unused obfuscators are kept in between jobs
+        keystore_path : str, optional
+            Directory caching the encryption kit between jobs
+        key_max_age : int
+            Seconds a cached kit stays in use, 0 for no limit
+        key_max_uses : int
+            Jobs a cached kit serves, 0 for no limit
+        metrics_trace_path : str, optional
+            File the per-phase metrics are also written to as JSON
+        incremental_path : str, optional
+            Directory keeping row slots and hashes between jobs; only new or
+            modified rows are then encrypted in "local" mode
+        encoding : str
+            "float" encrypts values as floats, "integer" and "fixed_point"
+            as exact int64 plaintexts
+        encoding_precision : int
+            Decimal digits kept by "fixed_point" encoding
+        spill_path : str, optional
+            Directory for memory-mapped spill files; results are then
+            decrypted segment by segment in "local" mode
+        checkpoint_path : str, optional
+            Directory keeping the key, encrypted chunks and decrypted
+            results of the job, so that a retry resumes in "local" mode
         """
         self.ctx = ctx
-        self._init_encrypt_kit()
+        self.encrypt_mode = encrypt_mode
+        self.chunk_size = chunk_size
+        self.pack = pack
+        self.pack_headroom_bits = pack_headroom_bits
+        self.decrypt_partitions = decrypt_partitions
+        self._encoding = ValueEncoding(encoding, encoding_precision)
+        self._encoding_meta = None
+        self._packer = None
+        self._increment = None
+        self._row_cache = GuestRowCache(incremental_path) if incremental_path else None
+        self._spill_path = spill_path
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint = None
+        # Host index -> checkpoint action of every chunk
+        self._actions = None
+        # Host index -> formula digest keying its decrypted chunks
+        self._host_digests = None
+        self._send_queue = []
+        self._kit_sent = False
+        # Batch sub-jobs leave cleanup and reporting to run_batches
+        self._batched = False
+        self.metrics = PhaseMetrics("guest", metrics_trace_path)
+        self._keystore = (
+            GuestKeyStore(keystore_path, key_max_age, key_max_uses)
+            if keystore_path
+            else None
+        )
+        with self.metrics.phase("key_setup"):
+            self._init_encrypt_kit()
+        self._obfuscator_pool = None
+        self._obfuscation_pool_path = obfuscation_pool_path
+        # Partitions cannot take from the driver's pool, they obfuscate online
+        self._obfuscate_partitions = False
+        if obfuscation_pool > 0 and encrypt_mode == "partition":
+            logger.warning(
+                "encrypt_mode 'partition' obfuscates inside the partitions, "
+                "obfuscation pool not used"
+            )
+            self._obfuscate_partitions = self._encrypt_kit.kind != "mock"
+        elif obfuscation_pool > 0:
+            self._init_obfuscator_pool(obfuscation_pool)
 
     def _init_encrypt_kit(self):
-        """Initialize homomorphic encryption kit"""
-        kit = self.ctx.cipher.phe.setup()
+        """Initialize homomorphic encryption kit, reusing a stored one if allowed"""
+        kit = None
+        builder = self.ctx.cipher.phe
+        scope = GuestKeyStore.scope(
+            self.ctx.local.party_id,
+            [host.party_id for host in self.ctx.hosts],
+            builder.kind,
+            builder.key_length,
+        )
+        # A retried job keeps the key its checkpointed chunks are encrypted under
+        checkpoint_kit = None
+        if self._checkpoint_path:
+            checkpoint_kit = kit = checkpoint_keys(self._checkpoint_path).load(scope)
+        if kit is None and self._keystore is not None:
+            kit = self._keystore.load(scope)
+        if kit is None:
+            kit = self.ctx.cipher.phe.setup()
+            if self._keystore is not None:
+                self._keystore.save(scope, kit)
+        if self._checkpoint_path and checkpoint_kit is None:
+            checkpoint_keys(self._checkpoint_path).save(scope, kit)
+        self._kit_scope = scope
         self._encrypt_kit = kit
         self._en_key_length = kit.key_size
         (
@@ -58,10 +204,28 @@ class SecureFuncGuest:
             kit.get_tensor_encryptor(),
             kit.get_tensor_decryptor(),
         )
+        self._fingerprint = key_fingerprint(self._pk)
+        self.metrics.ciphertext_size = ciphertext_bytes(kit.kind, kit.key_size)
         logger.info(
             f"Encryption kit initialized with key length: {self._en_key_length}"
         )
 
+    def _init_obfuscator_pool(self, size: int):
+        """Start precomputing obfuscators, before the values are even read"""
+        if self._encrypt_kit.kind == "mock":
+            logger.warning("mock encryption has no obfuscation, pool disabled")
+            return
+        pool = ObfuscatorPool(self._pk, self._evaluator, self._coder)
+        if self._obfuscation_pool_path:
+            pool.load(self._obfuscation_pool_path)
+        pool.fill_in_background(size - len(pool))
+        self._obfuscator_pool = pool
+
+    def _save_obfuscator_pool(self):
+        """Keep the unused obfuscators for the next job with this key"""
+        if self._obfuscator_pool is not None and self._obfuscation_pool_path:
+            self._obfuscator_pool.save(self._obfuscation_pool_path)
+
     def encrypt_and_send(self, values: DataFrame):
         """
         Encrypt values and send to host
@@ -73,47 +237,847 @@ class SecureFuncGuest:
         """
 
         self.values = values
+        self._packer = None
+        self._increment = None
+        self._checkpoint = None
+        self._actions = None
+        self._host_digests = None
+        self._send_queue = []
 
         # Encrypt each value
         logger.info(f"Encrypting {len(values)} values...")
 
-        values_df = values.as_pd_df()
-        self.idxvalues = {vidx: idx for idx, vidx in enumerate(values_df["id"])}
-        en_vals = {
-            col: self._encryptor.encrypt_tensor(Tensor(values_df[col]))
-            for col in values.columns
+        with self.metrics.phase("key_exchange"):
+            if not self._kit_sent:
+                self._send_encrypt_kit()
+            self.columns = self._receive_required_columns(values)
+            self._receive_aggregate_maps(values)
+            if self._row_cache is not None:
+                host_tokens = self.ctx.hosts.get("inc_token")
+
+        max_abs = self._max_abs(values) if self.pack or self._encoding.exact else None
+        self._encoding_meta = self._encoding.meta(
+            max_abs, self._encrypt_kit.kind, self._en_key_length
+        )
+        if self.pack:
+            self._init_packer(max_abs)
+        if self._row_cache is not None:
+            if self.encrypt_mode == "local":
+                self._plan_increment(values, host_tokens)
+            else:
+                logger.warning("Incremental mode needs encrypt_mode 'local', ignored")
+        if self._checkpoint_path and (
+            self.encrypt_mode != "local" or self._increment is not None
+        ):
+            logger.warning(
+                "Checkpoints need encrypt_mode 'local' without incremental mode, ignored"
+            )
+        layout = self._packer.layout if self._packer is not None else None
+        self._wire = WireCodec(
+            self._pk, self._evaluator, self._coder, self.ctx.device, layout
+        )
+        en_meta = {
+            "pack": layout.meta() if layout is not None else None,
+            "encoding": self._encoding_meta,
+            "num_rows": len(values),
+            # Hosts evaluate "local" chunks on as many partitions
+            "num_partitions": values.block_table.num_partitions,
+            "ciphertext_bytes": self.metrics.ciphertext_size,
+        }
+
+        if self.encrypt_mode == "partition":
+            self._init_groups(values)
+            self._send_meta(dict(en_meta, mode="partition"))
+            if self._groups:
+                self._send_group_blocks(values)
+            with self.metrics.phase("encryption"):
+                en_vals = self._encrypt_partitioned(values)
+            self.metrics.count(
+                "encryption", self._num_ciphertexts(len(values), len(self.columns))
+            )
+            logger.info("Sending encrypted values to host...")
+            with self.metrics.phase("send"):
+                self._send_values(
+                    self.ctx,
+                    en_vals,
+                    lambda table, columns: table.mapValues(
+                        functools.partial(_select_columns, columns=columns)
+                    ),
+                )
+            self.metrics.count(
+                "send",
+                sum(
+                    self._num_ciphertexts(len(values), len(columns))
+                    for columns in self.host_columns
+                ),
+            )
+            logger.info("Encrypted values sent to host")
+            self._save_obfuscator_pool()
+        elif self._increment is not None:
+            # The whole delta goes as one chunk, the hosts patch their copies
+            self._chunks = [(0, len(self._values_df))]
+            self._init_groups(values)
+            self._send_meta(
+                dict(en_meta, mode="local", num_chunks=1, incremental=self._increment)
+            )
+            self._actions = [["evaluate"] for _ in self.ctx.hosts]
+            self._send_delta()
+        else:
+            self._prepare_chunks(values)
+            self._init_groups(values)
+            en_meta = dict(en_meta, mode="local", num_chunks=len(self._chunks))
+            if self._checkpoint_path:
+                en_meta.update(checkpoint=self._open_checkpoint(), chunks=self._chunks)
+            self._send_meta(en_meta)
+            self._plan_resume()
+            # Prime the pipeline, the rest is sent while results come back
+            for _ in range(PIPELINE_DEPTH):
+                self._send_next_chunk()
+
+    def _send_encrypt_kit(self):
+        """Send the public key to the hosts that have not cached it yet"""
+        self.ctx.hosts.put("en_kit_fingerprint", self._fingerprint)
+        needed = self.ctx.hosts.get("en_kit_needed")
+        for host, host_needs_kit in zip(self.ctx.hosts, needed):
+            if host_needs_kit:
+                host.put("en_kit", [self._pk, self._evaluator, self._coder])
+            else:
+                logger.info(f"{host.name} has key {self._fingerprint} cached")
+        self._kit_sent = True
+
+    def _receive_required_columns(self, values: DataFrame) -> list:
+        """
+        Get the columns the hosts' formulas reference, in values order
+
+        Sets ``host_columns`` to the columns of each host and returns their
+        union, which is encrypted once and shared by all hosts.
+        """
+        required = set()
+        self.host_columns = []
+        for host_columns in self.ctx.hosts.get("required_columns"):
+            host_columns = set(host_columns)
+            required.update(host_columns)
+            self.host_columns.append(
+                [col for col in values.columns if col in host_columns]
+            )
+
+        unknown = sorted(required - set(values.columns))
+        if unknown:
+            raise ValueError(f"Host formulas reference unknown guest columns: {unknown}")
+
+        columns = [col for col in values.columns if col in required]
+        logger.info(
+            f"Encrypting {len(columns)} of {len(values.columns)} columns: {columns}"
+        )
+        return columns
+
+    def _receive_aggregate_maps(self, values: DataFrame):
+        """Get each host's aggregate key -> (function, group column) map"""
+        self.host_aggregates = self.ctx.hosts.get("aggregate_map")
+        groups = set(
+            group
+            for aggregates in self.host_aggregates
+            for _, group in aggregates.values()
+            if group is not None
+        )
+        unknown = sorted(groups - set(values.columns))
+        if unknown:
+            raise ValueError(f"Host aggregates group by unknown guest columns: {unknown}")
+
+    def _init_groups(self, values: DataFrame):
+        """
+        Index the groups of every group column the hosts' aggregates use
+
+        Sets ``_groups`` to group column -> (group index of every row in
+        ``_values_df`` order, group labels); None groups all rows together.
+        """
+        self._groups = {}
+        groups = set(
+            group for aggregates in self.host_aggregates for _, group in aggregates.values()
+        )
+        if not groups:
+            return
+        named = sorted(group for group in groups if group is not None)
+        if self.encrypt_mode == "partition":
+            # Only the labels are needed here, blocks index their own rows
+            group_df = values[named].as_pd_df() if named else None
+        else:
+            group_df = self._values_df
+        for group in groups:
+            if group is None:
+                self._groups[None] = (np.zeros(len(values), dtype=np.int64), [None])
+            else:
+                self._groups[group] = group_codes(group_df[group])
+        logger.info(
+            f"Aggregating over {', '.join(f'{len(labels)} groups of {group}' for group, (_, labels) in self._groups.items())}"
+        )
+
+    def _host_groups(self, h: int) -> list:
+        return sorted(
+            set(group for _, group in self.host_aggregates[h].values()),
+            key=lambda group: (group is not None, group or ""),
+        )
+
+    def _send_meta(self, en_meta: dict):
+        """Send the metadata, with the group indices each host's aggregates need"""
+        if not self._groups:
+            self.ctx.hosts.put("en_meta", en_meta)
+            return
+        for h, host in enumerate(self.ctx.hosts):
+            groups = self._host_groups(h)
+            meta = dict(en_meta, groups={g: len(self._groups[g][1]) for g in groups})
+            if en_meta["mode"] == "local":
+                meta["group_codes"] = {g: self._sent_codes(g) for g in groups}
+            host.put("en_meta", meta)
+
+    def _sent_codes(self, group) -> np.ndarray:
+        """Group indices in the order rows are sent, slot order if incremental"""
+        codes, labels = self._groups[group]
+        if self._increment is None:
+            return codes
+        # Free slots fall outside every group
+        slot_codes = np.full(self._slots.num_units, len(labels), dtype=np.int64)
+        slot_codes[self._slots.row_slots] = codes
+        return slot_codes
+
+    def _send_group_blocks(self, values: DataFrame):
+        """Send the group indices of every block, keyed like the value blocks"""
+        group_locs = {
+            group: values.data_manager.loc_block(group, with_offset=True)
+            for group in self._groups
+            if group is not None
+        }
+        lookups = {
+            group: {label: code for code, label in enumerate(labels)}
+            for group, (_, labels) in self._groups.items()
+            if group is not None
         }
+        num_labels = {group: len(labels) for group, (_, labels) in self._groups.items()}
 
-        # Send encrypted values and encryption kit to host
-        logger.info("Sending encrypted values and encryption kit to host...")
-        self.ctx.hosts.put("en_vals", en_vals)
-        self.ctx.hosts.put("en_kit", [self._pk, self._evaluator])
+        def block_codes(blocks):
+            num_rows = len(blocks[0])
+            codes = {}
+            for group, size in num_labels.items():
+                if group is None:
+                    codes[None] = np.zeros(num_rows, dtype=np.int64)
+                    continue
+                bid, offset = group_locs[group]
+                labels = pd.Series(np.asarray(blocks[bid][:, offset]))
+                codes[group] = (
+                    labels.map(lookups[group]).fillna(size).to_numpy(dtype=np.int64)
+                )
+            return codes
+
+        en_groups = values.block_table.mapValues(block_codes)
+        for h, host in enumerate(self.ctx.hosts):
+            groups = self._host_groups(h)
+            if groups:
+                host.put(
+                    "en_groups",
+                    en_groups.mapValues(functools.partial(_select_columns, columns=groups)),
+                )
 
-        logger.info("Encrypted values sent to host")
+    def _send_values(self, ctx, en_vals, select, hosts: list = None):
+        """
+        Send the encrypted values, each host only getting its own columns
+
+        ``select(en_vals, columns)`` narrows the values to some columns; it is
+        skipped when every host references all encrypted columns. ``hosts``
+        limits the receivers to some host indices.
+        """
+        if hosts is None:
+            hosts = list(range(len(ctx.hosts)))
+        if len(hosts) == len(ctx.hosts) and all(
+            columns == self.columns for columns in self.host_columns
+        ):
+            ctx.hosts.put("en_vals", en_vals)
+            return
+        for h in hosts:
+            ctx.hosts[h].put("en_vals", select(en_vals, self.host_columns[h]))
+
+    def _max_abs(self, values: DataFrame) -> float:
+        """Largest absolute value of the referenced columns"""
+        return max(
+            float(values.max()[self.columns].abs().max()),
+            float(values.min()[self.columns].abs().max()),
+        )
+
+    def _init_packer(self, max_abs: float):
+        """Choose a packing layout from the value range, if the scheme allows"""
+        if not self._encrypt_kit.can_support_pack:
+            logger.warning(
+                f"{self._encrypt_kit.kind} does not support packing, packing disabled"
+            )
+            return
+
+        if self._encoding.exact:
+            # Values are already integers, slots need no fractional bits
+            layout = make_layout(
+                max_abs * self._encoding.scale,
+                self._encrypt_kit.kind,
+                self._en_key_length,
+                self.pack_headroom_bits,
+                precision=0,
+            )
+        else:
+            layout = make_layout(
+                max_abs,
+                self._encrypt_kit.kind,
+                self._en_key_length,
+                self.pack_headroom_bits,
+            )
+        if layout is not None:
+            self._packer = Packer(self._pk, self._evaluator, self._coder, layout)
+            logger.info(f"Packing guest values with {layout}")
+
+    def _plan_increment(self, values: DataFrame, host_tokens: list):
+        """
+        Assign row slots and pick the units to encrypt
+
+        Only units with new or modified rows are encrypted when the row cache
+        of this key matches every host's stored ciphertexts (same token and
+        columns) and the packing layout can be kept; otherwise all are.
+        """
+        self._values_df = values.as_pd_df()
+        entry = self._row_cache.load(self._fingerprint)
+        layout = self._packer.layout if self._packer is not None else None
+        delta = (
+            entry is not None
+            and entry["columns"] == self.columns
+            and _same_encoding(entry.get("encoding"), self._encoding_meta)
+            and all(token == entry["token"] for token in host_tokens)
+        )
+        if delta and layout is not None:
+            delta = reusable_layout(entry["layout"], layout)
+            if delta:
+                # Keep the slot layout of the stored ciphertexts
+                self._packer.layout = entry["layout"]
+        elif delta:
+            delta = entry["layout"] is None
+
+        if delta and self._encoding_meta is not None:
+            # Stored ciphertexts of unchanged and free slots keep their values
+            self._encoding_meta["int_bits"] = max(
+                self._encoding_meta["int_bits"], entry["encoding"]["int_bits"]
+            )
+
+        self._slots = SlotAssignment(
+            self._values_df["id"],
+            row_hashes(self._values_df, self.columns),
+            self._packer.layout.pack_num if self._packer is not None else 1,
+            entry["slots"] if delta else None,
+        )
+        self._increment = {
+            "token": uuid.uuid4().hex,
+            "delta": delta,
+            "units": self._slots.units,
+            "num_units": self._slots.num_units,
+        }
+        logger.info(
+            f"Incremental mode: encrypting {len(self._slots.units)} of "
+            f"{self._slots.num_units} units ({'delta' if delta else 'full refresh'})"
+        )
+
+    def _send_delta(self):
+        """Encrypt the units picked by ``_plan_increment`` and send them"""
+        with self.metrics.phase("encryption"):
+            en_delta = {}
+            if len(self._slots.units):
+                for col in self.columns:
+                    values = self._values_df[col].to_numpy(dtype=np.float64)
+                    en_delta[col] = _encrypt_column(
+                        self._encoding.encode(self._slots.unit_values(values)),
+                        self._encryptor,
+                        self._packer,
+                    )
+            if self._obfuscator_pool is not None:
+                en_delta = {
+                    col: self._obfuscator_pool.obfuscate(tensor)
+                    for col, tensor in en_delta.items()
+                }
+        self.metrics.count("encryption", count_ciphertexts(en_delta))
+        with self.metrics.phase("serialization"):
+            payload = self._wire.encode(en_delta)
+        with self.metrics.phase("send"):
+            self._send_values(
+                self.ctx.sub_ctx("chunks").indexed_ctx(0), payload, _select_columns
+            )
+        for columns in self.host_columns:
+            self.metrics.count(
+                "send",
+                count_ciphertexts(_select_columns(en_delta, columns)),
+                payload_bytes(_select_columns(payload, columns)),
+            )
+        logger.info("Encrypted delta sent to host")
+        self._save_obfuscator_pool()
+
+    def _save_increment(self):
+        """Remember the row slots once the hosts have stored their ciphertexts"""
+        self._row_cache.save(
+            self._fingerprint,
+            {
+                "token": self._increment["token"],
+                "columns": self.columns,
+                "layout": self._packer.layout if self._packer is not None else None,
+                "encoding": self._encoding_meta,
+                "slots": self._slots.state(),
+            },
+        )
+
+    def _prepare_chunks(self, values: DataFrame):
+        """Collect values to the driver and split the rows into chunks"""
+        self._values_df = values.as_pd_df()
+        num_rows = len(self._values_df)
+        chunk_size = self.chunk_size if self.chunk_size > 0 else max(num_rows, 1)
+        self._chunks = [
+            (start, min(start + chunk_size, num_rows))
+            for start in range(0, num_rows, chunk_size)
+        ]
+        logger.info(f"Split {num_rows} rows into {len(self._chunks)} chunks")
+
+    def _open_checkpoint(self) -> str:
+        """Open the checkpoint of the job's inputs, returning their digest"""
+        digest = checkpoint_digest(
+            self._values_df,
+            self.columns,
+            self.host_columns,
+            self.host_aggregates,
+            self._chunks,
+            self._packer.layout if self._packer is not None else None,
+            self._encoding_meta,
+        )
+        self._checkpoint = GuestCheckpoint(self._checkpoint_path, self._fingerprint, digest)
+        return digest
+
+    def _plan_resume(self):
+        """
+        Agree with the hosts on what every chunk still needs
+
+        Without a checkpoint every chunk is evaluated by every host. With one,
+        every host reports the digest of its formulas with its kept chunks;
+        results decrypted under other formulas are not reused.
+        """
+        num_chunks = len(self._chunks)
+        if self._checkpoint is None:
+            self._actions = [["evaluate"] * num_chunks for _ in self.ctx.hosts]
+        else:
+            kept = self.ctx.hosts.get("checkpoint_chunks")
+            self._host_digests = [host_kept["digest"] for host_kept in kept]
+            decrypted = self._checkpoint.decrypted(num_chunks, self._host_digests)
+            self._actions = [
+                resume_actions(
+                    decrypted[h],
+                    set(kept[h]["chunks"]),
+                    bool(self.host_aggregates[h]),
+                    num_chunks,
+                )
+                for h in range(len(self.ctx.hosts))
+            ]
+            for host, actions in zip(self.ctx.hosts, self._actions):
+                host.put("checkpoint_actions", actions)
+            done = sum(action != "evaluate" for actions in self._actions for action in actions)
+            if done:
+                logger.info(
+                    f"Resuming from checkpoint: {done} of "
+                    f"{num_chunks * len(self.ctx.hosts)} host chunks are not evaluated again"
+                )
+        # Chunks some host still has to evaluate, in sending order
+        self._send_queue = [
+            i
+            for i in range(num_chunks)
+            if any(actions[i] == "evaluate" for actions in self._actions)
+        ]
+
+    def _send_next_chunk(self):
+        """Send the next chunk of the queue, if any"""
+        if self._send_queue:
+            self._send_chunk(self._send_queue.pop(0))
+            if not self._send_queue:
+                self._save_obfuscator_pool()
+
+    def _send_chunk(self, i: int):
+        """
+        Encrypt the i-th row chunk and send it under its sequenced key, to the
+        hosts that evaluate it
+        """
+        start, end = self._chunks[i]
+        hosts = [h for h, actions in enumerate(self._actions) if actions[i] == "evaluate"]
+        payload = None
+        if self._checkpoint is not None:
+            with self.metrics.phase("checkpoint"):
+                payload = self._checkpoint.load_values(i)
+        if payload is None:
+            chunk_df = self._values_df.iloc[start:end]
+            with self.metrics.phase("encryption"):
+                en_chunk = {
+                    col: _encrypt_column(
+                        self._encoding.encode(chunk_df[col].values),
+                        self._encryptor,
+                        self._packer,
+                    )
+                    for col in self.columns
+                }
+                if self._obfuscator_pool is not None:
+                    en_chunk = {
+                        col: self._obfuscator_pool.obfuscate(tensor)
+                        for col, tensor in en_chunk.items()
+                    }
+            self.metrics.count("encryption", count_ciphertexts(en_chunk))
+            with self.metrics.phase("serialization"):
+                payload = self._wire.encode(en_chunk)
+            del en_chunk
+            if self._checkpoint is not None:
+                with self.metrics.phase("checkpoint"):
+                    self._checkpoint.save_values(i, payload)
+                self.metrics.count("checkpoint", 0, payload_bytes(payload))
+        else:
+            logger.info(f"Chunk {i} read from checkpoint, not encrypted again")
+        with self.metrics.phase("send"):
+            self._send_values(
+                self.ctx.sub_ctx("chunks").indexed_ctx(i),
+                payload,
+                _select_columns,
+                hosts,
+            )
+        for h in hosts:
+            sent = _select_columns(payload, self.host_columns[h])
+            self.metrics.count(
+                "send",
+                sum(self._wire.num_ciphertexts(buf) for buf in sent.values()),
+                payload_bytes(sent),
+            )
+        logger.info(f"Encrypted chunk {i} (rows {start}-{end}) sent to hosts {hosts}")
+
+    def _encrypt_partitioned(self, values: DataFrame):
+        """
+        Encrypt every block of the values table inside its own partition
+
+        The returned table is keyed like ``values.block_table``, each value
+        being a dict of column name -> wire buffer for the rows of that block.
+        """
+        encryptor = self._encryptor
+        packer = self._packer
+        encoding = self._encoding
+        wire = self._wire
+        obfuscate = self._obfuscate_partitions
+        column_locs = {
+            col: values.data_manager.loc_block(col, with_offset=True)
+            for col in self.columns
+        }
+
+        def encrypt_block(blocks):
+            return wire.encode(
+                {
+                    col: _encrypt_column(
+                        encoding.encode(blocks[bid][:, offset]),
+                        encryptor,
+                        packer,
+                        obfuscate,
+                    )
+                    for col, (bid, offset) in column_locs.items()
+                }
+            )
+
+        return values.block_table.mapValues(encrypt_block)
+
+    def _num_ciphertexts(self, num_rows: int, num_columns: int) -> int:
+        """Ciphertexts holding ``num_columns`` columns of ``num_rows`` rows"""
+        if self._packer is not None:
+            num_rows = -(-num_rows // self._packer.layout.pack_num)
+        return num_rows * num_columns
 
     def receive_and_decrypt(self) -> DataFrame:
         """
-        Receive and decrypt result from host
+        Receive and decrypt the results of every host
+
+        Results are pulled from all hosts concurrently and each one is
+        decrypted as soon as it arrives, whatever the host order.
 
         Returns
         -------
         DataFrame
             Decrypted result as DataFrame
         """
-        logger.info("Receiving encrypted result from host...")
-        en_result = self.ctx.hosts.get("result")[0]
+        # Output column -> (host index, key of its possibly shared result column)
+        with self.metrics.phase("receive"):
+            result_map = self._receive_result_maps()
+        aggregate_keys = {
+            (h, key)
+            for h, aggregates in enumerate(self.host_aggregates)
+            for key in aggregates
+        }
+        result_keys = sorted(set(result_map.values()) - aggregate_keys)
 
-        logger.info("Decrypting result from host...")
+        pulls = ThreadPoolExecutor(
+            max_workers=len(self.ctx.hosts), thread_name_prefix="secure-func-pull"
+        )
+        try:
+            if self.encrypt_mode == "partition":
+                ret = self._receive_partitioned(pulls, result_map, result_keys)
+            else:
+                ret = self._receive_chunks(pulls, result_map, result_keys)
+        finally:
+            pulls.shutdown(wait=False)
+        if self._increment is not None:
+            self._save_increment()
+        if not self._batched:
+            if self._checkpoint_path:
+                self._clear_checkpoint([self._checkpoint])
+            self.metrics.report(self.ctx)
+        return ret
+
+    def run_batches(self, batches: list) -> list:
+        """
+        Encrypt, send, receive and decrypt several values tables
+
+        Every table is an independent sub-job of the hosts' formulas, in its
+        own federation namespace, but all of them share the key setup, the
+        kit exchange and the hosts' compiled formulas. Hosts follow with
+        ``SecureFuncHost.eval_batches``. Checkpoints of completed batches are
+        kept until all batches are, so that a retry skips them.
+
+        Parameters
+        ----------
+        batches : list
+            Values tables, each one like the input of ``encrypt_and_send``
+
+        Returns
+        -------
+        list
+            Decrypted result of every batch, in order
+        """
+        with self.metrics.phase("key_exchange"):
+            if not self._kit_sent:
+                self._send_encrypt_kit()
+            self.ctx.hosts.put("num_batches", len(batches))
+        if len(batches) == 1:
+            self.encrypt_and_send(batches[0])
+            return [self.receive_and_decrypt()]
+
+        if self._row_cache is not None:
+            logger.warning("Incremental mode keeps a single table, ignored with batches")
+            self._row_cache = None
+        root = self.ctx
+        results = []
+        checkpoints = []
+        self._batched = True
+        try:
+            for b, values in enumerate(batches):
+                self.ctx = root.sub_ctx("batches").indexed_ctx(b)
+                logger.info(f"Batch {b + 1}/{len(batches)}: {len(values)} rows")
+                self.encrypt_and_send(values)
+                results.append(self.receive_and_decrypt())
+                checkpoints.append(self._checkpoint)
+        finally:
+            self.ctx = root
+            self._batched = False
+        if self._checkpoint_path:
+            self._clear_checkpoint(checkpoints)
+        self.metrics.report(self.ctx)
+        return results
+
+    def _clear_checkpoint(self, checkpoints: list):
+        """Remove the checkpoints of the completed job or batches, and their key"""
+        for checkpoint in checkpoints:
+            if checkpoint is not None:
+                checkpoint.clear()
+        checkpoint_keys(self._checkpoint_path).remove(self._kit_scope)
+
+    def _receive_result_maps(self) -> dict:
+        """Merge the hosts' formula id -> result key maps, namespaced by host"""
+        host_maps = self.ctx.hosts.get("result_map")
+        namespaced = len(host_maps) > 1
+        result_map = {}
+        for h, (host, host_map) in enumerate(zip(self.ctx.hosts, host_maps)):
+            for formula_id, key in host_map.items():
+                column = f"host_{host.party_id}_{formula_id}" if namespaced else formula_id
+                result_map[column] = (h, key)
+        return result_map
+
+    def _receive_aggregates(self, pulls: ThreadPoolExecutor, result_map: dict) -> dict:
+        """
+        Receive and decrypt the hosts' aggregates, one value per group
+
+        Sets ``aggregates`` to output column -> value, or a Series indexed by
+        group label for grouped aggregates, and returns (host index, key) ->
+        (group column, values per group).
+        """
+        decrypted = {}
+        for h, payload in self._arrivals(pulls, self.ctx, "aggregate"):
+            with self.metrics.phase("serialization"):
+                en_aggregates = self._wire.decode(payload)
+            num_ciphertexts = count_ciphertexts(en_aggregates)
+            self.metrics.count("receive", num_ciphertexts, payload_bytes(payload))
+            with self.metrics.phase("decryption"):
+                for key, tensor in en_aggregates.items():
+                    func, group = self.host_aggregates[h][key]
+                    codes, labels = self._groups[group]
+                    sums = self._encoding.decode(
+                        decrypt_column(tensor, self._decryptor, self._sk)
+                    )
+                    counts = np.bincount(codes, minlength=len(labels))[: len(labels)]
+                    decrypted[(h, key)] = (group, finish_aggregate(func, sums, counts))
+            self.metrics.count("decryption", num_ciphertexts)
+
+        self.aggregates = {}
+        for column, key in result_map.items():
+            if key in decrypted:
+                group, values = decrypted[key]
+                self.aggregates[column] = (
+                    values[0] if group is None else pd.Series(values, index=self._groups[group][1])
+                )
+        if decrypted:
+            logger.info(f"Decrypted {len(decrypted)} aggregates")
+        return decrypted
+
+    def _arrivals(self, pulls: ThreadPoolExecutor, ctx, name: str, hosts: list = None):
+        """Yield (host index, message) of every host, or of ``hosts``, in order of arrival"""
+        if hosts is None:
+            hosts = range(len(ctx.hosts))
+        futures = {pulls.submit(_pull, ctx.hosts[h].get, name): h for h in hosts}
+        arrived = as_completed(futures)
+        for _ in range(len(futures)):
+            with self.metrics.phase("receive"):
+                future = next(arrived)
+            # Taken out of its box so that the future does not keep it alive
+            yield futures[future], future.result().pop()
+
+    def _receive_partitioned(self, pulls, result_map: dict, result_keys: list):
+        """Merge the hosts' block-keyed result tables and decrypt them in one pass"""
+        logger.info("Receiving encrypted result from hosts...")
+        tables = []
+        for h, table in self._arrivals(pulls, self.ctx, "result"):
+            tables.append(table.mapValues(functools.partial(_tag_host, host_index=h)))
+            logger.info(f"Received encrypted result of host {h}")
+        en_result = functools.reduce(
+            lambda left, right: left.join(right, _merge_payloads), tables
+        )
+        num_ciphertexts = self._num_ciphertexts(len(self.values), len(result_keys))
+        self.metrics.count("receive", num_ciphertexts)
+        aggregates = self._receive_aggregates(pulls, result_map)
+        # Blocks are decrypted and joined in one pass
+        with self.metrics.phase("decryption"):
+            ret = self._decrypt_partitioned(en_result, result_map, aggregates)
+        self.metrics.count("decryption", num_ciphertexts)
+        return ret
+
+    def _receive_chunks(self, pulls, result_map: dict, result_keys: list):
+        """Decrypt the hosts' result chunks as they arrive and join them by id"""
+        decryptor = ParallelDecryptor(
+            self.ctx,
+            self._decryptor,
+            self._sk,
+            self._packer,
+            num_partitions=self.decrypt_partitions
+            or self.values.block_table.num_partitions,
+        )
+        decrypted_chunks = {key: [] for key in result_keys}
+        for i in range(len(self._chunks)):
+            chunk_ctx = self.ctx.sub_ctx("chunks").indexed_ctx(i)
+            hosts = []
+            for h, actions in enumerate(self._actions):
+                if actions[i] != "skip":
+                    hosts.append(h)
+                    continue
+                with self.metrics.phase("checkpoint"):
+                    decrypted = self._checkpoint.load_decrypted(
+                        i, h, self._host_digests[h]
+                    )
+                for key, values in decrypted.items():
+                    decrypted_chunks[key].append(values)
+            if not hosts:
+                logger.info(f"Result chunk {i} read from checkpoint")
+                continue
+            for n, (h, payload) in enumerate(
+                self._arrivals(pulls, chunk_ctx, "result", hosts)
+            ):
+                # Keep the hosts busy while this chunk is being decrypted
+                if n == 0:
+                    self._send_next_chunk()
+
+                if self._spill_path is not None:
+                    num_ciphertexts = sum(
+                        self._wire.num_ciphertexts(buf) for buf in payload.values()
+                    )
+                    self.metrics.count("receive", num_ciphertexts, payload_bytes(payload))
+                    decrypted = _tag_host(self._decrypt_spilled(decryptor, payload), h)
+                else:
+                    with self.metrics.phase("serialization"):
+                        en_result = _tag_host(self._wire.decode(payload), h)
+                    num_ciphertexts = count_ciphertexts(en_result)
+                    self.metrics.count("receive", num_ciphertexts, payload_bytes(payload))
+                    with self.metrics.phase("decryption"):
+                        decrypted = decryptor.decrypt(en_result)
+
+                for key, values in decrypted.items():
+                    decrypted_chunks[key].append(values)
+                self.metrics.count("decryption", num_ciphertexts)
+                if self._checkpoint is not None:
+                    with self.metrics.phase("checkpoint"):
+                        self._checkpoint.save_decrypted(
+                            i, h, self._host_digests[h], decrypted
+                        )
+                logger.info(f"Decrypted result chunk {i} of host {h}")
         decrypted_values = {
-            idx: self._decryptor.decrypt_tensor(tensor).tolist()
-            for idx, tensor in en_result.items()
+            key: self._encoding.decode(np.concatenate(chunks))
+            for key, chunks in decrypted_chunks.items()
         }
+        if self._increment is not None:
+            # Results come in slot order, put them back in row order
+            decrypted_values = {
+                key: values[self._slots.row_slots]
+                for key, values in decrypted_values.items()
+            }
+        # Sent by the hosts after their last result chunk
+        for key, (group, values) in self._receive_aggregates(pulls, result_map).items():
+            decrypted_values[key] = broadcast(values, self._groups[group][0])
         logger.info("Decryption complete...")
 
-        new_columns = list(decrypted_values.keys())
+        with self.metrics.phase("result_join"):
+            return self._join_by_id(decrypted_values, result_map)
+
+    def _decrypt_spilled(self, decryptor: ParallelDecryptor, payload: dict) -> dict:
+        """
+        Decrypt a dict of encoded result columns segment by segment
+
+        The buffers are moved to a spill file and read back through its
+        memory map, so only one segment of one column is decoded at a time.
+        """
+        segment_rows = DEFAULT_SEGMENT_ROWS
+        if self._packer is not None:
+            pack_num = self._packer.layout.pack_num
+            segment_rows = max(pack_num, segment_rows - segment_rows % pack_num)
+
+        decrypted = {}
+        with SpillFile(self._spill_path) as spill:
+            with self.metrics.phase("spill"):
+                for key in list(payload):
+                    spill.write(key, payload.pop(key))
+            self.metrics.count("spill", 0, spill.nbytes)
+            for key in spill.keys():
+                buf = spill[key]
+                parts = []
+                for start, size in segment_bounds(self._wire.num_rows(buf), segment_rows):
+                    with self.metrics.phase("serialization"):
+                        segment = self._wire.decode_rows(buf, start, size)
+                    with self.metrics.phase("decryption"):
+                        parts.append(decryptor.decrypt({key: segment})[key])
+                decrypted[key] = np.concatenate(parts) if parts else np.empty(0)
+                del buf
+        return decrypted
+
+    def _join_by_id(self, decrypted_values: dict, result_map: dict) -> DataFrame:
+        """
+        Append decrypted results (in ``_values_df`` row order) to the values
+
+        Row positions of every block are resolved once on the driver, and each
+        block is sent only the rows of the results it needs, gathered with
+        NumPy fancy-indexing.
+        """
+        new_columns = list(result_map.keys())
         new_dm = self.values.data_manager.duplicate()
         bids = new_dm.append_columns(
-            new_columns, [BlockType.get_block_type(float)] * len(new_columns)
+            new_columns, self._result_block_types(new_columns, result_map)
         )
 
         match_id_loc = new_dm.loc_block("id", with_offset=True)
@@ -123,36 +1087,119 @@ class SecureFuncGuest:
             match_id_block_id = match_id_loc
             match_id_offset = 0
 
-        idxvalues = self.idxvalues
+        # One array per distinct result, output columns index into them; they
+        # are not stacked so that int64 results stay exact next to float ones
+        result_keys = sorted(decrypted_values.keys())
+        result_arrays = [decrypted_values[key] for key in result_keys]
+        result_cols = [result_keys.index(result_map[col]) for col in new_columns]
+
+        block_table = self.values.block_table
+        block_ids = block_table.mapValues(
+            lambda blocks: _block_match_ids(blocks[match_id_block_id], match_id_offset)
+        ).collect()
+
+        row_index = pd.Index(self._values_df["id"])
+        block_results = []
+        for block_key, ids in block_ids:
+            positions = row_index.get_indexer(ids)
+            if (positions < 0).any():
+                raise ValueError(f"Result rows missing for ids of block {block_key}")
+            block_results.append(
+                (block_key, [values[positions] for values in result_arrays])
+            )
 
-        def append_col_by_id_separate(blocks):
-            match_id_block = blocks[match_id_block_id]
+        block_results = self.ctx.computing.parallelize(
+            block_results,
+            include_key=True,
+            partition=block_table.num_partitions,
+            key_serdes_type=block_table.key_serdes_type,
+            partitioner_type=block_table.partitioner_type,
+        )
 
+        def append_result_block(blocks, results):
+            ret_blocks = [block for block in blocks]
+            for bid, idx in zip(bids, result_cols):
+                ret_blocks.append(
+                    new_dm.blocks[bid].convert_block(results[idx].reshape(-1, 1))
+                )
+            return ret_blocks
+
+        ret = DataFrame(
+            self.values._ctx,
+            block_table.join(block_results, append_result_block),
+            copy.deepcopy(self.values.partition_order_mappings),
+            new_dm,
+        )
+
+        logger.info("Decrypted result DataFrame constructed...")
+
+        return ret
+
+    def _result_block_types(self, new_columns: list, result_map: dict) -> list:
+        """Block type of every output column, aggregates are always float"""
+        aggregate_keys = {
+            (h, key)
+            for h, aggregates in enumerate(self.host_aggregates)
+            for key in aggregates
+        }
+        return [
+            BlockType.get_block_type(
+                float if result_map[col] in aggregate_keys else self._encoding.result_type
+            )
+            for col in new_columns
+        ]
+
+    def _decrypt_partitioned(
+        self, en_result, result_map: dict, aggregates: dict = None
+    ) -> DataFrame:
+        """
+        Decrypt a block-keyed result table and append it to the values
+
+        Result blocks share their keys with ``values.block_table``, so each
+        partition decrypts and appends its own rows without any id lookup.
+        Aggregates are spread over the rows of each block by their group.
+        """
+        new_columns = list(result_map.keys())
+        new_dm = self.values.data_manager.duplicate()
+        bids = new_dm.append_columns(
+            new_columns, self._result_block_types(new_columns, result_map)
+        )
+        # (host index, key) -> (group location or None, label -> value)
+        aggregate_rows = {
+            key: (
+                None
+                if group is None
+                else self.values.data_manager.loc_block(group, with_offset=True),
+                dict(zip(self._groups[group][1], values.tolist())),
+            )
+            for key, (group, values) in (aggregates or {}).items()
+        }
+
+        decryptor = self._decryptor
+        sk = self._sk
+        packer = self._packer
+        encoding = self._encoding
+        wire = self._wire
+
+        def decrypt_and_append(blocks, payload):
+            decrypted = {
+                key: encoding.decode(
+                    decrypt_column(tensor, decryptor, sk, packer)
+                ).reshape(-1, 1)
+                for key, tensor in wire.decode(payload).items()
+            }
+            for key, (loc, lookup) in aggregate_rows.items():
+                decrypted[key] = _block_aggregate(blocks, loc, lookup).reshape(-1, 1)
             ret_blocks = [block for block in blocks]
             for bid, col in zip(bids, new_columns):
                 ret_blocks.append(
-                    new_dm.blocks[bid].convert_block(
-                        [
-                            [
-                                decrypted_values[col][
-                                    idxvalues[
-                                        (
-                                            row[match_id_offset]
-                                            if isinstance(row, list)
-                                            else row
-                                        )
-                                    ]
-                                ]
-                            ]
-                            for row in match_id_block
-                        ]
-                    )
+                    new_dm.blocks[bid].convert_block(decrypted[result_map[col]])
                 )
             return ret_blocks
 
         ret = DataFrame(
             self.values._ctx,
-            self.values.block_table.mapValues(append_col_by_id_separate),
+            self.values.block_table.join(en_result, decrypt_and_append),
             copy.deepcopy(self.values.partition_order_mappings),
             new_dm,
         )
@@ -160,3 +1207,51 @@ class SecureFuncGuest:
         logger.info("Decrypted result DataFrame constructed...")
 
         return ret
+
+
+def _block_match_ids(match_id_block, offset: int) -> list:
+    """Match ids of one block, rows may be plain ids or lists of fields"""
+    return [row[offset] if isinstance(row, list) else row for row in match_id_block]
+
+
+def _block_aggregate(blocks, loc, lookup: dict) -> np.ndarray:
+    """Aggregate value of every row of a block, by the row's group label"""
+    if loc is None:
+        return np.full(len(blocks[0]), lookup[None], dtype=np.float64)
+    bid, offset = loc
+    labels = pd.Series(np.asarray(blocks[bid][:, offset]))
+    return labels.map(lookup).to_numpy(dtype=np.float64)
+
+
+def _pull(get, name: str) -> list:
+    """Get a message, boxed in a list the receiver can empty"""
+    return [get(name)]
+
+
+def _select_columns(payload: dict, columns: list) -> dict:
+    """The given columns of a dict of encrypted columns, as far as it has them"""
+    return {col: payload[col] for col in columns if col in payload}
+
+
+def _tag_host(payload: dict, host_index: int) -> dict:
+    """Key the result columns of one host by (host index, result key)"""
+    return {(host_index, key): column for key, column in payload.items()}
+
+
+def _merge_payloads(left: dict, right: dict) -> dict:
+    return {**left, **right}
+
+
+def _same_encoding(cached: dict, meta: dict) -> bool:
+    """Whether ciphertexts stored under ``cached`` can be mixed with ``meta`` ones"""
+    if cached is None or meta is None:
+        return cached is meta
+    return (cached["kind"], cached["precision"]) == (meta["kind"], meta["precision"])
+
+
+def _encrypt_column(column: Tensor, encryptor, packer=None, obfuscate=False):
+    """Encrypt one column, packing it first when a packer is set"""
+    if packer is not None:
+        return packer.encrypt(column, obfuscate)
+    return encryptor.encrypt_tensor(column, obfuscate)
+
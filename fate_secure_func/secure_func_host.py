@@ -3,8 +3,23 @@ Host Party Implementation for Secure Function Component
 """
 
 from fate.arch.dataframe import DataFrame
+from .aggregate import add_aggregates
+from .checkpoint import HostCheckpoint, checkpoint_digest
+from .decryption import slice_rows
+from .encoding import encode_plan
+from .evaluation import ParallelEvaluator, add_aggregate_payloads, evaluate_payload
+from .formula import FormulaPlan, compile_formulas
+from .incremental import HostCiphertextStore, apply_delta
+from .keystore import HostKeyCache
+from .matrix import FORMULA_TYPES, compile_matrix
+from .metrics import PhaseMetrics, count_ciphertexts
+from .packing import PackLayout, check_plan_packable
+from .spill import DEFAULT_SEGMENT_ROWS, SpillFile, segment_bounds
+from .wire import WireCodec, payload_bytes
 
+import functools
 import logging
+import operator
 
 logger = logging.getLogger(__name__)
 
@@ -15,12 +30,26 @@ class SecureFuncHost:
 
     The host party:
     1. Receives encryption kit from guest
-    2. Receives encrypted values from guest
-    3. Performs computation on encrypted data
-    4. Sends encrypted result back to guest
+    2. Sends the guest columns its formulas reference
+    3. Receives encrypted values from guest
+    4. Performs computation on encrypted data
+    5. Sends encrypted result back to guest, aggregates reduced to one
+       ciphertext per group
+
+    ``eval_batches`` repeats 2-5 for every batch the guest runs.
     """
 
-    def __init__(self, ctx):
+    def __init__(
+        self,
+        ctx,
+        keystore_path: str = None,
+        metrics_trace_path: str = None,
+        incremental_path: str = None,
+        formula_type: str = "expression",
+        eval_partitions: int = 0,
+        spill_path: str = None,
+        checkpoint_path: str = None,
+    ):
         """
         Initialize host component
 
@@ -28,14 +57,65 @@ class SecureFuncHost:
         ----------
         ctx : Context
             FATE context
+        keystore_path : str, optional
+            Directory caching the guest's public keys between jobs
+        metrics_trace_path : str, optional
+            File the per-phase metrics are also written to as JSON
+        incremental_path : str, optional
+            Directory keeping the guest's encrypted columns between jobs, so
+            that only changed rows are sent again
+        formula_type : str
+            "expression" reads string formulas, "matrix" a coefficient table
+            applied as one encrypted matrix product
+        eval_partitions : int
+            Partitions evaluating the plan in row batches in "local" mode,
+            0 uses as many as the guest values have
+        spill_path : str, optional
+            Directory for memory-mapped spill files; received columns are
+            then evaluated segment by segment in "local" mode
+        checkpoint_path : str, optional
+            Directory keeping the results of evaluated chunks, so that a
+            retry of the job resumes in "local" mode
         """
+        if formula_type not in FORMULA_TYPES:
+            raise ValueError(
+                f"Unknown formula type {formula_type!r}, expected one of {FORMULA_TYPES}"
+            )
         self.ctx = ctx
-        self._init_encrypt_kit()
+        self.formula_type = formula_type
+        self.eval_partitions = eval_partitions
+        self._spill_path = spill_path
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint = None
+        # Formula table, its pandas copy and its plan, compiled once for all batches
+        self._compiled = None
+        # Batch sub-jobs leave cleanup and reporting to eval_batches
+        self._batched = False
+        self.metrics = PhaseMetrics("host", metrics_trace_path)
+        self._key_cache = HostKeyCache(keystore_path) if keystore_path else None
+        self._store = (
+            HostCiphertextStore(incremental_path) if incremental_path else None
+        )
+        with self.metrics.phase("key_exchange"):
+            self._init_encrypt_kit()
 
     def _init_encrypt_kit(self):
-        """Receive encryption kit from guest"""
-        self.pk, self.evaluator = self.ctx.guest.get("en_kit")
-        logger.info("Received encryption kit from guest")
+        """Receive encryption kit from guest, unless it is already cached"""
+        fingerprint = self.ctx.guest.get("en_kit_fingerprint")
+        en_kit = None
+        if self._key_cache is not None:
+            en_kit = self._key_cache.get(fingerprint)
+        self.ctx.guest.put("en_kit_needed", en_kit is None)
+
+        if en_kit is None:
+            en_kit = self.ctx.guest.get("en_kit")
+            logger.info(f"Received encryption kit {fingerprint} from guest")
+            if self._key_cache is not None:
+                self._key_cache.put(fingerprint, en_kit)
+        else:
+            logger.info(f"Using cached encryption kit {fingerprint}")
+        self.pk, self.evaluator, self.coder = en_kit
+        self._fingerprint = fingerprint
 
     def eval(self, formula: DataFrame):
         """
@@ -44,32 +124,405 @@ class SecureFuncHost:
         Parameters
         ----------
         formula : DataFrame
-            Formula to evaluate (e.g., "x+y", "2*x+3*y")
+            Formula to evaluate (e.g., "x+y", "2*x+3*y"), or with
+            ``formula_type="matrix"`` one row of coefficients per output
         """
         logger.info(f"Evaluating formula shape of: {formula.shape}")
 
-        # Receive encrypted values from guest (dict of PHETensor)
-        en_vals = self.ctx.guest.get("en_vals")
+        if self._compiled is not None and self._compiled[0] is formula:
+            _, formula_df, plan = self._compiled
+        else:
+            formula_df = formula.as_pd_df()
+            if self.formula_type == "matrix":
+                with self.metrics.phase("compile"):
+                    plan = compile_matrix(formula_df)
+            else:
+                formulas = [
+                    (row["id"], row["formula"])
+                    for row in formula_df.to_dict(orient="records")
+                ]
+                for idx, f in formulas:
+                    logger.info(f"Processing formula: {f}")
+                with self.metrics.phase("compile"):
+                    plan = compile_formulas(formulas)
+            self._compiled = (formula, formula_df, plan)
 
-        # Perform computation based on formula
-        xAy = en_vals["x"] + en_vals["y"]
-        xSy = en_vals["x"] - en_vals["y"]
+        # Only the referenced columns are encrypted and sent by the guest
+        self.ctx.guest.put("required_columns", plan.columns)
+        logger.info(f"Requested guest columns: {plan.columns}")
+        # Aggregate key -> (function, group column), the guest sends group indices
+        self.ctx.guest.put(
+            "aggregate_map",
+            {key: (func, group) for key, (func, group, _) in plan.aggregates.items()},
+        )
+        # Token of the stored ciphertexts, the guest sends a delta if it matches
+        self.ctx.guest.put(
+            "inc_token",
+            self._store.token(self._fingerprint, plan.columns)
+            if self._store is not None
+            else None,
+        )
 
-        result = {}
+        # The id -> result column map goes first so the guest can lay out its
+        # output while chunks are still in flight. Formulas with identical
+        # results share a column, which is sent and decrypted only once.
+        self.ctx.guest.put("result_map", plan.outputs)
+        logger.info(
+            f"{len(plan.outputs)} formulas map to {len(plan.result_keys)} distinct results"
+        )
 
-        for row in formula.as_pd_df().to_dict(orient="records"):
-            idx = row["id"]
-            f = row["formula"]
-            logger.info(f"Processing formula: {f}")
+        with self.metrics.phase("receive"):
+            en_meta = self.ctx.guest.get("en_meta")
+        self.metrics.ciphertext_size = en_meta["ciphertext_bytes"]
+        layout = en_meta.get("pack")
+        if layout is not None:
+            layout = PackLayout.from_meta(layout)
+        encoding = en_meta.get("encoding")
+        if layout is not None and plan.aggregates:
+            raise ValueError("Aggregate formulas do not support packed guest values")
+        if layout is not None and self.formula_type == "matrix":
+            raise ValueError("Matrix formulas do not support packed guest values")
+        if encoding is not None:
+            # Exact int64 plaintexts, constants scaled like the guest values
+            plan = encode_plan(
+                plan, encoding, packed=layout is not None, num_rows=en_meta["num_rows"]
+            )
+            logger.info(f"Guest values are {encoding['kind']} encoded: {encoding}")
+        if layout is not None:
+            check_plan_packable(plan, layout)
+            logger.info(f"Guest values are packed: {layout}")
+        wire = WireCodec(self.pk, self.evaluator, self.coder, self.ctx.device, layout)
+        packed = layout is not None
+        # Group column -> number of groups, None for aggregates over all rows
+        num_groups = en_meta.get("groups", {})
+
+        if en_meta["mode"] == "partition":
+            # Table of dicts of wire-encoded columns keyed by the guest's block ids
+            with self.metrics.phase("receive"):
+                en_vals = self.ctx.guest.get("en_vals")
+            num_rows = en_meta["num_rows"]
+            if layout is not None:
+                num_rows = -(-num_rows // layout.pack_num)
+            self.metrics.count("receive", num_rows * len(plan.columns))
+            if plan.aggregates:
+                # Block-keyed group indices, aligned with the value blocks
+                with self.metrics.phase("receive"):
+                    en_groups = self.ctx.guest.get("en_groups")
+                en_vals = en_vals.join(en_groups, _with_codes)
+            # Blocks are decoded, evaluated and encoded inside their partitions
+            with self.metrics.phase("evaluation"):
+                evaluated = en_vals.mapValues(
+                    functools.partial(
+                        evaluate_payload,
+                        plan=plan,
+                        packed=packed,
+                        wire=wire,
+                        num_groups=num_groups if plan.aggregates else None,
+                    )
+                )
+                result = evaluated.mapValues(operator.itemgetter(0))
+                aggregates = {}
+                if plan.aggregates:
+                    # Partial sums are added within and then across partitions
+                    aggregates = evaluated.mapValues(operator.itemgetter(1)).reduce(
+                        functools.partial(add_aggregate_payloads, wire=wire)
+                    )
+            with self.metrics.phase("send"):
+                self.ctx.guest.put("result", result)
+                self.ctx.guest.put("aggregate", aggregates)
+            self.metrics.count("send", num_rows * len(plan.result_keys))
+            self.metrics.count(
+                "send",
+                sum(num_groups[group] for _, group, _ in plan.aggregates.values()),
+                payload_bytes(aggregates),
+            )
+        else:
+            # Every chunk is evaluated in row batches on the computing engine,
+            # on as many partitions as the guest values have unless set
+            evaluator = ParallelEvaluator(
+                self.ctx,
+                wire,
+                self.metrics,
+                self.eval_partitions or en_meta.get("num_partitions", 1),
+            )
+            checkpoint, actions = self._resume(en_meta, formula_df)
+            self._checkpoint = checkpoint
+            if (
+                self._spill_path is not None
+                and en_meta["num_chunks"] == 1
+                and "incremental" not in en_meta
+            ):
+                # Spilling bounds decoded ciphertexts, not the wire buffers
+                logger.warning(
+                    "Guest values come as one chunk, their wire buffers and the "
+                    "joined results pass through memory whole; set chunk_size "
+                    "on the guest to bound them"
+                )
+            # Evaluate every chunk as soon as it lands and stream it back
+            codes = en_meta.get("group_codes", {})
+            aggregates = {}
+            offset = 0
+            for i in range(en_meta["num_chunks"]):
+                chunk_ctx = self.ctx.sub_ctx("chunks").indexed_ctx(i)
+                if actions[i] != "evaluate":
+                    start, end = en_meta["chunks"][i]
+                    offset += end - start
+                    kept = None
+                    if checkpoint is not None:
+                        with self.metrics.phase("checkpoint"):
+                            kept = checkpoint.load(i)
+                    if kept is None:
+                        continue
+                    payload, partial = kept
+                    aggregates = add_aggregates(aggregates, wire.decode(partial))
+                    if actions[i] == "resend":
+                        with self.metrics.phase("send"):
+                            chunk_ctx.guest.put("result", payload)
+                        self.metrics.count(
+                            "send",
+                            sum(wire.num_ciphertexts(buf) for buf in payload.values()),
+                            payload_bytes(payload),
+                        )
+                        logger.info(f"Result chunk {i} resent from checkpoint")
+                    continue
+                with self.metrics.phase("receive"):
+                    payload = chunk_ctx.guest.get("en_vals")
+                self.metrics.count(
+                    "receive",
+                    sum(wire.num_ciphertexts(buf) for buf in payload.values()),
+                    payload_bytes(payload),
+                )
+                # Columns stay encoded until they are cut into batches
+                chunk_groups = (codes, num_groups, offset)
+                if self._spill_path is not None and "incremental" not in en_meta:
+                    # in a memory-mapped file, removed even if evaluation fails
+                    with SpillFile(self._spill_path) as spill:
+                        with self.metrics.phase("spill"):
+                            for col in list(payload):
+                                spill.write(col, payload.pop(col))
+                        self.metrics.count("spill", 0, spill.nbytes)
+                        en_vals = {col: spill[col] for col in spill.keys()}
+                        payload, partial, size = self._evaluate_chunk(
+                            en_vals, plan, packed, chunk_groups, evaluator
+                        )
+                        del en_vals
+                else:
+                    en_vals = payload
+                    if "incremental" in en_meta:
+                        with self.metrics.phase("serialization"):
+                            en_vals = wire.decode(payload)
+                        en_vals = self._apply_increment(
+                            en_meta["incremental"], en_vals, plan, wire
+                        )
+                    payload, partial, size = self._evaluate_chunk(
+                        en_vals, plan, packed, chunk_groups, evaluator
+                    )
+                    del en_vals
+                num_ciphertexts = sum(wire.num_ciphertexts(buf) for buf in payload.values())
+                aggregates = add_aggregates(aggregates, partial)
+                offset += size
+                if checkpoint is not None:
+                    with self.metrics.phase("checkpoint"):
+                        checkpoint.save(i, payload, wire.encode(partial))
+                    self.metrics.count("checkpoint", 0, payload_bytes(payload))
+                with self.metrics.phase("send"):
+                    chunk_ctx.guest.put("result", payload)
+                self.metrics.count("send", num_ciphertexts, payload_bytes(payload))
+                logger.info(f"Encrypted result chunk {i} sent to guest")
+
+            with self.metrics.phase("serialization"):
+                payload = wire.encode(aggregates)
+            with self.metrics.phase("send"):
+                self.ctx.guest.put("aggregate", payload)
+            self.metrics.count("send", count_ciphertexts(aggregates), payload_bytes(payload))
+            if checkpoint is not None and not self._batched:
+                checkpoint.clear()
+
+        logger.info(
+            f"Encrypted result sent to guest (count: {len(plan.result_keys)}, "
+            f"aggregates: {len(plan.aggregates)})"
+        )
+        if not self._batched:
+            self.metrics.report(self.ctx)
+
+    def eval_batches(self, formula: DataFrame):
+        """
+        Evaluate the formulas on every batch of ``SecureFuncGuest.run_batches``
+
+        The formulas are compiled once; every batch is evaluated like a job
+        of ``eval`` in its own federation namespace.
+
+        Parameters
+        ----------
+        formula : DataFrame
+            Formulas, or coefficients, applied to every batch
+        """
+        with self.metrics.phase("key_exchange"):
+            num_batches = self.ctx.guest.get("num_batches")
+        if num_batches == 1:
+            self.eval(formula)
+            return
+
+        root = self.ctx
+        checkpoints = []
+        self._batched = True
+        try:
+            for b in range(num_batches):
+                self.ctx = root.sub_ctx("batches").indexed_ctx(b)
+                self._checkpoint = None
+                self.eval(formula)
+                checkpoints.append(self._checkpoint)
+        finally:
+            self.ctx = root
+            self._batched = False
+        for checkpoint in checkpoints:
+            if checkpoint is not None:
+                checkpoint.clear()
+        logger.info(f"Evaluated {num_batches} batches")
+        self.metrics.report(self.ctx)
+
+    def _resume(self, en_meta: dict, formula_df):
+        """
+        Checkpoint of the job and the action of every chunk
+
+        When the guest checkpoints, the digest of the formulas and the chunks
+        kept here are reported and the guest answers which ones to evaluate,
+        resend or skip; otherwise every chunk is evaluated.
+        """
+        num_chunks = en_meta["num_chunks"]
+        if "checkpoint" not in en_meta:
+            return None, ["evaluate"] * num_chunks
+        checkpoint = None
+        kept = []
+        # Keys the guest's decrypted results of this host
+        plan_digest = checkpoint_digest(self.formula_type, formula_df)
+        if self._checkpoint_path:
+            digest = checkpoint_digest(en_meta["checkpoint"], plan_digest)
+            checkpoint = HostCheckpoint(self._checkpoint_path, self._fingerprint, digest)
+            kept = checkpoint.chunks(num_chunks)
+        self.ctx.guest.put("checkpoint_chunks", {"digest": plan_digest, "chunks": kept})
+        actions = self.ctx.guest.get("checkpoint_actions")
+        if kept:
+            logger.info(f"Kept results of chunks {kept}, chunk actions: {actions}")
+        return checkpoint, actions
+
+    def _evaluate_chunk(
+        self,
+        en_vals: dict,
+        plan: FormulaPlan,
+        packed: bool,
+        chunk_groups: tuple,
+        evaluator: ParallelEvaluator,
+    ):
+        """
+        Evaluate the columns of one chunk, segment by segment with ``spill_path``
+
+        ``chunk_groups`` is (group column -> group index of every row of the
+        job, group column -> number of groups, first row of the chunk).
+        Returns the encoded results, the aggregates and the rows of the chunk.
+        """
+        codes, num_groups, offset = chunk_groups
+        size = evaluator.num_rows(en_vals, plan) if codes else 0
+        groups = {
+            group: (group_codes[offset : offset + size], num_groups[group])
+            for group, group_codes in codes.items()
+        }
+        if self._spill_path is not None:
+            payload, partial = self._evaluate_segments(
+                en_vals, plan, packed, groups, evaluator
+            )
+        else:
+            payload, partial = evaluator.evaluate(en_vals, plan, packed, groups)
+        return payload, partial, size
+
+    def _evaluate_segments(
+        self,
+        en_vals: dict,
+        plan: FormulaPlan,
+        packed: bool,
+        groups: dict,
+        evaluator: ParallelEvaluator,
+    ):
+        """
+        Evaluate segment by segment, results collected in a spill file
+
+        ``en_vals`` holds encoded columns of a spill file, or decoded ones;
+        either way only one segment of rows is decoded, evaluated and
+        encoded at a time. Returns the encoded results, joined in memory into
+        one wire buffer per result column of the chunk, and the aggregates.
+        """
+        wire = evaluator.wire
+        segment_rows = DEFAULT_SEGMENT_ROWS
+        if packed:
+            pack_num = wire.layout.pack_num
+            segment_rows = max(pack_num, segment_rows - segment_rows % pack_num)
+        segments = segment_bounds(evaluator.num_rows(en_vals, plan), segment_rows)
+
+        aggregates = {}
+        with SpillFile(self._spill_path) as results:
+            for i, (start, size) in enumerate(segments):
+                with self.metrics.phase("serialization"):
+                    segment = {
+                        col: _segment_rows(en_vals[col], start, size, wire)
+                        for col in plan.columns
+                    }
+                result, partial = evaluator.evaluate(
+                    segment,
+                    plan,
+                    packed,
+                    {
+                        group: (codes[start : start + size], num)
+                        for group, (codes, num) in groups.items()
+                    },
+                )
+                aggregates = add_aggregates(aggregates, partial)
+                with self.metrics.phase("spill"):
+                    for key, buf in result.items():
+                        results.write((key, i), buf)
+                del segment, result
+            with self.metrics.phase("serialization"):
+                payload = {
+                    key: wire.concat_columns(
+                        [results[(key, i)] for i in range(len(segments))]
+                    )
+                    for key in plan.result_keys
+                }
+            self.metrics.count("spill", 0, results.nbytes)
+        logger.info(f"Evaluated {len(segments)} segments of up to {segment_rows} rows")
+        return payload, aggregates
+
+    def _apply_increment(
+        self, increment: dict, delta: dict, plan: FormulaPlan, wire: WireCodec
+    ) -> dict:
+        """Patch the stored columns with the guest's delta and store them again"""
+        with self.metrics.phase("incremental"):
+            stored = {}
+            if increment["delta"]:
+                stored = self._store.load(self._fingerprint, wire)
+            en_vals = {
+                col: apply_delta(
+                    stored.get(col),
+                    delta.get(col),
+                    increment["units"],
+                    increment["num_units"],
+                )
+                for col in plan.columns
+            }
+            if self._store is not None:
+                self._store.save(self._fingerprint, increment["token"], en_vals, wire)
+        logger.info(
+            f"Updated {len(increment['units'])} of {increment['num_units']} "
+            f"stored ciphertext units"
+        )
+        return en_vals
+
+
+def _with_codes(payload: dict, codes: dict):
+    return payload, codes
 
-            if f == "x+y":
-                result[idx] = xAy
-            elif f == "x-y":
-                result[idx] = xSy
-            else:
-                logger.warning(f"Unknown formula '{f}', using default (sum all values)")
-                result[idx] = xAy
 
-        # Send encrypted result back to guest
-        self.ctx.guest.put("result", result)
-        logger.info(f"Encrypted result sent to guest (count: {len(result)})")
+def _segment_rows(column, start: int, size: int, wire: WireCodec):
+    """Rows ``start:start + size`` of a column, still encoded if it was"""
+    if isinstance(column, (bytes, memoryview)):
+        return wire.slice_column(column, start, size)
+    return slice_rows(column, start, size)
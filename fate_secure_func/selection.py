@@ -0,0 +1,259 @@
+"""
+HE Scheme Selection for Secure Function Component
+
+With ``he_param={"kind": "auto"}`` the guest picks the scheme and key length
+itself. Every scheme gets the shortest key length that reaches
+``min_security_bits`` and leaves the plaintext room the encoding and packing
+need: a longer key of the same scheme costs more per ciphertext than it can
+win back in packed slots. Schemes that cannot encrypt the encoding are left
+out, and so are schemes without negative plaintexts: host formulas subtract
+and take negative coefficients, so results can be negative whatever the
+guest values are. Packing would keep them non-negative, but the timings
+below encrypt unpacked columns, so packing does not make such a scheme a
+candidate. A single remaining candidate is used as it is; otherwise the
+candidates are timed on this machine, encrypting, evaluating (ciphertext
+additions and integer multiplications) and decrypting a small column, and
+the cheapest per value is used. Timings are cached per machine in
+``he_benchmark_path``, so only the first job on a machine pays for the
+microbenchmark.
+"""
+
+import logging
+import os
+import pickle
+import platform
+import time
+
+import numpy as np
+import torch
+
+from .encoding import MAX_INT_BITS, ValueEncoding
+from .keystore import _atomic_dump
+from .packing import MAX_SLOT_BITS, plaintext_bits
+
+logger = logging.getLogger(__name__)
+
+# Schemes "auto" chooses from; mock has no security
+AUTO_KINDS = ["paillier", "ou"]
+
+KEY_LENGTHS = [1024, 2048, 3072, 4096, 7680]
+
+DEFAULT_MIN_SECURITY_BITS = 112
+
+# Rows of the benchmark column
+BENCHMARK_ROWS = 256
+
+# Security of factoring-based moduli, NIST SP 800-57 Part 1
+_SECURITY_BITS = [(1024, 80), (2048, 112), (3072, 128), (7680, 192), (15360, 256)]
+
+
+def security_bits(key_length: int) -> int:
+    """Security level of a modulus of ``key_length`` bits, 0 below 1024 bits"""
+    bits = 0
+    for length, level in _SECURITY_BITS:
+        if key_length >= length:
+            bits = level
+    return bits
+
+
+def required_plaintext_bits(encoding: ValueEncoding, pack: bool) -> int:
+    """Plaintext bits the encoding and packing need whatever the values are"""
+    bits = 0
+    if encoding.exact:
+        # int64 results and one bit of sign room
+        bits = MAX_INT_BITS + 2
+    if pack:
+        # two slots of the widest layout
+        bits = max(bits, 2 * MAX_SLOT_BITS)
+    return bits
+
+
+def candidates(min_security_bits: int, encoding: ValueEncoding, pack: bool) -> list:
+    """(kind, key_length) of the shortest suitable key of every scheme"""
+    needed = required_plaintext_bits(encoding, pack)
+    found = []
+    for kind in AUTO_KINDS:
+        for key_length in KEY_LENGTHS:
+            if (
+                security_bits(key_length) >= min_security_bits
+                and plaintext_bits(kind, key_length) >= needed
+            ):
+                found.append((kind, key_length))
+                break
+    return found
+
+
+def benchmark_kit(kit, encoding: ValueEncoding, rows: int = BENCHMARK_ROWS) -> dict:
+    """
+    Seconds per ciphertext of each phase, for one encryption kit
+
+    Raises
+    ------
+    NotImplementedError
+        If the scheme's coder does not support the encoding's dtype
+    """
+    column = encoding.encode(np.arange(rows, dtype=np.float64))
+    encryptor = kit.get_tensor_encryptor()
+    decryptor = kit.get_tensor_decryptor()
+
+    start = time.perf_counter()
+    encrypted = encryptor.encrypt_tensor(column, True)
+    encrypt = time.perf_counter() - start
+
+    # a tensor scalar keeps exact encodings in int64
+    scalar = torch.tensor(3, dtype=column.dtype)
+    start = time.perf_counter()
+    evaluated = encrypted * scalar + encrypted
+    evaluate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decryptor.decrypt_tensor(evaluated)
+    decrypt = time.perf_counter() - start
+    return {
+        "encrypt": encrypt / rows,
+        "evaluate": evaluate / rows,
+        "decrypt": decrypt / rows,
+    }
+
+
+def _machine() -> tuple:
+    """What the timings depend on besides the scheme"""
+    return (
+        platform.machine(),
+        platform.processor(),
+        os.cpu_count(),
+        platform.python_implementation(),
+        platform.python_version(),
+    )
+
+
+class BenchmarkCache:
+    """
+    Timings of the schemes per machine, kept in a file between jobs
+
+    Parameters
+    ----------
+    path : str, optional
+        File of the timings, created if missing; None keeps them in memory
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    self._entries = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                logger.warning(f"Scheme benchmark cache {path} is unreadable, ignored")
+
+    def _key(self, kind: str, key_length: int, encoding: ValueEncoding):
+        return (_machine(), kind, key_length, encoding.kind, BENCHMARK_ROWS)
+
+    def load(self, kind: str, key_length: int, encoding: ValueEncoding):
+        return self._entries.get(self._key(kind, key_length, encoding))
+
+    def save(self, kind: str, key_length: int, encoding: ValueEncoding, timings: dict):
+        self._entries[self._key(kind, key_length, encoding)] = timings
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _atomic_dump(self._entries, self.path)
+
+
+def select_scheme(
+    builder,
+    min_security_bits: int = DEFAULT_MIN_SECURITY_BITS,
+    encoding: ValueEncoding = None,
+    pack: bool = False,
+    cache_path: str = None,
+) -> dict:
+    """
+    Fastest scheme and key length on this machine
+
+    Parameters
+    ----------
+    builder : PHECipherBuilder
+        ``ctx.cipher.phe``, sets up the kits to time
+    min_security_bits : int
+        Security level every candidate key has to reach
+    encoding : ValueEncoding
+        Encoding of the guest values, float by default
+    pack : bool
+        Whether the values are packed; the keys need room for two slots and
+        the cost per value counts the slots of the widest layout
+    cache_path : str, optional
+        File caching the timings between jobs
+
+    Returns
+    -------
+    dict
+        ``kind`` and ``key_length`` for ``ctx.cipher.set_phe``
+
+    Raises
+    ------
+    ValueError
+        If no scheme the FATE configuration allows reaches the security level
+        with the plaintext room needed
+    """
+    encoding = encoding or ValueEncoding()
+    cache = BenchmarkCache(cache_path)
+    eligible = []
+    # Kits set up to check the uncached candidates, timed only if needed
+    kits = {}
+    for kind, key_length in candidates(min_security_bits, encoding, pack):
+        timings = cache.load(kind, key_length, encoding)
+        if timings is not None:
+            negative = timings["negative"]
+        else:
+            try:
+                start = time.perf_counter()
+                kit = builder.setup({"kind": kind, "key_length": key_length})
+                keygen = time.perf_counter() - start
+            except ValueError as e:
+                # disallowed or below the minimum key size of the FATE config
+                logger.info(f"Skipping {kind} {key_length}: {e}")
+                continue
+            kits[(kind, key_length)] = (kit, keygen)
+            negative = kit.can_support_negative_number
+        if not negative:
+            logger.info(f"Skipping {kind}: no support for negative values")
+            continue
+        eligible.append((kind, key_length))
+
+    if len(eligible) == 1:
+        kind, key_length = eligible[0]
+        logger.info(f"Selected {kind} with {key_length} bit keys, the only candidate")
+        return {"kind": kind, "key_length": key_length}
+
+    costs = {}
+    for kind, key_length in eligible:
+        timings = cache.load(kind, key_length, encoding)
+        if timings is None:
+            kit, keygen = kits[(kind, key_length)]
+            try:
+                timings = dict(benchmark_kit(kit, encoding), keygen=keygen)
+            except NotImplementedError as e:
+                timings = {"unsupported": str(e)}
+            timings["negative"] = kit.can_support_negative_number
+            cache.save(kind, key_length, encoding, timings)
+        if "unsupported" in timings:
+            logger.info(f"Skipping {kind}: no {encoding.kind} encoding support")
+            continue
+        per_ciphertext = timings["encrypt"] + timings["evaluate"] + timings["decrypt"]
+        slots = plaintext_bits(kind, key_length) // MAX_SLOT_BITS if pack else 1
+        costs[(kind, key_length)] = per_ciphertext / slots
+        logger.info(
+            f"{kind} {key_length}: encrypt {timings['encrypt'] * 1e6:.0f} us, "
+            f"evaluate {timings['evaluate'] * 1e6:.0f} us, "
+            f"decrypt {timings['decrypt'] * 1e6:.0f} us per ciphertext"
+        )
+    if not costs:
+        raise ValueError(
+            f"No HE scheme reaches {min_security_bits} bits of security "
+            f"for the values with the plaintext room {encoding} needs"
+        )
+    kind, key_length = min(costs, key=costs.get)
+    logger.info(f"Selected {kind} with {key_length} bit keys")
+    return {"kind": kind, "key_length": key_length}
@@ -0,0 +1,94 @@
+"""
+Out-of-Core Storage for Secure Function Component
+
+A ciphertext column takes 8-16 times the memory of its plaintext, and more
+once it is rebuilt as fate_utils big integers. With ``spill_path`` the
+encrypted columns of a message are written to a temporary file in the wire
+format and read back through a memory map, one fixed-size segment of rows
+at a time: the host evaluates the plan and the guest decrypts segment by
+segment, so only one segment of each column is ever decoded, and plan
+intermediates never exist as whole columns. The wire buffers of one message
+still pass through memory: the received message before it is spilled, and
+on the host the encoded results, joined before they are sent. The guest's
+``chunk_size`` bounds both.
+"""
+
+import logging
+import mmap
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Rows decoded at once, a few MB of ciphertexts per column
+DEFAULT_SEGMENT_ROWS = 16384
+
+
+def segment_bounds(num_rows: int, segment_rows: int):
+    """(start, size) of every segment of ``num_rows`` rows"""
+    return [
+        (start, min(segment_rows, num_rows - start))
+        for start in range(0, num_rows, segment_rows)
+    ]
+
+
+class SpillFile:
+    """
+    Append-only temporary file of buffers, read back through a memory map
+
+    Buffers are written first; the first read maps the file and no more
+    buffers can be written. The file is removed on ``close``.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the file, created if missing; it should be on local
+        disk with room for the spilled columns
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(suffix=".spill", dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self._spans = {}
+        self._map = None
+
+    def write(self, key, buf):
+        """Append a buffer under ``key``"""
+        if self._map is not None:
+            raise ValueError("Spill file is read-only once mapped")
+        self._spans[key] = (self._file.tell(), len(buf))
+        self._file.write(buf)
+
+    def keys(self):
+        return self._spans.keys()
+
+    def __getitem__(self, key) -> memoryview:
+        """Read-only view of a buffer; its pages are loaded as they are read"""
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, size = self._spans[key]
+        return memoryview(self._map)[offset : offset + size]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size in self._spans.values())
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a view is still alive, the map goes with it
+                logger.debug(f"Spill file {self.path} is still referenced")
+            self._map = None
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self) -> "SpillFile":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
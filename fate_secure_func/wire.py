@@ -0,0 +1,487 @@
+"""
+Wire Format for Encrypted Columns
+
+Encrypted columns travel between guest and host as one contiguous buffer
+each instead of pickled ``PHETensor`` objects, which repeat the public key
+and coder in every tensor and serialize each ciphertext as its hex digits.
+A column buffer is a fixed header followed by fixed-width little-endian
+64-bit limbs:
+
+    magic "SFCT", version, scheme, dtype, flags, limbs per ciphertext,
+    ndim, key fingerprint (8 bytes), ciphertext count
+    shape                ndim x u64
+    exponents            one i32 if shared by all ciphertexts, else count x i32
+    packed row count     u64, packed columns only
+    packed weight        u64, packed columns only
+    ciphertexts          count x limbs x u64
+
+fate_utils may hold a ciphertext as a negative representative, for instance
+after adding a negative constant; the limbs of such columns are two's
+complement, marked by a flag.
+
+fate_utils serializes a ciphertext vector as the hex digits of every
+ciphertext. Both directions convert all ciphertexts of a column at once
+with numpy, between those digits and a ``count x limbs`` byte matrix; only
+the scan for where each ciphertext's digits start is a Python loop. Slicing
+and joining encoded columns copy just the bytes of the rows involved. Mock
+columns carry their plain values, with their dtype in the exponent slot.
+"""
+
+import struct
+from typing import NamedTuple
+
+import numpy as np
+import torch
+from fate.arch.tensor.phe import PHETensor
+
+from .keystore import key_fingerprint
+from .packing import PackedCiphertext
+
+WIRE_MAGIC = b"SFCT"
+WIRE_VERSION = 1
+
+_HEADER = struct.Struct("<4sBBBBHH8sQ")
+_U64 = struct.Struct("<Q")
+_I32 = struct.Struct("<i")
+# bincode layout of one fate_utils ciphertext: radix, digit count, digits, exponent
+_CT_DIGITS = struct.Struct("<IQ")
+
+_SCHEMES = ["mock", "paillier", "ou"]
+_DTYPES = [torch.float64, torch.float32, torch.int64, torch.int32]
+
+_FLAG_PACKED = 1
+_FLAG_SHARED_EXPONENT = 2
+_FLAG_SIGNED = 4
+
+
+
+class WireFormatError(ValueError):
+    """Raised when a buffer is not an encrypted column of the expected key"""
+
+
+def payload_bytes(payload: dict) -> int:
+    """Size of an encoded dict of columns"""
+    return sum(len(buf) for buf in payload.values())
+
+
+def _scheme_of(data) -> str:
+    module = type(data).__module__
+    if module.startswith("fate_utils."):
+        return module.rsplit(".", 1)[-1]
+    return "mock"
+
+
+def _vector_class(scheme: str):
+    if scheme == "paillier":
+        from fate_utils.paillier import CiphertextVector
+    elif scheme == "ou":
+        from fate_utils.ou import CiphertextVector
+    else:
+        raise WireFormatError(f"No ciphertext vector for scheme {scheme}")
+    return CiphertextVector
+
+
+def _scan_vector(state: bytes):
+    """Radix, first digit and digit count of every ciphertext of a vector state"""
+    (count,) = _U64.unpack_from(state, 0)
+    radices, starts, lengths = [], [], []
+    offset = _U64.size
+    for _ in range(count):
+        radix, length = _CT_DIGITS.unpack_from(state, offset)
+        offset += _CT_DIGITS.size
+        radices.append(radix)
+        starts.append(offset)
+        lengths.append(length)
+        offset += length + _I32.size
+    if offset != len(state):
+        raise WireFormatError("Unexpected fate_utils ciphertext vector layout")
+    return (
+        np.array(radices, dtype=np.int64),
+        np.array(starts, dtype=np.int64),
+        np.array(lengths, dtype=np.int64),
+    )
+
+
+def _negate(limbs: np.ndarray) -> np.ndarray:
+    """Two's complement of rows of little-endian u64 limbs"""
+    # The +1 carries through the low limbs that are zero
+    carry = np.ones(limbs.shape, dtype=np.uint64)
+    carry[:, 1:] = np.cumprod(limbs == 0, axis=1)[:, :-1]
+    return ~limbs + carry
+
+
+def _split_vector(data):
+    """
+    Ciphertexts of a fate_utils ciphertext vector as little-endian limbs
+
+    Returns
+    -------
+    body : np.ndarray
+        ``count x limbs * 8`` bytes, two's complement if ``signed``
+    exponents : np.ndarray
+        int32 exponent of every ciphertext
+    limbs : int
+        u64 limbs per ciphertext
+    signed : bool
+        Whether any ciphertext is a negative representative
+    """
+    state = bytes(data.__getstate__())
+    radices, starts, lengths = _scan_vector(state)
+    raw = np.frombuffer(state, dtype=np.uint8)
+    count = len(starts)
+    ends = starts + lengths
+    windows = np.lib.stride_tricks.sliding_window_view
+    exponents = windows(raw, _I32.size)[ends].view("<i4").ravel()
+
+    negative = raw[starts] == ord("-")
+    digits = lengths - negative
+    # fate_utils writes radix 16, other radixes are converted one by one
+    others = {
+        i: int(state[starts[i] : ends[i]], int(radices[i]))
+        for i in np.flatnonzero(radices != 16)
+    }
+    signed = bool(negative.any()) or any(value < 0 for value in others.values())
+    bits = np.where(radices == 16, 4 * digits, 0)
+    for i, value in others.items():
+        bits[i] = value.bit_length()
+    limbs = max(1, -(-(int(bits.max(initial=0)) + signed) // 64))
+    width = limbs * 8
+
+    # Digit pairs are bytes, counted from the last digit; rows are converted
+    # in groups of equal digit count
+    body = np.zeros((count, width), dtype=np.uint8)
+    hex_rows = radices == 16
+    first = starts + negative
+    for length in np.unique(digits[hex_rows]):
+        rows = np.flatnonzero(hex_rows & (digits == length))
+        text = windows(raw, length)[first[rows]]
+        if length % 2:
+            text = np.pad(text, ((0, 0), (1, 0)), constant_values=ord("0"))
+        big = np.frombuffer(bytes.fromhex(text.tobytes().decode("ascii")), dtype=np.uint8)
+        body[rows, : (length + 1) // 2] = big.reshape(len(rows), -1)[:, ::-1]
+    if negative.any():
+        rows = np.flatnonzero(negative)
+        body[rows] = _negate(body[rows].view("<u8")).view(np.uint8)
+    for i, value in others.items():
+        body[i] = np.frombuffer(value.to_bytes(width, "little", signed=signed), np.uint8)
+    return body, exponents, limbs, signed
+
+
+def _join_vector(
+    scheme: str, body, count: int, limbs: int, exponents, signed: bool = False
+):
+    """Rebuild a fate_utils ciphertext vector from its limbs"""
+    width = limbs * 8
+    cts = np.frombuffer(body, dtype=np.uint8).reshape(count, width)
+    negative = np.zeros(count, dtype=bool)
+    if signed:
+        negative = cts[:, -1] >= 0x80
+        if negative.any():
+            cts = cts.copy()
+            cts[negative] = _negate(cts[negative].view("<u8")).view(np.uint8)
+    # Fixed-width records: the digits keep their leading zeros, and signed
+    # columns get a sign character, "-" or a leading "0"
+    num_digits = 2 * width + signed
+    records = np.empty(
+        count,
+        dtype=[
+            ("radix", "<u4"),
+            ("length", "<u8"),
+            ("digits", np.uint8, (num_digits,)),
+            ("exponent", "<i4"),
+        ],
+    )
+    records["radix"] = 16
+    records["length"] = num_digits
+    text = np.ascontiguousarray(cts[:, ::-1]).tobytes().hex().encode("ascii")
+    digits = records["digits"]
+    digits[:, signed:] = np.frombuffer(text, dtype=np.uint8).reshape(count, 2 * width)
+    if signed:
+        digits[:, 0] = np.where(negative, ord("-"), ord("0"))
+    records["exponent"] = exponents
+    cls = _vector_class(scheme)
+    data = cls.__new__(cls)
+    data.__setstate__(_U64.pack(count) + records.tobytes())
+    return data
+
+
+class WireCodec:
+    """
+    Encodes and decodes dicts of encrypted columns for one encryption kit
+
+    Parameters
+    ----------
+    pk, evaluator, coder
+        Raw cipher objects of the kit, received columns are rebuilt on them
+    device
+        Device of the rebuilt tensors
+    layout : PackLayout, optional
+        Slot layout of packed columns
+    """
+
+    def __init__(self, pk, evaluator, coder, device, layout=None):
+        self.pk = pk
+        self.evaluator = evaluator
+        self.coder = coder
+        self.device = device
+        self.layout = layout
+        self.fingerprint = key_fingerprint(pk)
+        self._fingerprint_bytes = bytes.fromhex(self.fingerprint)
+
+    def encode(self, columns: dict) -> dict:
+        """Encode a dict of PHETensor/PackedCiphertext into a dict of buffers"""
+        return {key: self.encode_column(tensor) for key, tensor in columns.items()}
+
+    def decode(self, payload: dict) -> dict:
+        """Rebuild the columns of a dict of buffers"""
+        return {key: self.decode_column(buf) for key, buf in payload.items()}
+
+    def encode_column(self, tensor) -> bytes:
+        flags = 0
+        packed = b""
+        if isinstance(tensor, PackedCiphertext):
+            flags |= _FLAG_PACKED
+            packed = _U64.pack(tensor.num_rows) + _U64.pack(tensor.weight)
+            data, shape, dtype = tensor.data, (tensor.num_ciphertexts,), torch.int64
+        else:
+            data, shape, dtype = tensor.data, tuple(tensor.shape), tensor.dtype
+        scheme = _scheme_of(data)
+
+        if scheme == "mock":
+            plain = data.data.detach().contiguous()
+            body = plain.numpy().tobytes()
+            count, limbs = plain.numel(), 1
+            exponents = [_DTYPES.index(plain.dtype)]
+        else:
+            body, exponents, limbs, signed = _split_vector(data)
+            count = len(exponents)
+            if signed:
+                flags |= _FLAG_SIGNED
+
+        return self._write(scheme, dtype, flags, limbs, shape, count, exponents, packed, body)
+
+    def decode_column(self, buf):
+        return self.decode_rows(buf)
+
+    def _read_header(self, buf) -> "_Column":
+        view = memoryview(buf)
+        try:
+            magic, version, scheme, dtype, flags, limbs, ndim, fingerprint, count = (
+                _HEADER.unpack_from(view, 0)
+            )
+        except struct.error as e:
+            raise WireFormatError(f"Truncated column header: {e}") from e
+        if magic != WIRE_MAGIC or version != WIRE_VERSION:
+            raise WireFormatError(f"Not a version {WIRE_VERSION} encrypted column")
+        if fingerprint != self._fingerprint_bytes:
+            raise WireFormatError(
+                f"Column encrypted under key {fingerprint.hex()}, expected {self.fingerprint}"
+            )
+        offset = _HEADER.size
+        shape = struct.unpack_from(f"<{ndim}Q", view, offset)
+        offset += 8 * ndim
+        num_exponents = 1 if flags & _FLAG_SHARED_EXPONENT else count
+        exponents = np.frombuffer(view, dtype="<i4", count=num_exponents, offset=offset)
+        offset += 4 * num_exponents
+        num_rows, weight = shape[0] if shape else count, 1
+        if flags & _FLAG_PACKED:
+            num_rows, weight = struct.unpack_from("<QQ", view, offset)
+            offset += 16
+
+        scheme = _SCHEMES[scheme]
+        if scheme == "mock":
+            width = _DTYPES[exponents[0]].itemsize
+        else:
+            width = limbs * 8
+        if len(view) - offset != count * width:
+            raise WireFormatError("Column body does not match its header")
+        return _Column(
+            scheme, _DTYPES[dtype], flags, limbs, shape, count, exponents,
+            num_rows, weight, view[offset:], width,
+        )
+
+    def num_rows(self, buf) -> int:
+        """Rows of an encoded column, read from its header"""
+        return self._read_header(buf).num_rows
+
+    def num_ciphertexts(self, buf) -> int:
+        """Ciphertexts of an encoded column, read from its header"""
+        return self._read_header(buf).count
+
+    def decode_rows(self, buf, start: int = 0, size: int = None):
+        """
+        Rebuild rows ``start:start + size`` of an encoded column, all by default
+
+        Only the bytes of these rows are read, so ``buf`` may be a memory map
+        of a much larger column. Packed columns are cut between ciphertexts,
+        ``start`` must then be a multiple of ``layout.pack_num``.
+        """
+        column = self._read_header(buf)
+        if size is None:
+            size = column.num_rows - start
+        first, count = self._row_span(column, start, size)
+        body = column.body[first * column.width : (first + count) * column.width]
+
+        if column.scheme == "mock":
+            from fate.arch.protocol.phe.mock import EV
+
+            plain_dtype = _DTYPES[int(column.exponents[0])]
+            # a private copy, torch cannot wrap a read-only buffer
+            data = EV(torch.frombuffer(bytearray(body), dtype=plain_dtype))
+        else:
+            exponents = column.exponents
+            data = _join_vector(
+                column.scheme,
+                body,
+                count,
+                column.limbs,
+                exponents if len(exponents) == 1 else exponents[first : first + count],
+                signed=bool(column.flags & _FLAG_SIGNED),
+            )
+
+        if column.flags & _FLAG_PACKED:
+            return PackedCiphertext(
+                self.pk, self.evaluator, self.coder, self.layout, data, size, column.weight
+            )
+        shape = (size, *column.shape[1:]) if column.shape else column.shape
+        return PHETensor(
+            self.pk, self.evaluator, self.coder, torch.Size(shape), data, column.dtype, self.device
+        )
+
+    def concat_columns(self, buffers: list) -> bytes:
+        """
+        Join encoded columns into one, row after row, without decoding them
+
+        Ciphertexts are widened to the widest limb count of the parts, one
+        more for unsigned parts when another part is signed. Every packed
+        part but the last must fill its ciphertexts.
+        """
+        columns = [self._read_header(buf) for buf in buffers]
+        first = columns[0]
+        for column in columns[1:]:
+            if (column.scheme, column.dtype, column.flags & _FLAG_PACKED, column.weight) != (
+                first.scheme, first.dtype, first.flags & _FLAG_PACKED, first.weight
+            ) or column.shape[1:] != first.shape[1:]:
+                raise WireFormatError("Only columns of the same kind can be joined")
+        count = sum(column.count for column in columns)
+        num_rows = sum(column.num_rows for column in columns)
+
+        signed = any(column.flags & _FLAG_SIGNED for column in columns)
+        if first.scheme == "mock":
+            limbs = first.limbs
+            body = b"".join(column.body for column in columns)
+        else:
+            limbs = max(
+                column.limbs + (signed and not column.flags & _FLAG_SIGNED)
+                for column in columns
+            )
+            parts = []
+            for column in columns:
+                cts = np.frombuffer(column.body, dtype=np.uint8).reshape(column.count, column.width)
+                # Little-endian limbs, widening pads the high end with zeros,
+                # or with ones for negative two's complement values
+                high = np.zeros((column.count, (limbs - column.limbs) * 8), dtype=np.uint8)
+                if column.flags & _FLAG_SIGNED:
+                    high[cts[:, -1] >= 0x80] = 0xFF
+                parts.append(np.concatenate([cts, high], axis=1))
+            body = np.concatenate(parts).tobytes()
+
+        flags = (first.flags & _FLAG_PACKED) | (_FLAG_SIGNED if signed else 0)
+        if first.scheme == "mock":
+            # the plain dtype
+            exponents = first.exponents
+        else:
+            exponents = np.concatenate(
+                [np.broadcast_to(column.exponents, column.count) for column in columns]
+            )
+        shape = (num_rows, *first.shape[1:]) if not flags & _FLAG_PACKED else (count,)
+        packed = _U64.pack(num_rows) + _U64.pack(first.weight) if flags & _FLAG_PACKED else b""
+        return self._write(
+            first.scheme, first.dtype, flags, limbs, shape, count, exponents, packed, body
+        )
+
+    def slice_column(self, buf, start: int, size: int) -> bytes:
+        """
+        Rows ``start:start + size`` of an encoded column, still encoded
+
+        Only the header and the bytes of these rows are copied. Packed
+        columns are cut between ciphertexts like in ``decode_rows``.
+        """
+        column = self._read_header(buf)
+        first, count = self._row_span(column, start, size)
+        flags = column.flags & ~_FLAG_SHARED_EXPONENT
+        if column.flags & _FLAG_PACKED:
+            shape = (count,)
+            packed = _U64.pack(size) + _U64.pack(column.weight)
+        else:
+            shape = (size, *column.shape[1:]) if column.shape else column.shape
+            packed = b""
+        exponents = column.exponents
+        if len(exponents) > 1:
+            exponents = exponents[first : first + count]
+        body = column.body[first * column.width : (first + count) * column.width]
+        return self._write(
+            column.scheme, column.dtype, flags, column.limbs, shape, count,
+            exponents, packed, body,
+        )
+
+    def _write(
+        self, scheme: str, dtype, flags: int, limbs: int, shape, count: int,
+        exponents, packed: bytes, body,
+    ) -> bytes:
+        """Header and body of an encoded column, mock exponents hold the dtype"""
+        exponents = np.asarray(exponents, dtype="<i4")
+        if not exponents.size or (exponents == exponents[0]).all():
+            flags |= _FLAG_SHARED_EXPONENT
+            exponents = exponents[:1] if exponents.size else np.zeros(1, dtype="<i4")
+        header = _HEADER.pack(
+            WIRE_MAGIC,
+            WIRE_VERSION,
+            _SCHEMES.index(scheme),
+            _DTYPES.index(dtype),
+            flags,
+            limbs,
+            len(shape),
+            self._fingerprint_bytes,
+            count,
+        )
+        return b"".join(
+            [
+                header,
+                struct.pack(f"<{len(shape)}Q", *shape),
+                exponents.tobytes(),
+                packed,
+                body,
+            ]
+        )
+
+    def _row_span(self, column: "_Column", start: int, size: int):
+        """First ciphertext and ciphertext count of rows ``start:start + size``"""
+        if column.flags & _FLAG_PACKED:
+            pack_num = self.layout.pack_num
+            if start % pack_num:
+                raise WireFormatError(f"Packed rows start {start} is not a multiple of {pack_num}")
+            first, count = start // pack_num, -(-size // pack_num)
+        else:
+            # Ciphertexts per row of a multi-dimensional column
+            stride = column.count // column.num_rows if column.num_rows else 1
+            first, count = start * stride, size * stride
+        if first + count > column.count:
+            raise WireFormatError(f"Rows {start}:{start + size} are past the end of the column")
+        return first, count
+
+
+class _Column(NamedTuple):
+    """Parsed header of an encoded column, ``body`` views its ciphertexts"""
+
+    scheme: str
+    dtype: torch.dtype
+    flags: int
+    limbs: int
+    shape: tuple
+    count: int
+    exponents: np.ndarray
+    num_rows: int
+    weight: int
+    body: memoryview
+    width: int
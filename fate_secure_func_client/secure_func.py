@@ -23,8 +23,51 @@ class SecureFunc(Component):
         Input values (from guest)
     formula : object
         Formula/coefficients (from host)
+    batch_values : list
+        More values tables (from guest), each run as a batch
     he_param : dict
-        Homomorphic encryption parameters
+        Homomorphic encryption parameters, kind "auto" picks the scheme
+    encrypt_mode : str
+        "local" or "partition", where the guest encrypts its values
+    chunk_size : int
+        Rows per streamed chunk in "local" mode, 0 for a single message
+    pack : bool
+        Pack several guest values into one plaintext (paillier/ou)
+    pack_headroom_bits : int
+        Bits reserved per packed slot for the formulas' growth
+    decrypt_partitions : int
+        Partitions decrypting results in "local" mode, 0 for the values' own
+    obfuscation_pool : int
+        Obfuscators precomputed before encryption, 0 to disable
+    obfuscation_pool_path : str
+        File keeping unused obfuscators between jobs
+    keystore_path : str
+        Directory caching keys between jobs
+    key_max_age : int
+        Seconds a cached guest key stays in use
+    key_max_uses : int
+        Jobs a cached guest key serves
+    metrics_trace_path : str
+        File the per-phase metrics are also written to
+    incremental_path : str
+        Directory keeping state between jobs to send only changed rows
+    encoding : str
+        Plaintext encoding of guest values ("float", "integer" or "fixed_point")
+    encoding_precision : int
+        Decimal digits kept by "fixed_point" encoding
+    formula_type : str
+        Host input type ("expression" or "matrix")
+    eval_partitions : int
+        Partitions evaluating the plan in "local" mode, 0 for the guest
+        values' own
+    spill_path : str
+        Directory encrypted columns are spilled to in "local" mode
+    checkpoint_path : str
+        Directory keeping completed chunks so that a retry resumes
+    he_benchmark_path : str
+        File caching the scheme timings of kind "auto"
+    batch_column : str
+        Column splitting the values tables into batches
 
     Examples
     --------
@@ -53,7 +96,28 @@ class SecureFunc(Component):
         runtime_parties: dict = None,
         values: object = PlaceHolder(),
         formula: object = PlaceHolder(),
+        batch_values: list = PlaceHolder(),
         he_param: dict = PlaceHolder(),
+        encrypt_mode: str = PlaceHolder(),
+        chunk_size: int = PlaceHolder(),
+        pack: bool = PlaceHolder(),
+        pack_headroom_bits: int = PlaceHolder(),
+        decrypt_partitions: int = PlaceHolder(),
+        obfuscation_pool: int = PlaceHolder(),
+        obfuscation_pool_path: str = PlaceHolder(),
+        keystore_path: str = PlaceHolder(),
+        key_max_age: int = PlaceHolder(),
+        key_max_uses: int = PlaceHolder(),
+        metrics_trace_path: str = PlaceHolder(),
+        incremental_path: str = PlaceHolder(),
+        encoding: str = PlaceHolder(),
+        encoding_precision: int = PlaceHolder(),
+        formula_type: str = PlaceHolder(),
+        eval_partitions: int = PlaceHolder(),
+        spill_path: str = PlaceHolder(),
+        checkpoint_path: str = PlaceHolder(),
+        he_benchmark_path: str = PlaceHolder(),
+        batch_column: str = PlaceHolder(),
     ):
         inputs = locals()
         self._process_init_inputs(inputs)
@@ -62,4 +126,25 @@ class SecureFunc(Component):
         self.runtime_parties = runtime_parties
         self.values = values
         self.formula = formula
+        self.batch_values = batch_values
         self.he_param = he_param
+        self.encrypt_mode = encrypt_mode
+        self.chunk_size = chunk_size
+        self.pack = pack
+        self.pack_headroom_bits = pack_headroom_bits
+        self.decrypt_partitions = decrypt_partitions
+        self.obfuscation_pool = obfuscation_pool
+        self.obfuscation_pool_path = obfuscation_pool_path
+        self.keystore_path = keystore_path
+        self.key_max_age = key_max_age
+        self.key_max_uses = key_max_uses
+        self.metrics_trace_path = metrics_trace_path
+        self.incremental_path = incremental_path
+        self.encoding = encoding
+        self.encoding_precision = encoding_precision
+        self.formula_type = formula_type
+        self.eval_partitions = eval_partitions
+        self.spill_path = spill_path
+        self.checkpoint_path = checkpoint_path
+        self.he_benchmark_path = he_benchmark_path
+        self.batch_column = batch_column
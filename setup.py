@@ -28,7 +28,7 @@ setup(
     author_email="iotsp@example.com",
     url="https://github.com/iotsp/fate-secure-func",
     license="MIT",
-    packages=find_packages(exclude=["examples", "examples.*"]),
+    packages=find_packages(exclude=["examples", "examples.*", "tests", "tests.*"]),
     # Include non-Python files
     include_package_data=True,
     package_data={
@@ -0,0 +1,100 @@
+"""
+Tests for the checkpoints of "local" mode jobs
+
+Chunk files hold real wire-encoded Paillier columns, which must decrypt
+after being read back; the resume actions are checked per chunk.
+"""
+
+import os
+import stat
+
+import pandas as pd
+import pytest
+import torch
+from fate.arch.context._cipher import PHECipherBuilder
+from fate.arch.unify import device
+
+from fate_secure_func.checkpoint import (
+    GuestCheckpoint,
+    HostCheckpoint,
+    checkpoint_digest,
+    checkpoint_keys,
+    resume_actions,
+)
+from fate_secure_func.keystore import key_fingerprint
+from fate_secure_func.wire import WireCodec
+
+
+@pytest.fixture(scope="module")
+def kit():
+    return PHECipherBuilder(None, "paillier", 1024).setup()
+
+
+def encrypted_payload(kit, values):
+    codec = WireCodec(kit.pk, kit.evaluator, kit.coder, device.CPU)
+    column = kit.get_tensor_encryptor().encrypt_tensor(values, obfuscate=False)
+    return codec, codec.encode({"x": column})
+
+
+@pytest.mark.parametrize(
+    "decrypted, kept, aggregates, expected",
+    [
+        (set(), set(), False, ["evaluate"] * 3),
+        ({0, 1}, set(), False, ["skip", "skip", "evaluate"]),
+        ({0, 1}, set(), True, ["evaluate", "evaluate", "evaluate"]),
+        ({0}, {0, 1}, True, ["skip", "resend", "evaluate"]),
+        (set(), {2}, False, ["evaluate", "evaluate", "resend"]),
+    ],
+)
+def test_resume_actions(decrypted, kept, aggregates, expected):
+    assert resume_actions(decrypted, kept, aggregates, 3) == expected
+
+
+def test_digest_follows_the_inputs():
+    df = pd.DataFrame({"id": ["a", "b"], "x": [1.0, 2.0]})
+    digest = checkpoint_digest(df, ["x"], 100)
+    assert digest == checkpoint_digest(df.copy(), ["x"], 100)
+    assert digest != checkpoint_digest(df, ["x"], 50)
+    assert digest != checkpoint_digest(df.assign(x=[1.0, 3.0]), ["x"], 100)
+
+
+def test_guest_checkpoint(kit, tmp_path):
+    values = torch.tensor([1.5, -2.0, 3.25])
+    codec, payload = encrypted_payload(kit, values)
+    fingerprint = key_fingerprint(kit.pk)
+    checkpoint = GuestCheckpoint(str(tmp_path), fingerprint, "digest")
+    assert stat.S_IMODE(os.stat(checkpoint.path).st_mode) == 0o700
+
+    assert checkpoint.load_values(0) is None
+    checkpoint.save_values(0, payload)
+    checkpoint.save_decrypted(1, 0, "formulas", {"f": [1.0]})
+    # A retry opens the same job's files again
+    retried = GuestCheckpoint(str(tmp_path), fingerprint, "digest")
+    decoded = codec.decode(retried.load_values(0))["x"]
+    assert torch.equal(kit.get_tensor_decryptor().decrypt_tensor(decoded), values.double())
+    assert retried.decrypted(3, ["formulas", "changed"]) == [{1}, set()]
+    assert retried.load_decrypted(1, 0, "formulas") == {"f": [1.0]}
+
+    retried.clear()
+    assert not os.path.exists(checkpoint.path)
+
+
+def test_host_checkpoint(kit, tmp_path):
+    values = torch.tensor([4.0, 5.0])
+    codec, payload = encrypted_payload(kit, values)
+    checkpoint = HostCheckpoint(str(tmp_path), key_fingerprint(kit.pk), "digest")
+    checkpoint.save(1, payload, {"total": payload})
+    assert checkpoint.chunks(3) == [1]
+    result, aggregates = checkpoint.load(1)
+    decoded = codec.decode(aggregates["total"])["x"]
+    assert torch.equal(kit.get_tensor_decryptor().decrypt_tensor(decoded), values.double())
+    assert HostCheckpoint(str(tmp_path), key_fingerprint(kit.pk), "other").chunks(3) == []
+
+
+def test_checkpoint_keys_keep_the_kit(kit, tmp_path):
+    keys = checkpoint_keys(str(tmp_path))
+    keys.save("scope", kit)
+    loaded = checkpoint_keys(str(tmp_path)).load("scope")
+    assert key_fingerprint(loaded.pk) == key_fingerprint(kit.pk)
+    encrypted = kit.get_tensor_encryptor().encrypt_tensor(torch.tensor([7.0]), obfuscate=False)
+    assert loaded.get_tensor_decryptor().decrypt_tensor(encrypted).tolist() == [7.0]
@@ -0,0 +1,121 @@
+"""
+Tests for the plaintext encodings
+
+Exactly encoded columns are encrypted with the real fate_utils Paillier
+coder, run through encoded formula plans and decoded, and must match the
+formulas evaluated on the plain values exactly.
+"""
+
+import numpy as np
+import pytest
+import torch
+from fate.arch.protocol.phe import paillier
+from fate.arch.tensor.phe import PHETensorCipher
+
+from fate_secure_func.encoding import EncodingError, ValueEncoding, encode_plan
+from fate_secure_func.formula import compile_formulas
+
+KEY_SIZE = 1024
+
+VALUES = {
+    "x": np.array([1.25, -0.5, 7.01, 0.0, -9.99]),
+    "y": np.array([0.01, 2.5, -3.0, 4.75, 6.2]),
+}
+
+
+@pytest.fixture(scope="module")
+def cipher():
+    sk, pk, coder = paillier.keygen(KEY_SIZE)
+    return PHETensorCipher.from_raw_cipher(pk, coder, sk, paillier.evaluator)
+
+
+def test_float_encoding_is_unchanged():
+    encoding = ValueEncoding()
+    assert not encoding.exact
+    assert encoding.meta(100.0, "paillier", KEY_SIZE) is None
+    decoded = encoding.decode(np.array([1.5, -2.0], dtype=np.float32))
+    assert decoded.dtype == np.float64
+
+
+def test_integer_encoding():
+    encoding = ValueEncoding("integer", precision=3)
+    assert encoding.precision == 0
+    encoded = encoding.encode(np.array([3.0, -5.0, 0.0]))
+    assert encoded.dtype == torch.int64
+    assert encoded.tolist() == [3, -5, 0]
+    with pytest.raises(EncodingError, match="integral"):
+        encoding.encode(np.array([1.5]))
+
+
+def test_fixed_point_encoding():
+    encoding = ValueEncoding("fixed_point", precision=2)
+    encoded = encoding.encode(VALUES["x"])
+    assert encoded.tolist() == [125, -50, 701, 0, -999]
+    assert encoding.decode(encoded.numpy()) == pytest.approx(VALUES["x"])
+    # Packed results come back as integral floats
+    assert encoding.decode(np.array([125.0, -50.0])) == pytest.approx([1.25, -0.5])
+
+
+def test_invalid_encodings():
+    with pytest.raises(ValueError, match="Unknown encoding"):
+        ValueEncoding("decimal")
+    with pytest.raises(ValueError, match=">= 0"):
+        ValueEncoding("fixed_point", precision=-1)
+
+
+def test_meta_bounds_values():
+    encoding = ValueEncoding("fixed_point", precision=4)
+    meta = encoding.meta(1000.0, "paillier", KEY_SIZE)
+    assert meta == {"kind": "fixed_point", "precision": 4, "int_bits": 24, "max_bits": 63}
+    with pytest.raises(EncodingError, match="bits"):
+        encoding.meta(1e16, "paillier", KEY_SIZE)
+
+
+def test_encode_plan_rejects_inexact_formulas():
+    meta = ValueEncoding("fixed_point", precision=2).meta(10.0, "paillier", KEY_SIZE)
+    with pytest.raises(EncodingError, match="non-integer"):
+        encode_plan(compile_formulas([("f", "0.5*x")]), meta)
+    with pytest.raises(EncodingError, match="decimals"):
+        encode_plan(compile_formulas([("f", "x + 0.001")]), meta)
+    with pytest.raises(EncodingError, match="overflow"):
+        encode_plan(compile_formulas([("f", f"{2**60}*x")]), meta)
+
+
+def test_aggregates_bound_all_rows():
+    meta = ValueEncoding("integer").meta(2.0**30, "paillier", KEY_SIZE)
+    plan = compile_formulas([("f", "sum(x)")])
+    encode_plan(plan, meta, num_rows=100)
+    with pytest.raises(EncodingError, match="overflow"):
+        encode_plan(plan, meta, num_rows=2**40)
+
+
+@pytest.mark.parametrize(
+    "encoding",
+    [ValueEncoding("integer"), ValueEncoding("fixed_point", precision=2)],
+    ids=["integer", "fixed_point"],
+)
+def test_encrypted_plan_is_exact(cipher, encoding):
+    values = VALUES
+    if encoding.kind == "integer":
+        values = {col: np.round(vals * 10) for col, vals in VALUES.items()}
+    formulas = [("a", "3*x - y + 2"), ("b", "-x - 2*y"), ("c", "y - 1.5")]
+    if encoding.kind == "integer":
+        formulas[2] = ("c", "y - 15")
+    max_abs = max(float(np.abs(vals).max()) for vals in values.values())
+    meta = encoding.meta(max_abs, "paillier", KEY_SIZE)
+    plan = encode_plan(compile_formulas(formulas), meta, num_rows=5)
+
+    en_vals = {
+        col: cipher.pk.encrypt_tensor(encoding.encode(vals), obfuscate=False)
+        for col, vals in values.items()
+    }
+    results = plan.evaluate(en_vals)
+    for idx, text in formulas:
+        decrypted = cipher.sk.decrypt_tensor(results[plan.outputs[idx]])
+        assert decrypted.dtype == torch.int64
+        decoded = encoding.decode(decrypted.numpy())
+        expected = eval(text, {}, dict(values))
+        if encoding.kind == "integer":
+            assert np.array_equal(decoded, expected)
+        else:
+            assert decoded == pytest.approx(expected)
@@ -0,0 +1,170 @@
+"""
+Tests for the formula compiler
+
+Plans are run on plain numbers, which support the same operators as the
+encrypted columns, and compared with evaluating the formula text directly.
+"""
+
+import pytest
+
+from fate_secure_func.formula import (
+    FormulaError,
+    _PlanBuilder,
+    addition_chain,
+    compile_formulas,
+    parse_formula,
+)
+
+ROWS = [
+    {"x": 0.0, "y": 0.0, "z": 0.0},
+    {"x": 1.0, "y": -2.0, "z": 3.5},
+    {"x": -4.25, "y": 7.0, "z": -1.0},
+    {"x": 1e6, "y": -3e-3, "z": 12.0},
+]
+
+
+def run_plan(plan, row: dict) -> dict:
+    """Formula id -> value of a plan on one row"""
+    results = plan.evaluate(row)
+    return {idx: results[key] for idx, key in plan.outputs.items()}
+
+
+def assert_matches_direct(formulas):
+    plan = compile_formulas(formulas)
+    for row in ROWS:
+        results = run_plan(plan, row)
+        for idx, text in formulas:
+            expected = eval(text, {}, dict(row))
+            assert results[idx] == pytest.approx(expected), (idx, text, row)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "x",
+        "x + y",
+        "2*x - 3*y + 1",
+        "-x",
+        "-2*x + 5",
+        "-x - y - z",
+        "0*x + y",
+        "x - x + y",
+        "3*(x - 0.5) / 2",
+        "x/4 - 0.25*y",
+        "1 - 2*y",
+        "(x + y) * 2 - (y - z) * 3",
+        "1.5*x + 2.0*x",
+    ],
+)
+def test_single_formula_matches_direct_evaluation(text):
+    assert_matches_direct([("f", text)])
+
+
+def test_shared_subexpressions_are_computed_once():
+    formulas = [
+        ("a", "2*x + y"),
+        ("b", "y + 2*x"),
+        ("c", "2*x + y + 1"),
+        ("d", "2*x - z"),
+        ("e", "y + x*2"),
+    ]
+    plan = compile_formulas(formulas)
+    assert plan.outputs["a"] == plan.outputs["b"] == plan.outputs["e"]
+    assert len(plan.result_keys) == 3
+    assert len(set(plan.steps)) == len(plan.steps)
+    # x, y, z, 2*x, 2*x + y, 2*x + y + 1 and 2*x - z
+    assert len(plan.steps) == 7
+    assert_matches_direct(formulas)
+
+
+def test_negative_coefficients_become_subtractions():
+    formulas = [("a", "x - 3*y"), ("b", "-5*z + 2"), ("c", "-x - 1")]
+    plan = compile_formulas(formulas)
+    assert all(args[1] > 0 for op, args in plan.steps if op == "mul")
+    assert any(op == "sub" for op, _ in plan.steps)
+    assert any(op == "rsub_const" for op, _ in plan.steps)
+    assert_matches_direct(formulas)
+
+
+def test_zero_coefficients_are_dropped():
+    assert parse_formula("0*x + y").coefs == {"y": 1}
+    plan = compile_formulas([("f", "0*x + 2*y")])
+    assert plan.columns == ["y"]
+
+
+@pytest.mark.parametrize("text", ["0*x + 3", "x - x", "5"])
+def test_formula_without_columns_is_rejected(text):
+    with pytest.raises(FormulaError):
+        compile_formulas([("f", text)])
+
+
+@pytest.mark.parametrize("text", ["x*y", "1/x", "x +", "x $ y"])
+def test_invalid_formula_is_rejected(text):
+    with pytest.raises(FormulaError):
+        compile_formulas([("f", text)])
+
+
+def test_integer_multiples_use_addition_chains():
+    formulas = [(f"m{c}", f"{c}*x") for c in (3, 5, 6, 7, 12, 13)] + [("n", "-7*x + y")]
+    plan = compile_formulas(formulas)
+    assert not any(op == "mul" for op, _ in plan.steps)
+    assert_matches_direct(formulas)
+
+
+def test_large_multiples_build_each_link_once():
+    formulas = [("f", f"{2**60}*x"), ("g", f"{2**60 + 3}*x - y")]
+    plan = compile_formulas(formulas)
+    assert len(plan.steps) < 200
+    assert_matches_direct(formulas)
+
+
+@pytest.mark.parametrize(
+    "coefs", [[2], [3, 5, 7], [6, 12, 24], [13, 17, 100], [1, 1023, 1024]]
+)
+def test_addition_chain_builds_every_coefficient(coefs):
+    known = {1}
+    for c, a, b in addition_chain(coefs):
+        assert c == a + b
+        assert a in known and b in known
+        known.add(c)
+    assert set(coefs) <= known
+
+
+def test_addition_chain_reuses_results():
+    chain = addition_chain([4, 8])
+    assert [c for c, _, _ in chain] == [2, 4, 8]
+
+
+def test_plan_builder_hash_conses_steps():
+    builder = _PlanBuilder()
+    x = builder.emit("col", "x")
+    y = builder.emit("col", "y")
+    assert builder.emit("col", "x") == x
+    assert builder.emit("add", (x, y)) == builder.emit("add", (y, x))
+    assert builder.emit("sub", (x, y)) != builder.emit("sub", (y, x))
+    assert builder.scaled("x", 1) == x
+    assert len(builder.steps) == 5
+
+
+def test_aggregates_share_identical_reductions():
+    plan = compile_formulas(
+        [
+            ("s1", "sum(x + y)"),
+            ("s2", "sum(y + x)"),
+            ("m", "mean(x + y) by z"),
+            ("r", "x + y"),
+        ]
+    )
+    assert plan.outputs["s1"] == plan.outputs["s2"]
+    assert plan.is_aggregate("s1") and plan.is_aggregate("m")
+    assert not plan.is_aggregate("r")
+    assert len(plan.aggregates) == 2
+    # The aggregates reduce the step of the row formula
+    assert {step for _, _, step in plan.aggregates.values()} == {plan.outputs["r"]}
+    assert plan.groups == [None, "z"]
+
+
+def test_unknown_columns_are_reported():
+    plan = compile_formulas([("f", "x + w")])
+    with pytest.raises(ValueError, match="w"):
+        plan.evaluate({"x": 1.0})
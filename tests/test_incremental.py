@@ -0,0 +1,125 @@
+"""
+Tests for incremental encryption
+
+Slot assignments are checked across jobs with new, modified and deleted
+rows; stored columns are real Paillier ciphertexts patched with a delta and
+kept in the wire format.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from fate.arch.context._cipher import PHECipherBuilder
+from fate.arch.unify import device
+
+from fate_secure_func.incremental import (
+    GuestRowCache,
+    HostCiphertextStore,
+    SlotAssignment,
+    apply_delta,
+    reusable_layout,
+    row_hashes,
+)
+from fate_secure_func.keystore import key_fingerprint
+from fate_secure_func.packing import PackLayout, Packer
+from fate_secure_func.wire import WireCodec
+
+IDS = ["a", "b", "c", "d", "e"]
+
+
+@pytest.fixture(scope="module")
+def kit():
+    return PHECipherBuilder(None, "paillier", 1024).setup()
+
+
+def encrypt(kit, values):
+    return kit.get_tensor_encryptor().encrypt_tensor(torch.tensor(values), obfuscate=False)
+
+
+def decrypt(kit, column):
+    return kit.get_tensor_decryptor().decrypt_tensor(column).tolist()
+
+
+def test_first_job_sends_every_unit():
+    slots = SlotAssignment(IDS, np.arange(5), pack_num=2)
+    assert slots.row_slots.tolist() == [0, 1, 2, 3, 4]
+    assert slots.num_units == 3
+    assert slots.units.tolist() == [0, 1, 2]
+    assert slots.unit_values(np.arange(5.0) + 10).tolist() == [10, 11, 12, 13, 14, 0]
+
+
+def test_changed_rows_reuse_slots():
+    previous = SlotAssignment(IDS, np.arange(5), pack_num=2).state()
+    # b deleted, c modified, f and g new
+    ids = ["a", "c", "d", "e", "f", "g"]
+    hashes = np.array([0, 99, 3, 4, 5, 6])
+    slots = SlotAssignment(ids, hashes, pack_num=2, previous=previous)
+    assert slots.row_slots.tolist() == [0, 2, 3, 4, 1, 5]
+    assert slots.num_slots == 6
+    # f takes b's slot in unit 0, c is in unit 1, g opens slot 5 of unit 2
+    assert slots.units.tolist() == [0, 1, 2]
+    assert slots.unit_values(np.arange(6.0)).tolist() == [0, 4, 1, 2, 3, 5]
+
+    unchanged = SlotAssignment(ids, hashes, pack_num=2, previous=slots.state())
+    assert unchanged.units.tolist() == []
+
+
+def test_ids_must_be_unique():
+    with pytest.raises(ValueError, match="unique"):
+        SlotAssignment(["a", "a"], np.arange(2))
+
+
+def test_row_hashes_follow_the_columns():
+    df = pd.DataFrame({"x": [1.0, 2.0], "y": [3.0, 4.0]})
+    hashes = row_hashes(df, ["x"])
+    assert np.array_equal(hashes, row_hashes(df.assign(y=[0.0, 0.0]), ["x"]))
+    assert hashes[1] != row_hashes(df.assign(x=[1.0, 5.0]), ["x"])[1]
+
+
+def test_reusable_layout():
+    cached = PackLayout(precision=16, int_bits=8, headroom_bits=8, pack_num=20)
+    assert reusable_layout(cached, PackLayout(16, 4, 8, pack_num=30))
+    assert not reusable_layout(cached, PackLayout(16, 10, 8, pack_num=18))
+    assert not reusable_layout(cached, PackLayout(12, 4, 8, pack_num=30))
+    assert not reusable_layout(None, cached)
+
+
+def test_apply_delta(kit):
+    stored = encrypt(kit, [0.0, 1.0, 2.0, 3.0])
+    # Units 1 and 2 replaced, units 4 and 5 appended
+    delta = encrypt(kit, [10.0, 20.0, 40.0, 50.0])
+    patched = apply_delta(stored, delta, np.array([1, 2, 4, 5]), 6)
+    assert patched.shape[0] == 6
+    assert decrypt(kit, patched) == [0.0, 10.0, 20.0, 3.0, 40.0, 50.0]
+    assert apply_delta(stored, None, np.array([], dtype=np.int64), 4) is stored
+    assert decrypt(kit, apply_delta(None, stored, np.arange(4), 4)) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_apply_delta_to_packed_columns(kit):
+    layout = PackLayout(precision=16, int_bits=4, headroom_bits=8, pack_num=2)
+    packer = Packer(kit.pk, kit.evaluator, kit.coder, layout)
+    stored = packer.encrypt(torch.tensor([1.0, 2.0, 3.0, 4.0]))
+    patched = apply_delta(stored, packer.encrypt(torch.tensor([5.0, 6.0])), np.array([1]), 2)
+    assert packer.decrypt(kit.sk, patched).tolist() == [1.0, 2.0, 5.0, 6.0]
+
+
+def test_host_store_keeps_wire_columns(kit, tmp_path):
+    fingerprint = key_fingerprint(kit.pk)
+    codec = WireCodec(kit.pk, kit.evaluator, kit.coder, device.CPU)
+    store = HostCiphertextStore(str(tmp_path))
+    assert store.token(fingerprint, ["x"]) is None
+    store.save(fingerprint, "job-1", {"x": encrypt(kit, [1.5, -2.5])}, codec)
+    assert store.token(fingerprint, ["x"]) == "job-1"
+    assert store.token(fingerprint, ["x", "y"]) is None
+    assert decrypt(kit, store.load(fingerprint, codec)["x"]) == [1.5, -2.5]
+
+
+def test_guest_row_cache(tmp_path):
+    cache = GuestRowCache(str(tmp_path / "rows"))
+    assert cache.load("key") is None
+    state = SlotAssignment(IDS, np.arange(5)).state()
+    cache.save("key", {"token": "job-1", "slots": state})
+    entry = GuestRowCache(str(tmp_path / "rows")).load("key")
+    assert entry["token"] == "job-1"
+    assert entry["slots"]["ids"].tolist() == IDS
@@ -0,0 +1,86 @@
+"""
+Tests for the key store
+
+The guest store keeps real Paillier kits set up by FATE's cipher builder,
+which must still decrypt after being reloaded, until they expire by age or
+by use.
+"""
+
+import os
+import stat
+
+import pytest
+import torch
+from fate.arch.context._cipher import PHECipherBuilder
+
+from fate_secure_func import keystore
+from fate_secure_func.keystore import GuestKeyStore, HostKeyCache, key_fingerprint
+
+
+@pytest.fixture(scope="module")
+def kit():
+    return PHECipherBuilder(None, "paillier", 1024).setup()
+
+
+def test_scope_ignores_host_order():
+    scope = GuestKeyStore.scope(9999, [10000, 10001], "paillier", 1024)
+    assert scope == GuestKeyStore.scope(9999, ["10001", "10000"], "paillier", 1024)
+    assert scope != GuestKeyStore.scope(9999, [10000, 10001], "paillier", 2048)
+    assert scope != GuestKeyStore.scope(9999, [10000], "paillier", 1024)
+
+
+def test_reloaded_kit_decrypts(kit, tmp_path):
+    store = GuestKeyStore(str(tmp_path / "keys"))
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o700
+    assert store.load("scope") is None
+    store.save("scope", kit)
+    assert stat.S_IMODE(os.stat(store._file("scope")).st_mode) == 0o600
+
+    loaded = store.load("scope")
+    assert key_fingerprint(loaded.pk) == key_fingerprint(kit.pk)
+    encrypted = kit.get_tensor_encryptor().encrypt_tensor(torch.tensor([2.5]), obfuscate=False)
+    assert loaded.get_tensor_decryptor().decrypt_tensor(encrypted).tolist() == [2.5]
+
+
+def test_kit_expires_after_max_uses(kit, tmp_path):
+    store = GuestKeyStore(str(tmp_path), max_uses=3)
+    store.save("scope", kit)
+    # The job that generated the kit counts as the first use
+    assert store.load("scope") is not None
+    assert store.load("scope") is not None
+    assert store.load("scope") is None
+    assert not os.path.exists(store._file("scope"))
+
+
+def test_kit_expires_after_max_age(kit, tmp_path, monkeypatch):
+    store = GuestKeyStore(str(tmp_path), max_age=60)
+    store.save("scope", kit)
+    now = keystore.time.time()
+    monkeypatch.setattr(keystore.time, "time", lambda: now + 30)
+    assert store.load("scope") is not None
+    monkeypatch.setattr(keystore.time, "time", lambda: now + 61)
+    assert store.load("scope") is None
+    assert not os.path.exists(store._file("scope"))
+
+
+def test_no_limits_keep_the_kit(kit, tmp_path, monkeypatch):
+    store = GuestKeyStore(str(tmp_path))
+    store.save("scope", kit)
+    now = keystore.time.time()
+    monkeypatch.setattr(keystore.time, "time", lambda: now + 10**8)
+    for _ in range(5):
+        assert store.load("scope") is not None
+
+
+def test_host_key_cache(kit, tmp_path):
+    cache = HostKeyCache(str(tmp_path))
+    fingerprint = key_fingerprint(kit.pk)
+    assert cache.get(fingerprint) is None
+    cache.put(fingerprint, (kit.pk, kit.evaluator, kit.coder))
+    pk, _, _ = cache.get(fingerprint)
+    assert key_fingerprint(pk) == fingerprint
+
+    # An entry that does not match its fingerprint is dropped
+    os.rename(cache._file(fingerprint), cache._file("0" * 16))
+    assert cache.get("0" * 16) is None
+    assert not os.path.exists(cache._file("0" * 16))
@@ -0,0 +1,165 @@
+"""
+Tests for plaintext packing
+
+Columns are packed, encrypted and run through the host's operations with the
+real fate_utils Paillier and OU coders, then unpacked and compared with the
+same operations on the plain values.
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from fate.arch.protocol.phe import ou, paillier
+
+from fate_secure_func.encoding import ValueEncoding, encode_plan
+from fate_secure_func.formula import compile_formulas
+from fate_secure_func.packing import (
+    MAX_SLOT_BITS,
+    PackLayout,
+    Packer,
+    check_plan_packable,
+    make_layout,
+)
+
+KEY_SIZE = 1024
+
+X = torch.tensor([1.5, -2.25, 3.0, -4.0, 5.5, 0.0, 7.125])
+Y = torch.tensor([0.5, 1.0, -3.0, 2.0, -1.0, 4.0, -2.5])
+
+
+@pytest.fixture(scope="module", params=["paillier", "ou"])
+def kit(request):
+    module = paillier if request.param == "paillier" else ou
+    sk, pk, coder = module.keygen(KEY_SIZE)
+    return request.param, sk, pk, coder, module.evaluator
+
+
+def make_packer(kit, layout):
+    _, _, pk, coder, evaluator = kit
+    return Packer(pk, evaluator, coder, layout)
+
+
+def small_layout(kit, precision=16):
+    """A layout with few slots per plaintext, so the columns span several"""
+    kind = kit[0]
+    layout = make_layout(8.0, kind, KEY_SIZE, headroom_bits=8, precision=precision)
+    layout.pack_num = 3
+    return layout
+
+
+def test_round_trip(kit):
+    packer = make_packer(kit, small_layout(kit))
+    decrypted = packer.decrypt(kit[1], packer.encrypt(X))
+    assert torch.equal(decrypted, X.to(torch.float64))
+
+
+def test_round_trip_with_full_plaintexts(kit):
+    layout = make_layout(8.0, kit[0], KEY_SIZE, headroom_bits=8)
+    assert layout.pack_num >= 2
+    packer = make_packer(kit, layout)
+    column = torch.linspace(-8, 8, layout.pack_num * 2 + 1)
+    decrypted = packer.decrypt(kit[1], packer.encrypt(column, obfuscate=True))
+    assert decrypted == pytest.approx(column.to(torch.float64), abs=2**-16)
+
+
+@pytest.mark.parametrize(
+    "op",
+    [
+        lambda x, y: x + y,
+        lambda x, y: x - y,
+        lambda x, y: 3 * x - y + 1.5,
+        lambda x, y: 2 - x * 2 - y,
+        lambda x, y: 0 - x - 0.25,
+        lambda x, y: x * -4 + y * 2,
+    ],
+)
+def test_host_operations_match_plaintext(kit, op):
+    packer = make_packer(kit, small_layout(kit))
+    result = op(packer.encrypt(X), packer.encrypt(Y)).normalize()
+    expected = op(X.to(torch.float64), Y.to(torch.float64))
+    assert torch.equal(packer.decrypt(kit[1], result), expected)
+
+
+def test_exact_integer_slots(kit):
+    packer = make_packer(kit, PackLayout(0, 4, 8, pack_num=3))
+    column = torch.tensor([3, -5, 7, 0, -1], dtype=torch.int64)
+    result = (packer.encrypt(column) * -3 + 4).normalize()
+    decrypted = packer.decrypt(kit[1], result)
+    assert decrypted.dtype == torch.int64
+    assert torch.equal(decrypted, column * -3 + 4)
+
+
+@pytest.mark.parametrize(
+    "encoding, values",
+    [
+        (ValueEncoding("integer"), {"x": [3, -5, 7, 0, -1], "y": [1, 2, -3, 4, 6]}),
+        (
+            ValueEncoding("fixed_point", precision=2),
+            {"x": [1.25, -0.5, 7.01, 0.0, -9.99], "y": [0.01, 2.5, -3.0, 4.75, 6.2]},
+        ),
+    ],
+)
+def test_exact_encodings_with_packing(kit, encoding, values):
+    formulas = [("a", "3*x - y + 2"), ("b", "-x - 2*y"), ("c", "y - 1.5")]
+    if encoding.kind == "integer":
+        formulas[2] = ("c", "y - 15")
+    columns = {col: np.array(vals, dtype=np.float64) for col, vals in values.items()}
+    max_abs = max(float(np.abs(col).max()) for col in columns.values())
+
+    # As the guest: slots without fractional bits for the encoded integers
+    layout = make_layout(
+        max_abs * encoding.scale, kit[0], KEY_SIZE, headroom_bits=8, precision=0
+    )
+    layout.pack_num = 3
+    packer = make_packer(kit, layout)
+    meta = encoding.meta(max_abs, kit[0], KEY_SIZE)
+    en_vals = {
+        col: packer.encrypt(encoding.encode(col_values)) for col, col_values in columns.items()
+    }
+
+    # As the host
+    plan = encode_plan(compile_formulas(formulas), meta, packed=True)
+    check_plan_packable(plan, layout)
+    results = plan.evaluate(en_vals)
+
+    for idx, text in formulas:
+        packed = results[plan.outputs[idx]].normalize()
+        decrypted = encoding.decode(packer.decrypt(kit[1], packed).numpy())
+        expected = eval(text, {}, dict(columns))
+        if encoding.kind == "integer":
+            assert decrypted.dtype == np.int64
+            assert np.array_equal(decrypted, expected)
+        else:
+            assert decrypted == pytest.approx(expected)
+
+
+def test_non_integer_coefficients_are_rejected(kit):
+    packed = make_packer(kit, small_layout(kit)).encrypt(X)
+    with pytest.raises(ValueError):
+        packed * 0.5
+
+
+def test_layout_meta_round_trip():
+    layout = PackLayout(precision=16, int_bits=4, headroom_bits=8, pack_num=35)
+    meta = layout.meta()
+    assert all(type(value) is int for value in meta.values())
+    rebuilt = PackLayout.from_meta(meta)
+    assert rebuilt.meta() == meta
+    assert rebuilt.slot_bits == layout.slot_bits == 29
+
+
+def test_layout_limits():
+    assert make_layout(2.0**40, "paillier", KEY_SIZE, headroom_bits=8) is None
+    layout = make_layout(100.0, "paillier", KEY_SIZE, headroom_bits=8)
+    assert layout.slot_bits <= MAX_SLOT_BITS
+    assert make_layout(100.0, "ou", 64, headroom_bits=8) is None
+
+
+def test_plan_packability():
+    layout = PackLayout(precision=16, int_bits=4, headroom_bits=8, pack_num=35)
+    check_plan_packable(compile_formulas([("f", "3*x - y + 2")]), layout)
+    with pytest.raises(ValueError, match="non-integer"):
+        check_plan_packable(compile_formulas([("f", "0.5*x")]), layout)
+    with pytest.raises(ValueError, match="headroom"):
+        check_plan_packable(compile_formulas([("f", "1000*x")]), layout)
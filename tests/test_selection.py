@@ -0,0 +1,78 @@
+"""
+Tests for the "auto" scheme selection
+
+Kits are set up with FATE's own cipher builder and timed with the real
+fate_utils coders; the timings cache lives in a temporary directory.
+"""
+
+import pytest
+from fate.arch.context._cipher import PHECipherBuilder
+
+from fate_secure_func.encoding import ValueEncoding
+from fate_secure_func.selection import (
+    BenchmarkCache,
+    benchmark_kit,
+    candidates,
+    security_bits,
+    select_scheme,
+)
+
+FLOAT = ValueEncoding()
+
+
+@pytest.fixture
+def builder():
+    return PHECipherBuilder(None, "paillier", 1024)
+
+
+def test_security_bits():
+    assert security_bits(512) == 0
+    assert security_bits(1024) == 80
+    assert security_bits(2048) == 112
+    assert security_bits(4096) == 128
+    assert security_bits(7680) == 192
+
+
+def test_candidates_take_the_shortest_key():
+    assert candidates(80, FLOAT, False) == [("paillier", 1024), ("ou", 1024)]
+    assert candidates(112, ValueEncoding("integer"), True) == [("paillier", 2048), ("ou", 2048)]
+    assert candidates(128, FLOAT, False) == [("paillier", 3072), ("ou", 3072)]
+    assert candidates(300, FLOAT, False) == []
+
+
+def test_only_candidate_is_not_timed(builder, tmp_path):
+    # OU has no negative plaintexts, paillier remains
+    path = str(tmp_path / "timings")
+    assert select_scheme(builder, 80, cache_path=path) == {"kind": "paillier", "key_length": 1024}
+    assert BenchmarkCache(path).load("paillier", 1024, FLOAT) is None
+
+
+def test_timings_are_cached(builder, tmp_path):
+    path = str(tmp_path / "timings")
+    # A cheaper candidate taken from the cache; paillier is timed and stored
+    fast = {"encrypt": 0.0, "evaluate": 0.0, "decrypt": 0.0, "negative": True}
+    BenchmarkCache(path).save("ou", 1024, FLOAT, fast)
+    assert select_scheme(builder, 80, cache_path=path) == {"kind": "ou", "key_length": 1024}
+
+    timings = BenchmarkCache(path).load("paillier", 1024, FLOAT)
+    assert timings["negative"]
+    assert all(timings[phase] > 0 for phase in ("encrypt", "evaluate", "decrypt", "keygen"))
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / "timings"
+    path.write_bytes(b"not a pickle")
+    assert BenchmarkCache(str(path)).load("paillier", 1024, FLOAT) is None
+
+
+def test_benchmark_kit(builder):
+    kit = builder.setup()
+    for encoding in (FLOAT, ValueEncoding("integer")):
+        timings = benchmark_kit(kit, encoding, rows=16)
+        assert set(timings) == {"encrypt", "evaluate", "decrypt"}
+        assert all(value > 0 for value in timings.values())
+
+
+def test_no_scheme_reaches_the_security_level(builder):
+    with pytest.raises(ValueError, match="No HE scheme"):
+        select_scheme(builder, 300)